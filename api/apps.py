@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from api import replica, sqlite
+
+        connection_created.connect(sqlite.configure_connection)
+        request_started.connect(sqlite.close_replaced_connections)
+        # After close_replaced_connections, so the catalogue version is read from the current file.
+        request_started.connect(replica.refresh_replica)
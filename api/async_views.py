@@ -0,0 +1,90 @@
+"""Async read path for the API
+
+Served over ASGI, the sync viewsets run in a new thread per request: a burst
+of slow queries starts as many threads and database connections as there
+are requests in flight, and every request opens its own connection.
+
+The views under `/api/async/` are coroutines that run the list and retrieve
+handlers of the same viewsets on a shared pool of `API_ASYNC_DB_THREADS`
+threads. The event loop never waits on the database, at most that many
+queries run at once while further requests queue, and every pool thread
+keeps its database connection between requests (see `CONN_MAX_AGE`).
+Responses are rendered on the pool thread as well.
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import path
+
+from api import replica, sqlite
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Returns the thread pool running the handlers of the async views.
+
+    :returns: The ThreadPoolExecutor, created on first use.
+    """
+    global _executor
+
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.API_ASYNC_DB_THREADS, thread_name_prefix='api-db')
+    return _executor
+
+
+def _run(view, request, *args, **kwargs):
+    """Runs a sync view on a pool thread, doing the connection upkeep of a sync request."""
+    close_old_connections()
+    sqlite.close_replaced_connections()
+    replica.refresh_replica()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        # request_finished closes the connections of the handler thread only.
+        close_old_connections()
+
+
+def async_view(view):
+    """Wraps a sync view into a coroutine running it on the database thread pool.
+
+    :param view: The sync view function.
+    :returns: The async view function.
+    """
+
+    async def wrapper(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            get_executor(), functools.partial(_run, view, request, *args, **kwargs))
+
+    wrapper.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return wrapper
+
+
+def get_async_urls(router) -> list:
+    """Builds the async list and detail routes of every viewset of a router.
+
+    :param router: The DRF router with the registered viewsets.
+    :returns: List of URL patterns, named `async-<basename>-list` and `async-<basename>-detail`.
+    """
+    urls = []
+    for prefix, viewset, basename in router.registry:
+        list_view = viewset.as_view({'get': 'list'}, basename=basename, detail=False)
+        detail_view = viewset.as_view({'get': 'retrieve'}, basename=basename, detail=True)
+        urls += [
+            path(f"async/{prefix}/", async_view(list_view), name=f"async-{basename}-list"),
+            path(f"async/{prefix}/<str:pk>/", async_view(detail_view), name=f"async-{basename}-detail"),
+        ]
+    return urls
@@ -0,0 +1,326 @@
+"""In-memory bitmap index for filtering books
+
+Combining the relation filters of the book list (`languages`,
+`has_bookshelf`, `has_subject`, `has_agent_type`, `has_resource_type`) joins
+a through table per filter. The bitmap index answers these filters from
+process memory instead.
+
+Every book gets a position in the default order of the list (most
+downloaded first). The index keeps, for every language, bookshelf, subject,
+agent type, resource type and book type, the positions of its books: as a
+sorted array when the value is rare and as a bitmap (a Python int) when it
+is common. A filter combination is the AND of their bitmaps, and a
+`downloads_range` is a contiguous range of positions. Only the books of the
+requested page are then read from the database, by primary key.
+
+The index is built on first use and rebuilt when the catalogue version
+changes. The `API_BITMAP_FILTERS` setting turns it on. Requests it cannot
+answer, such as searches or other orderings, are served with SQL as before.
+"""
+
+import threading
+from array import array
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import F
+from django_filters import utils
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.exceptions import NotFound
+
+from api import catalogue, models
+from api.pagination import KeysetPagination
+
+# Filters of the book list answered by the index, and their dimension.
+DIMENSIONS = {
+    'type': 'types',
+    'languages': 'languages',
+    'has_bookshelf': 'bookshelves',
+    'has_subject': 'subjects',
+    'has_agent_type': 'agent_types',
+    'has_resource_type': 'resource_types',
+}
+DOWNLOADS_FILTER = 'downloads_range'
+
+# Query parameters that do not stop the index from answering a request.
+PASSTHROUGH_PARAMS = ('cursor', 'page_size', 'count', 'ordering', 'format', 'rank',
+                      'fields', 'exclude', 'expand', 'facets', 'facet_limit')
+
+# The keyset of the default book order, as built by KeysetPagination.
+INDEX_ORDERING = [('downloads', True, True), ('pk', True, False)]
+
+_index = None
+_lock = threading.Lock()
+
+
+def _iter_after(bitmap: int, start: int):
+    """Yields the set bits of a bitmap from position `start` upwards."""
+    bitmap >>= start
+    while bitmap:
+        lowest = bitmap & -bitmap
+        yield start + lowest.bit_length() - 1
+        bitmap ^= lowest
+
+
+def _iter_before(bitmap: int, stop: int):
+    """Yields the set bits of a bitmap below position `stop`, downwards."""
+    bitmap &= (1 << stop) - 1
+    while bitmap:
+        position = bitmap.bit_length() - 1
+        yield position
+        bitmap ^= 1 << position
+
+
+class BitmapIndex:
+    """The positions of the books of every filter value.
+
+    :param rows: Iterable of (id, downloads) tuples in the default book order.
+    """
+
+    def __init__(self, rows):
+        self.ids = array('q')
+        self.downloads = []
+        for id, downloads in rows:
+            self.ids.append(id)
+            self.downloads.append(downloads)
+        self.size = len(self.ids)
+        self.positions = {id: position for position, id in enumerate(self.ids)}
+        # Books without downloads come last, so the rest are sorted descending.
+        self.ranked = sum(1 for downloads in self.downloads if downloads is not None)
+        self.postings = {dimension: {} for dimension in DIMENSIONS.values()}
+
+    @classmethod
+    def build(cls, using: str = 'default') -> 'BitmapIndex':
+        """Reads the index from the catalogue tables.
+
+        :param using: The database alias.
+        :returns: The BitmapIndex.
+        """
+        Book = models.Book
+        books = Book.objects.using(using).order_by(F('downloads').desc(nulls_last=True), '-id')
+        index = cls(books.values_list('id', 'downloads').iterator(chunk_size=5000))
+
+        index.add('types', books.values_list('id', 'type').iterator(chunk_size=5000))
+        for dimension, through, value in (
+                ('languages', Book.languages.through, 'language_id'),
+                ('bookshelves', Book.bookshelves.through, 'bookshelf__name'),
+                ('subjects', Book.subjects.through, 'subject__name'),
+                ('agent_types', Book.agents.through, 'agent__type_id'),
+                ('resource_types', Book.resources.through, 'resource__type')):
+            rows = through.objects.using(using).values_list('book_id', value)
+            index.add(dimension, rows.iterator(chunk_size=5000))
+        return index
+
+    def add(self, dimension: str, rows) -> None:
+        """Adds the values of one dimension.
+
+        :param dimension: The dimension name.
+        :param rows: Iterable of (book id, value) tuples. NULL values are skipped.
+        :returns: None
+        """
+        grouped = {}
+        for id, value in rows:
+            position = self.positions.get(id)
+            if value is not None and position is not None:
+                grouped.setdefault(value, set()).add(position)
+
+        postings = self.postings[dimension]
+        for value, positions in grouped.items():
+            postings[value] = self.compress(positions)
+
+    def compress(self, positions):
+        """Stores a set of positions as a sorted array if that is smaller than a bitmap."""
+        if len(positions) * 32 < self.size:
+            return array('l', sorted(positions))
+        return self.to_bitmap(positions)
+
+    def to_bitmap(self, positions) -> int:
+        """Returns a bitmap with the bits of the given positions set."""
+        if isinstance(positions, int):
+            return positions
+        bits = bytearray((self.size + 7) // 8)
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bits, 'little')
+
+    def downloads_mask(self, low, high) -> int:
+        """Returns the bitmap of the books with `low <= downloads <= high`."""
+        # The first position with downloads <= high, then the first with downloads < low.
+        start = self._bisect(0, self.ranked, lambda position: self.downloads[position] <= high)
+        stop = self._bisect(start, self.ranked, lambda position: self.downloads[position] < low)
+        return ((1 << stop) - 1) ^ ((1 << start) - 1)
+
+    def select(self, criteria: dict, downloads=None) -> int:
+        """Returns the bitmap of the books matching every criterion.
+
+        :param criteria: Dict mapping dimension names to a value.
+        :param downloads: Optional (low, high) tuple of inclusive download bounds.
+        :returns: The bitmap.
+        """
+        bitmap = (1 << self.size) - 1
+        for dimension, value in criteria.items():
+            posting = self.postings[dimension].get(value)
+            if posting is None:
+                return 0
+            bitmap &= self.to_bitmap(posting)
+        if downloads is not None:
+            bitmap &= self.downloads_mask(*downloads)
+        return bitmap
+
+    def key(self, position: int) -> list:
+        """Returns the keyset values of the book at a position."""
+        return [self.downloads[position], self.ids[position]]
+
+    def _bisect(self, low: int, high: int, after) -> int:
+        """Returns the first position in [low, high) for which `after` is true, `after` being monotonic."""
+        while low < high:
+            middle = (low + high) // 2
+            if after(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _sort_key(self, downloads, id) -> tuple:
+        return (downloads is None, -(downloads or 0), -id)
+
+    def page(self, bitmap: int, values, reverse: bool, limit: int) -> list:
+        """Returns the positions of up to `limit` books of a bitmap after a cursor.
+
+        :param bitmap: The selected books.
+        :param values: The (downloads, id) keyset values of the cursor, None for the first page.
+        :param reverse: Return the books before the cursor instead, last one first.
+        :param limit: The number of positions.
+        :returns: List of positions.
+        """
+        if not values:
+            positions = _iter_after(bitmap, 0)
+        else:
+            cursor = self._sort_key(*values)
+            if reverse:
+                stop = self._bisect(0, self.size, lambda position: self._sort_key(*self.key(position)) >= cursor)
+                positions = _iter_before(bitmap, stop)
+            else:
+                start = self._bisect(0, self.size, lambda position: self._sort_key(*self.key(position)) > cursor)
+                positions = _iter_after(bitmap, start)
+
+        page = []
+        for position in positions:
+            page.append(position)
+            if len(page) == limit:
+                break
+        return page
+
+
+def get_index() -> BitmapIndex:
+    """Returns the index of the current catalogue, building it if needed.
+
+    :returns: The BitmapIndex.
+    """
+    global _index
+
+    version = catalogue.get_version()
+    if _index is None or _index[0] != version:
+        with _lock:
+            if _index is None or _index[0] != version:
+                _index = (version, BitmapIndex.build())
+    return _index[1]
+
+
+def invalidate() -> None:
+    """Forgets the index kept in memory.
+
+    :returns: None
+    """
+    global _index
+    _index = None
+
+
+class Selection(namedtuple('Selection', ('index', 'bitmap', 'queryset'))):
+    """The books matched by the index, and the unfiltered queryset to read them with."""
+
+    def count(self) -> int:
+        return bin(self.bitmap).count('1')
+
+    def fetch(self, positions) -> list:
+        """Reads the books at the given positions, in that order.
+
+        :param positions: List of positions.
+        :returns: List of rows of the queryset. Books deleted since the index was built are skipped.
+        """
+        ids = [self.index.ids[position] for position in positions]
+        rows = {}
+        for row in self.queryset.filter(pk__in=ids):
+            rows[row['id'] if isinstance(row, dict) else row.pk] = row
+        return [rows[id] for id in ids if id in rows]
+
+
+class BitmapFilterBackend(DjangoFilterBackend):
+    """Filter backend that also resolves the filters with the bitmap index when it can.
+
+    The SQL filtered queryset is still returned, for everything but the
+    list pages. Those are served by `BitmapKeysetPagination` from the
+    selection left on the view as `bitmap_selection`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        view.bitmap_selection = None
+        filterset = self.get_filterset(request, queryset, view)
+        if filterset is None:
+            return queryset
+
+        if not filterset.is_valid() and self.raise_exception:
+            raise utils.translate_validation(filterset.errors)
+
+        if settings.API_BITMAP_FILTERS and self.is_indexed(request, filterset.form.cleaned_data):
+            view.bitmap_selection = self.select(queryset, filterset.form.cleaned_data)
+        return filterset.qs
+
+    def is_indexed(self, request, data: dict) -> bool:
+        """Whether the index can answer the filters of a request."""
+        for param in request.query_params:
+            if param not in PASSTHROUGH_PARAMS and param not in DIMENSIONS and not (
+                    param.startswith(DOWNLOADS_FILTER + '_')):
+                return False
+        # With a single bound, NumericRangeFilter matches by prefix rather than by range.
+        downloads = data.get(DOWNLOADS_FILTER)
+        return not downloads or (downloads.start is not None and downloads.stop is not None)
+
+    def select(self, queryset, data: dict) -> Selection:
+        criteria = {}
+        for name, dimension in DIMENSIONS.items():
+            value = data.get(name)
+            if value not in (None, ''):
+                criteria[dimension] = value.pk if isinstance(value, models.Language) else value
+
+        downloads = data.get(DOWNLOADS_FILTER)
+        if downloads:
+            downloads = (downloads.start, downloads.stop)
+
+        index = get_index()
+        return Selection(index, index.select(criteria, downloads or None), queryset)
+
+
+class BitmapKeysetPagination(KeysetPagination):
+    """Keyset pagination reading the pages of a bitmap selection from the index."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.selection = getattr(view, 'bitmap_selection', None)
+        return super().paginate_queryset(queryset, request, view)
+
+    def uses_index(self) -> bool:
+        return self.selection is not None and self.ordering == INDEX_ORDERING
+
+    def count_rows(self, queryset) -> int:
+        if self.uses_index():
+            return self.selection.count()
+        return super().count_rows(queryset)
+
+    def fetch_rows(self, queryset, values, reverse: bool) -> list:
+        if not self.uses_index():
+            return super().fetch_rows(queryset, values, reverse)
+        try:
+            positions = self.selection.index.page(self.selection.bitmap, values, reverse, self.page_size + 1)
+        except TypeError:
+            raise NotFound(self.invalid_cursor_message)
+        return self.selection.fetch(positions)
@@ -0,0 +1,83 @@
+"""Bulk lookups by id
+
+`BulkLookupMixin` adds a `bulk` action to a viewset, which returns many
+items in one streamed response. The items are fetched in chunks with the
+queryset and serializer of the viewset, so a chunk costs the same queries
+as a single page of the list.
+"""
+
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+
+from api.renderers import DocumentJSONRenderer
+
+CHUNK_SIZE = 500
+
+
+def parse_ids(request, limit: int) -> list:
+    """Reads the requested ids from `?ids=1,2,3` or a `{"ids": [1, 2, 3]}` body.
+
+    :param request: The DRF request.
+    :param limit: The maximum number of ids.
+    :returns: The unique ids, in the requested order.
+    """
+    if request.method == 'POST':
+        ids = request.data.get('ids') if isinstance(request.data, dict) else request.data
+        if not isinstance(ids, list):
+            raise ValidationError({'ids': ["Expected a list of ids."]})
+    else:
+        ids = [id for id in request.query_params.get('ids', '').split(',') if id.strip()]
+
+    try:
+        ids = list(dict.fromkeys(int(id) for id in ids))
+    except (TypeError, ValueError):
+        raise ValidationError({'ids': ["Ids must be integers."]})
+
+    if not ids:
+        raise ValidationError({'ids': ["No ids given."]})
+    if len(ids) > limit:
+        raise ValidationError({'ids': [f"At most {limit} ids can be looked up at once."]})
+    return ids
+
+
+class BulkLookupMixin:
+    """Viewset mixin adding `bulk`, which looks up many items by id in one request."""
+
+    @action(detail=False, methods=['get', 'post'])
+    def bulk(self, request):
+        """
+        Look up many items at once, with `?ids=1,2,3` or a POST body of `{"ids": [1, 2, 3]}`.
+        The items are returned in the requested order and the ids that do not exist are listed in `missing`.
+        """
+        ids = parse_ids(request, settings.API_BULK_MAX_IDS)
+        return StreamingHttpResponse(self.stream_items(ids), content_type='application/json')
+
+    def get_item_id(self, item):
+        return item['id'] if isinstance(item, dict) else item.pk
+
+    def stream_items(self, ids):
+        """Yields the JSON of the bulk response, one chunk of items at a time.
+
+        :param ids: The requested ids.
+        :returns: Iterator of bytes.
+        """
+        renderer = DocumentJSONRenderer()
+        queryset = self.get_queryset()
+        missing = []
+        separator = b''
+
+        yield b'{"results":['
+        for i in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[i:i + CHUNK_SIZE]
+            found = {self.get_item_id(item): item for item in queryset.filter(pk__in=chunk)}
+            items = [found[id] for id in chunk if id in found]
+            missing.extend(id for id in chunk if id not in found)
+
+            for data in self.get_serializer(items, many=True).data:
+                yield separator + renderer.render(data)
+                separator = b','
+        yield b'],"missing":' + json.dumps(missing).encode('utf-8') + b'}'
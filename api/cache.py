@@ -0,0 +1,78 @@
+"""Response cache for the read-only API
+
+List and detail responses are cached in the cache named by the
+`API_RESPONSE_CACHE` setting, keyed on the catalogue version and the
+normalized request. Bumping the catalogue version makes every cached
+response unreachable, so nothing has to be deleted after an import.
+Responses carry an ETag and Last-Modified derived from the catalogue version,
+and conditional requests are answered with a 304 before any query runs.
+"""
+
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from api import catalogue
+
+
+def get_cache_key(request, version: int) -> str:
+    """Builds the cache key of a request.
+
+    The query string is sorted so that the order of the parameters does not
+    matter. The host and renderer are part of the key as the responses embed
+    absolute links and differ per format.
+
+    :param request: The DRF request.
+    :param version: The catalogue version number.
+    :returns: The cache key.
+    """
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    accepted = request.accepted_renderer.format if request.accepted_renderer else ''
+    raw = '\n'.join((request.get_host(), request.path, query, accepted))
+    return f"api:{version}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+class CachedResponseMixin:
+    """Viewset mixin that caches list and retrieve responses."""
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        """Serves a response from the cache or stores the one `handler` builds.
+
+        :param handler: The view handler to call on a cache miss.
+        :param request: The DRF request.
+        :returns: The response.
+        """
+        if settings.API_RESPONSE_CACHE is None:
+            return handler(request, *args, **kwargs)
+
+        version = catalogue.get_version()
+        etag = f'W/"catalogue-{version.number}"'
+        last_modified = int(version.updated.timestamp()) if version.updated else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            cache = caches[settings.API_RESPONSE_CACHE]
+            key = get_cache_key(request, version.number)
+            data = cache.get(key)
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response.data)
+            else:
+                response = Response(data)
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
@@ -0,0 +1,66 @@
+"""Catalogue version tracking
+
+The catalogue only changes when it is imported with `load_db`, which bumps
+the version stored in the `Catalogue` table.
+Readers get the version through `get_version`, which keeps it in process
+memory for `CATALOGUE_VERSION_TTL` seconds so that most requests can be
+validated without touching the database.
+"""
+
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api import models
+
+CatalogueVersion = namedtuple('CatalogueVersion', ('number', 'updated'))
+
+_version = None
+_checked_at = 0.0
+
+
+def get_version() -> CatalogueVersion:
+    """Returns the current catalogue version.
+
+    :returns: The CatalogueVersion. The number is 0 if nothing was imported yet.
+    """
+    global _version, _checked_at
+
+    now = time.monotonic()
+    if _version is None or now - _checked_at > settings.CATALOGUE_VERSION_TTL:
+        row = models.Catalogue.objects.filter(pk=1).values_list('version', 'updated').first()
+        _version = CatalogueVersion(*row) if row else CatalogueVersion(0, None)
+        _checked_at = now
+    return _version
+
+
+def bump_version(using: str = 'default') -> CatalogueVersion:
+    """Increments the catalogue version after the catalogue has changed.
+
+    :param using: The database alias.
+    :returns: The new CatalogueVersion.
+    """
+    global _version, _checked_at
+
+    with transaction.atomic(using=using):
+        catalogue, _ = models.Catalogue.objects.using(using).get_or_create(pk=1)
+        models.Catalogue.objects.using(using).filter(pk=1).update(
+            version=F('version') + 1, updated=timezone.now())
+        catalogue.refresh_from_db()
+
+    _version = CatalogueVersion(catalogue.version, catalogue.updated)
+    _checked_at = time.monotonic()
+    return _version
+
+
+def invalidate() -> None:
+    """Forgets the version kept in memory so the next read hits the database.
+
+    :returns: None
+    """
+    global _version
+    _version = None
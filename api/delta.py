@@ -0,0 +1,343 @@
+"""Delta imports between two catalogue snapshots
+
+A snapshot is a database generated by `scripts/books_db.py`.
+Every book of a snapshot gets a content hash over its own fields and the
+natural values of its relations (names, urls, ...), never over the row ids,
+which change whenever books_db rebuilds the catalogue.
+Comparing the hashes of two snapshots gives the books that were added,
+changed or removed, and only those are written to the Django database.
+
+Download counts change daily for nearly every book, so they are left out of
+the hash and copied with one `bulk_update` instead of replacing the books.
+"""
+
+import hashlib
+import re
+import sqlite3
+from collections import defaultdict, namedtuple
+from datetime import datetime
+
+import pytz
+from django.db import connections, transaction
+from django.db.models import Max, Q
+
+from api import models
+
+Delta = namedtuple('Delta', ('added', 'changed', 'removed'))
+
+BOOK_QUERY = "SELECT id, format, title, description, license, downloads FROM Book{where}"
+
+DOWNLOADS_QUERY = "SELECT id, downloads FROM Book"
+
+# Natural values of the relations, keyed by book. Sorted so that the hash does not depend on row order.
+RELATION_QUERIES = {
+    'agents': """
+        SELECT ba.book, a.type, p.name, p.alias, p.birth_date, p.death_date, p.webpage
+        FROM Book_Agent ba JOIN Agent a ON a.id = ba.agent JOIN Person p ON p.id = a.person{where}
+        ORDER BY 1, 2, 3, 4, 5, 6, 7""",
+    'subjects': """
+        SELECT bs.book, s.name FROM Book_Subject bs JOIN Subject s ON s.id = bs.subject{where}
+        ORDER BY 1, 2""",
+    'bookshelves': """
+        SELECT bb.book, b.name FROM Book_Bookshelf bb JOIN Bookshelf b ON b.id = bb.bookshelf{where}
+        ORDER BY 1, 2""",
+    'languages': """
+        SELECT book, language FROM Book_Language{where}
+        ORDER BY 1, 2""",
+    'resources': """
+        SELECT br.book, r.url, r.size, r.modified, r.type
+        FROM Book_Resource br JOIN Resource r ON r.id = br.resource{where}
+        ORDER BY 1, 2, 3, 4, 5""",
+}
+
+RELATION_BOOK_COLUMNS = {
+    'agents': 'ba.book',
+    'subjects': 'bs.book',
+    'bookshelves': 'bb.book',
+    'languages': 'book',
+    'resources': 'br.book',
+}
+
+CHUNK_SIZE = 500
+
+YEAR = re.compile(r'\s*(-?\d+)')
+
+
+def parse_modified(modified: str):
+    """Parses the modification time of a resource as stored by books_db.
+
+    :param modified: The timestamp, e.g. 2021-03-01T12:00:00.123
+    :returns: The aware datetime in UTC, or None if there is no timestamp.
+    """
+    if not modified:
+        return None
+    return datetime.strptime(modified.split(".")[0], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=pytz.UTC)
+
+
+def parse_year(date: str):
+    """Parses the year of a birth or death date as stored by books_db.
+
+    :param date: The date, usually a year such as 1812 or -384 for 384 BC.
+    :returns: The year as an integer, or None if the date does not start with one.
+    """
+    match = YEAR.match(date or '')
+    return int(match.group(1)) if match else None
+
+
+def hash_snapshot(path: str) -> dict:
+    """Computes the content hash of every book in a snapshot.
+
+    The rows are streamed, so only one hash object per book is kept in memory.
+
+    :param path: The path of the snapshot.
+    :returns: A dict mapping book ids to hex digests.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        hashes = {}
+        for row in conn.execute(BOOK_QUERY.format(where="")):
+            # Without the download count, the last column.
+            hashes[row[0]] = hashlib.sha1(repr(row[:-1]).encode('utf-8'))
+
+        for relation, query in RELATION_QUERIES.items():
+            for book_id, *values in conn.execute(query.format(where="")):
+                if book_id in hashes:
+                    hashes[book_id].update(repr((relation, values)).encode('utf-8'))
+    finally:
+        conn.close()
+
+    return {book_id: digest.hexdigest() for book_id, digest in hashes.items()}
+
+
+def compute_delta(old: dict, new: dict) -> Delta:
+    """Compares the book hashes of two snapshots.
+
+    :param old: The hashes of the previous snapshot.
+    :param new: The hashes of the new snapshot.
+    :returns: The Delta with the sorted ids of added, changed and removed books.
+    """
+    return Delta(
+        added=sorted(new.keys() - old.keys()),
+        changed=sorted(book_id for book_id in new.keys() & old.keys() if new[book_id] != old[book_id]),
+        removed=sorted(old.keys() - new.keys()),
+    )
+
+
+def read_books(conn, book_ids) -> dict:
+    """Reads books with the natural values of their relations from a snapshot.
+
+    :param conn: A connection to the snapshot.
+    :param book_ids: The ids of the books to read.
+    :returns: A dict mapping book ids to dicts of the book row and its relations.
+    """
+    placeholders = ', '.join('?' * len(book_ids))
+    books = {}
+    for row in conn.execute(BOOK_QUERY.format(where=f" WHERE id IN ({placeholders})"), book_ids):
+        books[row[0]] = {'row': row, **{relation: [] for relation in RELATION_QUERIES}}
+
+    for relation, query in RELATION_QUERIES.items():
+        where = f" WHERE {RELATION_BOOK_COLUMNS[relation]} IN ({placeholders})"
+        for book_id, *values in conn.execute(query.format(where=where), book_ids):
+            books[book_id][relation].append(tuple(values))
+    return books
+
+
+class DimensionResolver:
+    """Finds or creates the rows shared between books, by their natural keys."""
+
+    def __init__(self, using: str):
+        self.using = using
+        self.next_ids = {}
+
+    def allocate_ids(self, model, count: int) -> list:
+        """Reserves ids for models whose primary key is not an AutoField."""
+        if model not in self.next_ids:
+            top = model.objects.using(self.using).aggregate(top=Max('id'))['top']
+            self.next_ids[model] = (top or 0) + 1
+        start = self.next_ids[model]
+        self.next_ids[model] += count
+        return list(range(start, start + count))
+
+    def named(self, model, names) -> dict:
+        """Maps names to the ids of Subject or Bookshelf rows, creating missing rows."""
+        names = set(names)
+        ids = {}
+        for id, name in model.objects.using(self.using).filter(name__in=names).order_by('id').values_list('id', 'name'):
+            ids.setdefault(name, id)
+
+        missing = sorted(names - ids.keys())
+        objs = [model(id=id, name=name) for id, name in zip(self.allocate_ids(model, len(missing)), missing)]
+        model.objects.using(self.using).bulk_create(objs)
+        ids.update((obj.name, obj.id) for obj in objs)
+        return ids
+
+    def keys(self, model, names) -> None:
+        """Creates the missing Language or AgentType rows, whose primary key is the name."""
+        model.objects.using(self.using).bulk_create(
+            [model(name=name) for name in set(names)], ignore_conflicts=True)
+
+    def agents(self, agents) -> dict:
+        """Maps (type, name, alias, birth_date, death_date, webpage) tuples to Agent ids."""
+        fields = ('name', 'alias', 'birth_date', 'death_date', 'webpage')
+        people = {agent[1:] for agent in agents}
+
+        names = {person[0] for person in people}
+        lookup = Q(name__in=names - {None})
+        if None in names:
+            lookup |= Q(name__isnull=True)
+
+        person_ids = {}
+        for person in models.Person.objects.using(self.using).filter(
+                lookup).order_by('id').values('id', *fields):
+            person_ids.setdefault(tuple(person[field] for field in fields), person['id'])
+
+        missing = [person for person in sorted(people, key=repr) if person not in person_ids]
+        created = models.Person.objects.using(self.using).bulk_create(
+            [models.Person(birth_year=parse_year(person[2]), death_year=parse_year(person[3]),
+                           **dict(zip(fields, person))) for person in missing])
+        person_ids.update(zip(missing, (person.id for person in created)))
+
+        agent_ids = {}
+        for id, person_id, type_id in models.Agent.objects.using(self.using).filter(
+                person_id__in=person_ids.values()).order_by('id').values_list('id', 'person_id', 'type_id'):
+            agent_ids.setdefault((person_id, type_id), id)
+
+        keys = {agent: (person_ids[agent[1:]], agent[0]) for agent in agents}
+        missing = sorted(set(keys.values()) - agent_ids.keys(), key=repr)
+        created = models.Agent.objects.using(self.using).bulk_create(
+            [models.Agent(person_id=person_id, type_id=type_id) for person_id, type_id in missing])
+        agent_ids.update(zip(missing, (agent.id for agent in created)))
+
+        return {agent: agent_ids[key] for agent, key in keys.items()}
+
+
+def delete_books(book_ids, using: str) -> None:
+    """Deletes books with their relations, and the rows only they used.
+
+    Resources, agents, subjects and bookshelves that no other book uses are
+    deleted, and so are the people left without agents, so the database
+    holds the same rows as after a full import.
+
+    :param book_ids: The ids of the books.
+    :param using: The database alias.
+    :returns: None
+    """
+    Book = models.Book
+    related = []
+    for relation, model in (('resources', models.Resource), ('agents', models.Agent),
+                            ('subjects', models.Subject), ('bookshelves', models.Bookshelf)):
+        column = getattr(Book, relation).field.m2m_reverse_name()
+        ids = list(getattr(Book, relation).through.objects.using(using).filter(
+            book_id__in=book_ids).values_list(column, flat=True))
+        related.append((model, ids))
+    agent_ids = dict(related)[models.Agent]
+    person_ids = list(models.Agent.objects.using(using).filter(
+        pk__in=agent_ids).values_list('person_id', flat=True))
+
+    Book.objects.using(using).filter(pk__in=book_ids).delete()
+    for model, ids in related:
+        model.objects.using(using).filter(pk__in=ids, book__isnull=True).delete()
+    models.Person.objects.using(using).filter(pk__in=person_ids, agent__isnull=True).delete()
+
+
+def insert_books(books: dict, resolver: DimensionResolver, using: str) -> None:
+    """Inserts books read by `read_books` with all of their relations.
+
+    :param books: The books.
+    :param resolver: The resolver of shared rows.
+    :param using: The database alias.
+    :returns: None
+    """
+    relations = defaultdict(list)
+    for book in books.values():
+        for relation in RELATION_QUERIES:
+            relations[relation].extend(book[relation])
+
+    subjects = resolver.named(models.Subject, (name for name, in relations['subjects']))
+    bookshelves = resolver.named(models.Bookshelf, (name for name, in relations['bookshelves']))
+    resolver.keys(models.Language, (name for name, in relations['languages']))
+    resolver.keys(models.AgentType, (agent[0] for agent in relations['agents']))
+    agents = resolver.agents(relations['agents'])
+
+    models.Book.objects.using(using).bulk_create([
+        models.Book(id=id, type=format, title=title, description=description, license=license, downloads=downloads)
+        for id, format, title, description, license, downloads in (book['row'] for book in books.values())
+    ])
+
+    resource_ids = iter(resolver.allocate_ids(models.Resource, len(relations['resources'])))
+    resources, book_resources = [], []
+    for book_id, book in books.items():
+        for url, size, modified, type in book['resources']:
+            resource = models.Resource(
+                id=next(resource_ids), uri=url, size=size, modified=parse_modified(modified), type=type)
+            resources.append(resource)
+            book_resources.append(models.Book.resources.through(book_id=book_id, resource_id=resource.id))
+    models.Resource.objects.using(using).bulk_create(resources)
+
+    Book = models.Book
+    through_rows = {
+        Book.resources.through: book_resources,
+        Book.agents.through: [
+            Book.agents.through(book_id=book_id, agent_id=agents[agent])
+            for book_id, book in books.items() for agent in book['agents']],
+        Book.subjects.through: [
+            Book.subjects.through(book_id=book_id, subject_id=subjects[name])
+            for book_id, book in books.items() for name, in book['subjects']],
+        Book.bookshelves.through: [
+            Book.bookshelves.through(book_id=book_id, bookshelf_id=bookshelves[name])
+            for book_id, book in books.items() for name, in book['bookshelves']],
+        Book.languages.through: [
+            Book.languages.through(book_id=book_id, language_id=name)
+            for book_id, book in books.items() for name, in book['languages']],
+    }
+    for through, rows in through_rows.items():
+        through.objects.using(using).bulk_create(rows)
+
+
+def update_downloads(conn, using: str = 'default') -> list:
+    """Copies the download counts of a snapshot to the books whose count changed.
+
+    :param conn: A connection to the snapshot.
+    :param using: The database alias.
+    :returns: The sorted ids of the updated books.
+    """
+    current = dict(models.Book.objects.using(using).values_list('id', 'downloads'))
+    rows = [(downloads, id) for id, downloads in conn.execute(DOWNLOADS_QUERY)
+            if id in current and current[id] != downloads]
+    # One prepared UPDATE for every row. bulk_update builds a CASE expression per
+    # row, which costs more than the update itself for a catalogue sized delta.
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.executemany(f"UPDATE {quote_name(models.Book._meta.db_table)} SET {quote_name('downloads')} = %s "
+                           f"WHERE {quote_name('id')} = %s", rows)
+    return sorted(id for _, id in rows)
+
+
+def apply_delta(path: str, delta: Delta, using: str = 'default') -> list:
+    """Writes the changed books of a snapshot to the database.
+
+    Changed books are deleted and inserted again with their relations.
+    People, agents, subjects, bookshelves, languages and agent types are
+    matched by their natural values and only created when missing.
+    The download counts of the other books are updated in place.
+
+    :param path: The path of the new snapshot.
+    :param delta: The Delta between the imported and the new snapshot.
+    :param using: The database alias.
+    :returns: The sorted ids of the books whose download count was updated.
+    """
+    resolver = DimensionResolver(using)
+    stale = delta.changed + delta.removed
+    fresh = delta.added + delta.changed
+
+    conn = sqlite3.connect(path)
+    try:
+        with transaction.atomic(using=using):
+            for i in range(0, len(stale), CHUNK_SIZE):
+                delete_books(stale[i:i + CHUNK_SIZE], using)
+            for i in range(0, len(fresh), CHUNK_SIZE):
+                insert_books(read_books(conn, fresh[i:i + CHUNK_SIZE]), resolver, using)
+            return update_downloads(conn, using)
+    finally:
+        conn.close()
@@ -0,0 +1,89 @@
+"""Pre-rendered book documents
+
+`build_documents` renders every book with BookSerializer and stores the
+JSON in the BookDocument table. The book endpoints serve these documents
+through BookDocumentSerializer and DocumentJSONRenderer, so a book and its
+relations are not serialized on every request.
+The documents are rebuilt by `load_db` after every import. A delta import
+rebuilds the documents of the added and changed books, and only patches the
+download count into the documents of the others, see `update_downloads`.
+"""
+
+import json
+
+from django.db import connections, transaction
+from rest_framework.renderers import JSONRenderer
+
+from api import models
+from api.planner import apply_plan, plan_serializer
+from api.serializers import BookSerializer
+
+CHUNK_SIZE = 500
+
+
+def build_documents(using: str = 'default', book_ids=None) -> int:
+    """Renders and stores the documents of books.
+
+    :param using: The database alias.
+    :param book_ids: Only build the documents of these books. Builds every
+        document if None.
+    :returns: The number of documents built.
+    """
+    books = models.Book.objects.using(using).order_by('pk')
+    if book_ids is None:
+        ids = list(books.values_list('pk', flat=True))
+    else:
+        ids = sorted(book_ids)
+
+    renderer = JSONRenderer()
+    plan = plan_serializer(BookSerializer(), models.Book)
+    count = 0
+
+    with transaction.atomic(using=using):
+        if book_ids is None:
+            models.BookDocument.objects.using(using).all().delete()
+
+        for i in range(0, len(ids), CHUNK_SIZE):
+            chunk = ids[i:i + CHUNK_SIZE]
+            data = BookSerializer(apply_plan(books.filter(pk__in=chunk), plan), many=True).data
+            models.BookDocument.objects.using(using).filter(pk__in=chunk).delete()
+            models.BookDocument.objects.using(using).bulk_create([
+                models.BookDocument(book_id=book['id'], json=renderer.render(book).decode('utf-8'))
+                for book in data
+            ])
+            count += len(data)
+    return count
+
+
+def update_downloads(using: str = 'default', book_ids=()) -> int:
+    """Copies the download counts of books into their stored documents.
+
+    Cheaper than `build_documents` for books whose download count is all that
+    changed, as the relations are not read and the books are not serialized.
+    The other keys keep their order, so the documents stay identical to
+    what BookSerializer renders.
+
+    :param using: The database alias.
+    :param book_ids: The books whose download count changed.
+    :returns: The number of documents updated.
+    """
+    ids = sorted(book_ids)
+    renderer = JSONRenderer()
+    documents = models.BookDocument.objects.using(using)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    sql = (f"UPDATE {quote_name(models.BookDocument._meta.db_table)} SET {quote_name('json')} = %s "
+           f"WHERE {quote_name('book_id')} = %s")
+    count = 0
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for i in range(0, len(ids), CHUNK_SIZE):
+            rows = []
+            for book_id, document, downloads in documents.filter(pk__in=ids[i:i + CHUNK_SIZE]).values_list(
+                    'pk', 'json', 'book__downloads'):
+                data = json.loads(document)
+                data['downloads'] = downloads
+                rows.append((renderer.render(data).decode('utf-8'), book_id))
+            cursor.executemany(sql, rows)
+            count += len(rows)
+    return count
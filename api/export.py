@@ -0,0 +1,85 @@
+"""Streaming exports of a whole endpoint
+
+`ExportMixin` adds an `export` action to a viewset, which streams every
+item matching the filters of the list as NDJSON (the default) or CSV
+(`?format=csv`). The rows are read with `.iterator()` and serialized in
+chunks with the fast path serializer of the viewset, so memory use does not
+grow with the size of the catalogue. The response is gzip compressed on the
+fly for clients that accept it.
+"""
+
+import re
+from itertools import islice
+
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from rest_framework.decorators import action
+from rest_framework.renderers import JSONRenderer
+
+from api.renderers import CSVRenderer, NDJSONRenderer
+
+CHUNK_SIZE = 2000
+
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def iter_chunks(iterable, size: int):
+    """Yields lists of up to `size` items of an iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ExportMixin:
+    """Viewset mixin adding `export`, which streams every item matching the list filters.
+
+    The viewset needs a `fast_serializer_class`.
+    """
+
+    @action(detail=False, renderer_classes=(NDJSONRenderer, CSVRenderer))
+    def export(self, request):
+        """
+        Download every item matching the filters of the list, as NDJSON or with `?format=csv` as CSV.
+        """
+        renderer = request.accepted_renderer
+        # Filtered before the response starts, so invalid filters still get a 400.
+        queryset = self.filter_queryset(self.queryset.all()).values(*self.fast_serializer_class.value_fields)
+        response = StreamingHttpResponse(
+            renderer.render_rows(self.iter_export_rows(queryset)),
+            content_type=f"{renderer.media_type}; charset=utf-8")
+
+        filename = f"{self.basename}.{renderer.format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            response.streaming_content = compress_sequence(response.streaming_content)
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+    def handle_exception(self, exc):
+        """Renders the errors of `export` as JSON, as the export renderers only take rows."""
+        response = super().handle_exception(exc)
+        if self.action == 'export':
+            self.request.accepted_renderer = JSONRenderer()
+            self.request.accepted_media_type = JSONRenderer.media_type
+        return response
+
+    def iter_export_rows(self, queryset):
+        """Yields the serialized items, fetching the rows and their relations a chunk at a time.
+
+        :param queryset: The filtered `.values()` queryset of the fast path serializer fields.
+        :returns: Iterator of dicts.
+        """
+        serializer_class = self.fast_serializer_class
+        add_relations = getattr(serializer_class, 'add_relations', None)
+
+        serializer = serializer_class()
+        for rows in iter_chunks(queryset.iterator(chunk_size=CHUNK_SIZE), CHUNK_SIZE):
+            if add_relations is not None:
+                rows = add_relations(rows)
+            for row in rows:
+                yield serializer.to_representation(row)
@@ -0,0 +1,143 @@
+"""Faceted counts for book lists
+
+`?facets=languages,subjects` adds the number of matching books per
+language, subject, ... to a book list. Every requested facet is counted in
+a single UNION ALL query over the ids of the filtered books, with
+`COUNT(DISTINCT book_id)` and a per facet LIMIT.
+Facets only depend on the filters, so they are cached per catalogue version
+and filter combination and reused while paging through the results.
+"""
+
+import hashlib
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from rest_framework.exceptions import ValidationError
+
+from api import catalogue, models
+
+FACETS = ('languages', 'bookshelves', 'subjects', 'agent_types', 'resource_types')
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Query parameters that do not change which books match.
+IGNORED_PARAMS = ('cursor', 'page_size', 'count', 'ordering', 'format', 'rank', 'fields', 'exclude', 'expand')
+
+
+def _facet_sources() -> dict:
+    """Returns the FROM clause and value column of every facet, keyed by facet name."""
+    Book = models.Book
+    languages = Book.languages.through._meta.db_table
+    bookshelves = Book.bookshelves.through._meta.db_table
+    subjects = Book.subjects.through._meta.db_table
+    agents = Book.agents.through._meta.db_table
+    resources = Book.resources.through._meta.db_table
+
+    return {
+        'languages': (f"{languages} x", "x.language_id"),
+        'bookshelves': (
+            f"{bookshelves} x JOIN {models.Bookshelf._meta.db_table} v ON v.id = x.bookshelf_id", "v.name"),
+        'subjects': (
+            f"{subjects} x JOIN {models.Subject._meta.db_table} v ON v.id = x.subject_id", "v.name"),
+        'agent_types': (
+            f"{agents} x JOIN {models.Agent._meta.db_table} v ON v.id = x.agent_id", "v.type_id"),
+        'resource_types': (
+            f"{resources} x JOIN {models.Resource._meta.db_table} v ON v.id = x.resource_id", "v.type"),
+    }
+
+
+def count_facets(queryset, facets, limit: int) -> dict:
+    """Counts the books of a queryset per value of each facet, in one query.
+
+    :param queryset: The filtered book queryset.
+    :param facets: The facet names.
+    :param limit: The number of values returned per facet.
+    :returns: Dict mapping facet names to lists of {"value", "count"} dicts,
+        most common value first.
+    """
+    ids_sql, ids_params = queryset.order_by().values('pk').query.sql_with_params()
+    sources = _facet_sources()
+
+    parts = []
+    for facet in facets:
+        source, value = sources[facet]
+        parts.append(
+            f"SELECT * FROM (SELECT %s AS facet, {value} AS value, COUNT(DISTINCT x.book_id) AS count "
+            f"FROM {source} WHERE x.book_id IN (SELECT id FROM ids) AND {value} IS NOT NULL "
+            f"GROUP BY {value} ORDER BY count DESC, value LIMIT %s) AS {facet}")
+    params = list(ids_params)
+    for facet in facets:
+        params += [facet, limit]
+
+    result = OrderedDict((facet, []) for facet in facets)
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f"WITH ids (id) AS ({ids_sql}) " + " UNION ALL ".join(parts), params)
+        for facet, value, count in cursor.fetchall():
+            result[facet].append({'value': value, 'count': count})
+
+    for values in result.values():
+        values.sort(key=lambda item: (-item['count'], item['value']))
+    return result
+
+
+def get_cache_key(request, facets, limit: int, version: int) -> str:
+    """Builds the cache key of the facets of a request, ignoring the paging parameters.
+
+    :param request: The DRF request.
+    :param facets: The facet names.
+    :param limit: The number of values per facet.
+    :param version: The catalogue version number.
+    :returns: The cache key.
+    """
+    query = urlencode(sorted(
+        (key, values) for key, values in request.query_params.lists()
+        if key not in IGNORED_PARAMS and key not in ('facets', 'facet_limit')), doseq=True)
+    raw = '\n'.join((request.path, query, ','.join(facets), str(limit)))
+    return f"facets:{version}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+
+def parse_facets(request):
+    """Reads the requested facets and limit.
+
+    :param request: The DRF request.
+    :returns: Tuple of (facet names, limit). The names are empty without `?facets=`.
+    """
+    facets = list(dict.fromkeys(name for name in request.query_params.get('facets', '').split(',') if name))
+    unknown = [name for name in facets if name not in FACETS]
+    if unknown:
+        raise ValidationError({'facets': [f"Unknown facet: {name}. Choose from {', '.join(FACETS)}."
+                                          for name in unknown]})
+    try:
+        limit = int(request.query_params.get('facet_limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ValidationError({'facet_limit': ["Must be an integer."]})
+    return facets, max(1, min(limit, MAX_LIMIT))
+
+
+class FacetMixin:
+    """Viewset mixin adding the facet counts requested with `?facets=` to the list."""
+
+    def list(self, request, *args, **kwargs):
+        facets, limit = parse_facets(request)
+        response = super().list(request, *args, **kwargs)
+        if facets and response.status_code == 200:
+            response.data['facets'] = self.get_facets(request, facets, limit)
+        return response
+
+    def get_facets(self, request, facets, limit: int) -> dict:
+        """Returns the facet counts of the filtered list, from the cache if possible."""
+        queryset = self.filter_queryset(self.queryset.all())
+        if settings.API_RESPONSE_CACHE is None:
+            return count_facets(queryset, facets, limit)
+
+        cache = caches[settings.API_RESPONSE_CACHE]
+        key = get_cache_key(request, facets, limit, catalogue.get_version().number)
+        result = cache.get(key)
+        if result is None:
+            result = count_facets(queryset, facets, limit)
+            cache.set(key, result)
+        return result
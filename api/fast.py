@@ -0,0 +1,28 @@
+"""Fast path for hot list endpoints
+
+Viewsets with a `fast_serializer_class` serve `.values()` rows through it
+instead of model instances through `serializer_class`. The fast serializers
+are ValuesSerializer subclasses producing the same output.
+The `API_FAST_SERIALIZERS` setting turns the fast path off everywhere.
+"""
+
+from django.conf import settings
+
+
+class FastSerializerMixin:
+    """Viewset mixin that serves the rows of a values() queryset with `fast_serializer_class`."""
+    fast_serializer_class = None
+
+    def use_fast_serializer(self) -> bool:
+        return self.fast_serializer_class is not None and settings.API_FAST_SERIALIZERS
+
+    def get_serializer_class(self):
+        if self.use_fast_serializer():
+            return self.fast_serializer_class
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.use_fast_serializer():
+            queryset = queryset.values(*self.fast_serializer_class.value_fields)
+        return queryset
@@ -0,0 +1,97 @@
+"""Management command to compare the model and fast path serializers
+
+Serializes the same rows with the ModelSerializer of a viewset, on its
+planned queryset, and with its fast path serializer, on a values() queryset,
+and prints the best time of each.
+Registers a django management command named 'benchmark_serializers' that can be
+used as `python manage.py benchmark_serializers`
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import views
+from api.planner import apply_plan, plan_serializer
+
+VIEWSETS = {
+    'book': views.BookViewSet,
+    'person': views.PersonViewSet,
+    'resource': views.ResourceViewSet,
+}
+
+
+def best_time(function, repeat: int) -> float:
+    """Runs a function `repeat` times.
+
+    :param function: The function to time.
+    :param repeat: The number of runs.
+    :returns: The fastest run in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def model_path(viewset, rows: int):
+    """Serializes the first `rows` rows like the viewset does without the fast path."""
+    serializer_class = viewset.serializer_class
+    queryset = apply_plan(viewset.queryset.all(), plan_serializer(serializer_class(), viewset.queryset.model))
+    return lambda: serializer_class(list(queryset[:rows]), many=True).data
+
+
+def fast_path(viewset, rows: int):
+    """Serializes the first `rows` rows with the fast path serializer of the viewset."""
+    serializer_class = viewset.fast_serializer_class
+    queryset = viewset.queryset.values(*serializer_class.value_fields)
+    return lambda: serializer_class(list(queryset[:rows]), many=True).data
+
+
+class Command(BaseCommand):
+    """Django management command for benchmark_serializers"""
+    help = 'Compares the ModelSerializer and fast path serializers of the hot list endpoints.'
+
+    def add_arguments(self, parser) -> None:
+        """Add arguments to benchmark_serializers
+
+        :param parser: django command line parser
+        :returns: None
+        """
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=100,
+            help="Number of rows serialized per run (the largest page size is 100)"
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=20,
+            help="Number of runs, the fastest is reported"
+        )
+        parser.add_argument(
+            "endpoints",
+            nargs="*",
+            help=f"The endpoints to benchmark: {', '.join(VIEWSETS)}. All of them by default"
+        )
+
+    def handle(self, *args, **options) -> None:
+        """Django management handler for benchmark_serializers.
+
+        Inherited member. See django docs for more details.
+        """
+        rows, repeat = options["rows"], options["repeat"]
+        unknown = set(options["endpoints"]) - VIEWSETS.keys()
+        if unknown:
+            raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+        for name in options["endpoints"] or VIEWSETS:
+            viewset = VIEWSETS[name]
+            model = best_time(model_path(viewset, rows), repeat)
+            fast = best_time(fast_path(viewset, rows), repeat)
+            self.stdout.write(
+                f"{name:<10} model {model * 1000:8.2f} ms   fast {fast * 1000:8.2f} ms   "
+                f"{model / fast if fast else 0:5.1f}x ({rows} rows, best of {repeat})")
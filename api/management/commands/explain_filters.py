@@ -0,0 +1,123 @@
+"""Management command to check the query plans of the API filters
+
+Builds the query for every filter and ordering field of the API viewsets
+with a sample value, prints the plan the database chooses for it and reports
+the queries that have to scan a whole table.
+Registers a django management command named 'explain_filters' that can be
+used as `python manage.py explain_filters`
+"""
+
+import re
+from datetime import date, datetime
+
+import django_filters
+import pytz
+from django.core.management.base import BaseCommand
+
+from api.urls import router
+
+# SQLite: "SCAN api_book [USING INDEX idx]". PostgreSQL: "Seq Scan on api_book"
+SCAN_PATTERN = re.compile(
+    r"\bSCAN (?:TABLE )?(\w+)(?: USING (?:COVERING )?INDEX (\w+))?|Seq Scan on (\w+)")
+
+
+def sample_value(filter_):
+    """Returns a value of the right type to run a filter with.
+
+    :param filter_: A django_filters filter.
+    :returns: A value that the filter accepts.
+    """
+    if isinstance(filter_, django_filters.DateFromToRangeFilter):
+        return slice(datetime(2000, 1, 1, tzinfo=pytz.UTC), datetime(2020, 1, 1, tzinfo=pytz.UTC))
+    if isinstance(filter_, (django_filters.RangeFilter, django_filters.NumericRangeFilter)):
+        return slice(1, 100)
+    if isinstance(filter_, django_filters.DateFilter):
+        return date(2020, 1, 1)
+    if isinstance(filter_, django_filters.NumberFilter):
+        return 1
+    if isinstance(filter_, django_filters.ModelChoiceFilter):
+        model = filter_.extra['queryset'].model
+        if model._meta.pk.get_internal_type() == 'CharField':
+            return model(pk='en')
+        return model(pk=1)
+    return 'en'
+
+
+def full_scans(plan: str) -> list:
+    """Returns the tables that a query plan scans completely.
+
+    A scan that walks an index is reported as well since it still visits every
+    row, unless the query is stopped early by a LIMIT.
+
+    :param plan: The output of `QuerySet.explain()`.
+    :returns: List of table descriptions.
+    """
+    scans = []
+    for table, index, seq_table in SCAN_PATTERN.findall(plan):
+        if seq_table:
+            scans.append(seq_table)
+        elif index:
+            scans.append(f"{table} (in {index} order)")
+        else:
+            scans.append(table)
+    return scans
+
+
+def iter_queries():
+    """Yields a query for every filter and ordering field of the API.
+
+    :returns: Iterator of (label, queryset) tuples.
+    """
+    for prefix, viewset, _ in router.registry:
+        queryset = viewset.queryset.all()
+        yield f"{prefix}", queryset
+
+        filterset_class = getattr(viewset, 'filterset_class', None)
+        if filterset_class is not None:
+            for name, filter_ in filterset_class(queryset=queryset).filters.items():
+                yield f"{prefix}?{name}", filter_.filter(queryset, sample_value(filter_))
+
+        aliases = getattr(viewset, 'ordering_aliases', {})
+        for field in getattr(viewset, 'ordering_fields', None) or ():
+            for ordering in (field, f"-{field}"):
+                yield f"{prefix}?ordering={ordering}", queryset.order_by(ordering.replace(field, aliases.get(field, field)))
+
+
+class Command(BaseCommand):
+    """Django management command for explain_filters"""
+    help = 'Prints the query plan of every API filter and reports full table scans.'
+
+    def add_arguments(self, parser) -> None:
+        """Add arguments to explain_filters
+
+        :param parser: django command line parser
+        :returns: None
+        """
+        parser.add_argument(
+            "--scans-only",
+            action="store_true",
+            help="Only print the queries that scan a whole table"
+        )
+
+    def handle(self, *args, **options) -> None:
+        """Django management handler for explain_filters.
+
+        Inherited member. See django docs for more details.
+        """
+        report = []
+        for label, queryset in iter_queries():
+            plan = queryset.explain()
+            scans = full_scans(plan)
+            if scans:
+                report.append((label, scans))
+            if scans or not options["scans_only"]:
+                self.stdout.write(self.style.MIGRATE_HEADING(label))
+                self.stdout.write(plan + "\n")
+
+        if not report:
+            self.stdout.write(self.style.SUCCESS("No full table scans."))
+            return
+
+        self.stdout.write(self.style.WARNING(f"{len(report)} queries scan a whole table:"))
+        for label, scans in report:
+            self.stdout.write(f"  {label}: {', '.join(scans)}")
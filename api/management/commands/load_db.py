@@ -9,214 +9,325 @@ import logging
 import os
 import sys
 import sqlite3
-from datetime import datetime
-import pytz
+import time
+from pathlib import Path
 
-from django.core.exceptions import FieldError
-from django.core.management.base import BaseCommand
+from django.core.exceptions import FieldError, ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections
 from django.db.transaction import atomic
 
 from api import models
+from api.catalogue import bump_version
+from api.delta import apply_delta, compute_delta, hash_snapshot, parse_modified, parse_year
+from api.documents import build_documents, update_downloads
+from api.postgres import copy_available, copy_instances, copy_rows, reset_sequences
+from api.search import rebuild_search_index
+from api.staging import check_swappable, staging_database
+from api.stats import update_stats
 
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
 
-def clear_db() -> None:
+DEFAULT_BATCH_SIZE = 5000
+
+# Schema name of the fixture when it is attached to an SQLite database
+FIXTURE_SCHEMA = 'fixture'
+
+
+def clear_db(using: str = 'default') -> None:
     """Clears all catalogue related information present in the database.
 
+    The tables are truncated with the SQL `flush` uses, instead of deleting
+    the rows one by one through the ORM.
+
+    :param using: The database alias.
     :param returns: None
     """
-    models.Person.objects.all().delete()
-    models.AgentType.objects.all().delete()
-    models.Agent.objects.all().delete()
-    models.Bookshelf.objects.all().delete()
-    models.Language.objects.all().delete()
-    models.Subject.objects.all().delete()
-    models.Resource.objects.all().delete()
-    models.Book.objects.all().delete()
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        # PostgreSQL cannot truncate tables with deferred foreign key checks pending.
+        connection.check_constraints()
+    tables = [model._meta.db_table for _, model, _, _ in TABLES]
+    sql_list = connection.ops.sql_flush(no_style(), tables, allow_cascade=True)
+    connection.ops.execute_sql_flush(sql_list)
+
+
+# (label, model, source query, function building a model instance from a source row)
+# The rows of the M2M through tables are inserted as they are, without model instances:
+# their source queries select the columns of the through table, in order.
+TABLES = (
+    ("Book", models.Book,
+     "SELECT id, format, title, description, license, downloads FROM Book",
+     lambda id, format, title, description, license, downloads: models.Book(
+         id=id, type=format, title=title, description=description, license=license, downloads=downloads)),
+    ("Person", models.Person,
+     "SELECT id, name, alias, birth_date, death_date, webpage FROM Person",
+     lambda id, name, alias, birth_date, death_date, webpage: models.Person(
+         pk=id, name=name, alias=alias, birth_date=birth_date, death_date=death_date, webpage=webpage,
+         birth_year=parse_year(birth_date), death_year=parse_year(death_date))),
+    ("AgentType", models.AgentType,
+     "SELECT name FROM AgentType",
+     lambda name: models.AgentType(name=name)),
+    ("Agent", models.Agent,
+     "SELECT id, person, type FROM Agent",
+     lambda id, person_id, type_id: models.Agent(pk=id, person_id=person_id, type_id=type_id)),
+    ("Bookshelf", models.Bookshelf,
+     "SELECT id, name FROM Bookshelf",
+     lambda id, name: models.Bookshelf(pk=id, name=name)),
+    ("Subject", models.Subject,
+     "SELECT id, name FROM Subject",
+     lambda id, name: models.Subject(pk=id, name=name)),
+    ("Resource", models.Resource,
+     "SELECT id, url, size, modified, type FROM Resource",
+     lambda id, url, size, modified, type: models.Resource(
+         pk=id, uri=url, size=size, modified=parse_modified(modified), type=type)),
+    ("Language", models.Language,
+     "SELECT name FROM Language",
+     lambda name: models.Language(name=name)),
+    ("Book Language M2M relation", models.Book.languages.through,
+     "SELECT book, language FROM Book_Language", None),
+    ("Book Subject M2M relation", models.Book.subjects.through,
+     "SELECT book, subject FROM Book_Subject", None),
+    ("Book Resource M2M relation", models.Book.resources.through,
+     "SELECT book, resource FROM Book_Resource", None),
+    ("Book Bookshelf M2M relation", models.Book.bookshelves.through,
+     "SELECT book, bookshelf FROM Book_Bookshelf", None),
+    ("Book Agent M2M relation", models.Book.agents.through,
+     "SELECT book, agent FROM Book_Agent", None),
+)
+
+
+def peak_memory() -> str:
+    """Returns the peak resident memory of the process, for progress messages.
+
+    :returns: The formatted size, or "n/a" where it cannot be measured.
+    """
+    if resource is None:
+        return "n/a"
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    if sys.platform == "darwin":
+        peak //= 1024
+    return f"{peak / 1024:.1f} MiB"
+
+
+def insert_rows(model, rows, using: str = 'default') -> None:
+    """Inserts rows of column values into the table of a model, without model instances.
+
+    The rows are written with COPY on PostgreSQL and with `executemany` elsewhere.
+
+    :param model: The model, whose concrete fields except an auto-incremented
+        primary key are the columns of the rows, in order.
+    :param rows: The row tuples.
+    :param using: The database alias.
+    :returns: None
+    """
+    opts = model._meta
+    columns = [field.column for field in opts.concrete_fields if field is not opts.auto_field]
+    if copy_available(using):
+        copy_rows(model, columns, rows, using)
+        return
+
+    connection = connections[using]
+    names = ', '.join(connection.ops.quote_name(column) for column in columns)
+    placeholders = ', '.join(['%s'] * len(columns))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {connection.ops.quote_name(opts.db_table)} ({names}) VALUES ({placeholders})", rows)
+
+
+def attach_fixture(fixture_file_path: str, using: str = 'default') -> bool:
+    """Attaches the fixture to an SQLite database, so tables can be copied with INSERT ... SELECT.
+
+    An attached database can only be detached outside of a transaction, so the
+    fixture is not attached when the import runs inside a transaction of the caller.
+
+    :param fixture_file_path: The path to the fixture file.
+    :param using: The database alias.
+    :returns: Whether the fixture was attached.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.in_atomic_block:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(f"ATTACH DATABASE %s AS {FIXTURE_SCHEMA}",
+                       (Path(fixture_file_path).resolve().as_uri() + '?mode=ro',))
+    return True
+
+
+def detach_fixture(using: str = 'default') -> None:
+    """Detaches the fixture attached by `attach_fixture`.
+
+    :param using: The database alias.
+    :returns: None
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DETACH DATABASE {FIXTURE_SCHEMA}")
 
 
-def import_catalogue(logger, fixture_file_path: str, clear: bool) -> None:
+def import_table(logger, cur, label: str, model, query: str, build, batch_size: int, using: str,
+                 attached: bool = False) -> int:
+    """Streams one table of the fixture into the database.
+
+    Rows are read with `fetchmany` and inserted with one `bulk_create` per chunk,
+    or one COPY per chunk on PostgreSQL, so at most `batch_size` instances are
+    held in memory.
+
+    The rows of tables without a `build` function are inserted as they are,
+    without model instances. If the fixture is attached to the database, they
+    are copied by the database itself with one INSERT ... SELECT.
+
+    :param logger: The logger used to log messages.
+    :param cur: A cursor on the fixture database.
+    :param label: The name of the table used in messages.
+    :param model: The model the rows are inserted into.
+    :param query: The query selecting the rows from the fixture.
+    :param build: A function building a model instance from a row, or None.
+    :param batch_size: The number of rows per chunk.
+    :param using: The database alias to import into.
+    :param attached: Whether the fixture is attached to the database, see `attach_fixture`.
+    :returns: The number of rows imported.
+    """
+    logger.info(f"Populating {label}")
+    start = time.monotonic()
+    count = 0
+    copy = copy_available(using)
+
+    if build is None and attached:
+        opts = model._meta
+        connection = connections[using]
+        names = ', '.join(connection.ops.quote_name(field.column)
+                          for field in opts.concrete_fields if field is not opts.auto_field)
+        # The fixture tables are only found in the attached schema, the source query needs no prefix.
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {connection.ops.quote_name(opts.db_table)} ({names}) {query}")
+            count = cursor.rowcount
+    else:
+        cur.execute(query)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            if build is None:
+                insert_rows(model, rows, using)
+            elif copy:
+                copy_instances(model, [build(*row) for row in rows], using)
+            else:
+                model.objects.using(using).bulk_create([build(*row) for row in rows], batch_size=batch_size)
+            count += len(rows)
+
+    elapsed = time.monotonic() - start
+    rate = count / elapsed if elapsed else 0
+    logger.info(f"  {count} rows in {elapsed:.1f}s ({rate:.0f} rows/s, peak memory {peak_memory()})")
+    return count
+
+
+def import_catalogue(logger, fixture_file_path: str, clear: bool,
+                     batch_size: int = DEFAULT_BATCH_SIZE, using: str = 'default') -> None:
     """ Imports the catalogue from fixtures.
 
     Imports all database information from the fixture path.
+    Every table is streamed in chunks of `batch_size` rows, inside a single transaction.
     NOTE: This function can clear all database information.
 
     :param logger: The logger used to log messages.
     :param fixture_file_path: The path to the fixture file.
     :param clear: Whether to clear the database before import.
+    :param batch_size: The number of rows read and inserted at a time.
+    :param using: The database alias to import into.
 
     :returns: None
     """
-    if clear:
-        clear_db()
-        logger.info("Cleared database")
-
     if not os.path.exists(fixture_file_path):
         logger.error("Fixture file not found. Nothing imported.")
+        return
 
     conn = sqlite3.connect(fixture_file_path)
     cur = conn.cursor()
+    attached = False
+
+    try:
+        attached = attach_fixture(fixture_file_path, using)
+        with atomic(using=using):
+            if clear:
+                clear_db(using)
+                logger.info("Cleared database")
 
-    logger.info("Populating Book")
-    cur.execute("""
-    SELECT id, format, title, description, license, downloads FROM Book
-    """)
-    books = cur.fetchall()
-    book_objs = []
-    for id, format, title, description, license, downloads in books:
-        book_objs.append(models.Book(id=id, type=format, title=title,
-                         description=description, license=license, downloads=downloads))
-    models.Book.objects.bulk_create(book_objs)
-    book_objs.clear()
-
-    logger.info("Populating Person")
-    cur.execute("""
-    SELECT id, name, alias, birth_date, death_date, webpage FROM Person;
-    """)
-    people = cur.fetchall()
-    people_objs = []
-    for id, name, alias, birth_date, death_date, webpage in people:
-        people_objs.append(models.Person(
-            pk=id, name=name, alias=alias, birth_date=birth_date, death_date=death_date, webpage=webpage))
-    models.Person.objects.bulk_create(people_objs)
-    people_objs.clear()
-
-    logger.info("Populating AgentType")
-    cur.execute("""
-    SELECT name FROM AgentType;
-    """)
-    agent_types = cur.fetchall()
-    agent_type_objs = []
-    for name, in agent_types:
-        agent_type_objs.append(models.AgentType(name=name))
-    models.AgentType.objects.bulk_create(agent_type_objs)
-    agent_type_objs.clear()
-
-    logger.info("Populating Agent")
-    cur.execute("""
-    SELECT id, person, type FROM Agent;
-    """)
-    agents = cur.fetchall()
-    agent_objs = []
-    for agent_id, person_id, type_id in agents:
-        agent_objs.append(models.Agent(pk=agent_id, person_id=person_id, type_id=type_id))
-    models.Agent.objects.bulk_create(agent_objs)
-    agent_objs.clear()
-
-    logger.info("Populating Bookshelf")
-    cur.execute("""
-    SELECT id, name FROM Bookshelf
-    """)
-    bookshelves = cur.fetchall()
-    bookshelf_objs = []
-    for id, name in bookshelves:
-        bookshelf_objs.append(models.Bookshelf(pk=id, name=name))
-    models.Bookshelf.objects.bulk_create(bookshelf_objs)
-    bookshelf_objs.clear()
-
-    logger.info("Populating Subject")
-    cur.execute("""
-    SELECT id, name FROM Subject
-    """)
-    subjects = cur.fetchall()
-    subject_objs = []
-    for id, name in subjects:
-        subject_objs.append(models.Subject(pk=id, name=name))
-    models.Subject.objects.bulk_create(subject_objs)
-    subject_objs.clear()
-
-    logger.info("Populating Resource")
-    cur.execute("""
-    SELECT id, url, size, modified, type FROM Resource
-    """)
-    resources = cur.fetchall()
-    resource_objs = []
-    for id, url, size, modified_str, type in resources:
-        modified_str = modified_str.split(".")[0]
-        modified = datetime.strptime(
-            modified_str, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=pytz.UTC)
-        resource_objs.append(models.Resource(
-            pk=id, uri=url, size=size, modified=modified, type=type))
-    models.Resource.objects.bulk_create(resource_objs)
-    resource_objs.clear()
-
-    logger.info("Populating Language")
-    cur.execute("""
-    SELECT name FROM Language
-    """)
-    languages = cur.fetchall()
-    language_objs = []
-    for name, in languages:
-        language_objs.append(models.Language(name=name))
-    models.Language.objects.bulk_create(language_objs)
-
-    logger.info("Populating Book Language M2M relation")
-    cur.execute("""
-    SELECT book, language FROM Book_Language;
-    """)
-    book_languages = cur.fetchall()
-    LanguageThrough = models.Book.languages.through
-    languages_through = []
-    for book_id, language_id in book_languages:
-        languages_through.append(LanguageThrough(
-            book_id=book_id, language_id=language_id))
-    LanguageThrough.objects.bulk_create(languages_through)
-    languages_through.clear()
-
-    logger.info("Populating Book Subject M2M relation")
-    cur.execute("""
-    SELECT book, subject FROM Book_Subject;
-    """)
-    book_subject = cur.fetchall()
-    SubjectThrough = models.Book.subjects.through
-    subjects_through = []
-    for book_id, subject_id in book_subject:
-        subjects_through.append(SubjectThrough(
-            book_id=book_id, subject_id=subject_id))
-    SubjectThrough.objects.bulk_create(subjects_through)
-    subjects_through.clear()
-
-    logger.info("Populating Book Resource M2M relation")
-    cur.execute("""
-    SELECT book, resource FROM Book_Resource;
-    """)
-    book_resource = cur.fetchall()
-    ResourceThrough = models.Book.resources.through
-    resources_through = []
-    for book_id, resource_id in book_resource:
-        resources_through.append(ResourceThrough(
-            book_id=book_id, resource_id=resource_id))
-    ResourceThrough.objects.bulk_create(resources_through)
-    resources_through.clear()
-
-    logger.info("Populating Book Bookshelf M2M relation")
-    cur.execute("""
-    SELECT book, bookshelf FROM Book_Bookshelf;
-    """)
-    book_bookshelf = cur.fetchall()
-    BookshelfThrough = models.Book.bookshelves.through
-    bookshelves_through = []
-    for book_id, bookshelf_id in book_bookshelf:
-        bookshelves_through.append(BookshelfThrough(
-            book_id=book_id, bookshelf_id=bookshelf_id))
-    BookshelfThrough.objects.bulk_create(bookshelves_through)
-    bookshelves_through.clear()
-
-    logger.info("Populating Book Agent M2M relation")
-    cur.execute("""
-    SELECT book, agent FROM Book_Agent;
-    """)
-    book_agent = cur.fetchall()
-    AgentThrough = models.Book.agents.through
-    agents_through = []
-    for book_id, agent_id in book_agent:
-        agents_through.append(AgentThrough(book_id=book_id, agent_id=agent_id))
-    AgentThrough.objects.bulk_create(agents_through)
-    agents_through.clear()
-
-    cur.close()
-    conn.close()
-
-    logger.info("Database import complete")
+            for label, model, query, build in TABLES:
+                import_table(logger, cur, label, model, query, build, batch_size, using, attached)
+
+            if connections[using].vendor == 'postgresql':
+                # The ids come from the fixture, so the sequences never advanced.
+                reset_sequences([model for _, model, _, _ in TABLES], using)
+    finally:
+        if attached:
+            detach_fixture(using)
+        cur.close()
+        conn.close()
+
+    logger.info("Rebuilding search index")
+    rebuild_search_index(using)
+
+    logger.info("Building book documents")
+    build_documents(using)
+
+    logger.info("Updating catalogue statistics")
+    update_stats(using)
+
+    logger.info("Updating query planner statistics")
+    with connections[using].cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+    version = bump_version(using)
+    logger.info(f"Database import complete. Catalogue version {version.number}")
+
+
+def import_delta(logger, fixture_file_path: str, previous_fixture_path: str, using: str = 'default') -> None:
+    """Imports only the books that changed between two fixtures.
+
+    The database must contain the catalogue of the previous fixture.
+
+    :param logger: The logger used to log messages.
+    :param fixture_file_path: The path to the new fixture file.
+    :param previous_fixture_path: The path to the fixture that was imported last.
+    :param using: The database alias to import into.
+
+    :returns: None
+    """
+    for path in (fixture_file_path, previous_fixture_path):
+        if not os.path.exists(path):
+            logger.error(f"Fixture file {path} not found. Nothing imported.")
+            return
+
+    start = time.monotonic()
+    logger.info("Comparing fixtures")
+    delta = compute_delta(hash_snapshot(previous_fixture_path), hash_snapshot(fixture_file_path))
+    logger.info(f"{len(delta.added)} added, {len(delta.changed)} changed, {len(delta.removed)} removed books")
+
+    logger.info("Applying changes")
+    downloads = apply_delta(fixture_file_path, delta, using)
+    logger.info(f"{len(downloads)} download counts updated")
+    if not any(delta) and not downloads:
+        logger.info("Nothing to import")
+        return
+
+    logger.info("Updating search index")
+    rebuild_search_index(using, delta.added + delta.changed + delta.removed)
+
+    logger.info("Building book documents")
+    build_documents(using, delta.added + delta.changed)
+    # The documents include the download count, which is patched into the documents of unchanged books.
+    update_downloads(using, set(downloads) - set(delta.added + delta.changed))
+
+    logger.info("Updating catalogue statistics")
+    update_stats(using)
+
+    version = bump_version(using)
+    logger.info(f"Delta import complete in {time.monotonic() - start:.1f}s. Catalogue version {version.number}")
 
 
 class Command(BaseCommand):
@@ -237,6 +348,27 @@ class Command(BaseCommand):
             help="Clear all existing entries in the catalogue before import"
         )
 
+        parser.add_argument(
+            "--since",
+            metavar="PREVIOUS_FIXTURE",
+            help="Only import the books that were added, changed or removed since this fixture, "
+                 "which must be the one the database was last loaded from"
+        )
+
+        parser.add_argument(
+            "--staging",
+            action="store_true",
+            help="Import into a copy of the database and swap it in when the import is complete. "
+                 "Replaces the whole catalogue, like --clear, or with --since applies the changes to the copy. "
+                 "The API never sees a partial import. SQLite only"
+        )
+
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            help=f"Number of rows read from the fixture and inserted at a time ({DEFAULT_BATCH_SIZE} by default)"
+        )
+
     def handle(self, *args, **options) -> None:
         """Django management handler for load_catalogue.
 
@@ -249,4 +381,31 @@ class Command(BaseCommand):
         logger.setLevel(logging.INFO)
         logger.addHandler(handler)
 
-        import_catalogue(logger, options["path"], options["clear"])
+        since = options["since"]
+        if since and (options["clear"] or options["batch_size"] is not None):
+            raise CommandError("--since cannot be combined with --clear or --batch-size.")
+        batch_size = options["batch_size"] or DEFAULT_BATCH_SIZE
+
+        if not options["staging"]:
+            if since:
+                import_delta(logger, options["path"], since)
+            else:
+                import_catalogue(logger, options["path"], options["clear"], batch_size)
+            return
+
+        for path in (options["path"], since):
+            if path and not os.path.exists(path):
+                raise CommandError(f"Fixture file {path} not found. Nothing imported.")
+
+        try:
+            check_swappable()
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+
+        with staging_database() as alias:
+            logger.info(f"Importing into {connections.databases[alias]['NAME']}")
+            if since:
+                import_delta(logger, options["path"], since, using=alias)
+            else:
+                import_catalogue(logger, options["path"], True, batch_size, using=alias)
+        logger.info("Swapped the staging database in")
@@ -0,0 +1,87 @@
+from django.db import migrations
+
+# The search index as of this migration, see api/search.py. Later imports
+# rebuild it with `load_db`, so the migration only creates and fills it.
+
+AGENTS = """(SELECT {concat}(p.name, ' ') FROM api_book_agents ba
+    JOIN api_agent a ON a.id = ba.agent_id
+    JOIN api_person p ON p.id = a.person_id
+    WHERE ba.book_id = b.id)"""
+
+SUBJECTS = """(SELECT {concat}(s.name, ' ') FROM api_book_subjects bs
+    JOIN api_subject s ON s.id = bs.subject_id
+    WHERE bs.book_id = b.id)"""
+
+BOOKSHELVES = """(SELECT {concat}(sh.name, ' ') FROM api_book_bookshelves bsh
+    JOIN api_bookshelf sh ON sh.id = bsh.bookshelf_id
+    WHERE bsh.book_id = b.id)"""
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS api_book_fts USING fts5(
+    title, description, agents, subjects, bookshelves,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+SQLITE_INSERT = f"""
+INSERT INTO api_book_fts (rowid, title, description, agents, subjects, bookshelves)
+SELECT b.id, b.title, b.description,
+    {AGENTS.format(concat='group_concat')},
+    {SUBJECTS.format(concat='group_concat')},
+    {BOOKSHELVES.format(concat='group_concat')}
+FROM api_book b
+"""
+
+POSTGRES_CREATE = (
+    """
+    CREATE TABLE IF NOT EXISTS api_book_search (
+        book_id integer PRIMARY KEY,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS api_book_search_document_idx ON api_book_search USING gin (document)",
+)
+
+
+def weighted(weight, *columns):
+    text = " || ' ' || ".join(f"coalesce({column.format(concat='string_agg')}, '')" for column in columns)
+    return f"setweight(to_tsvector('simple', {text}), '{weight}')"
+
+
+POSTGRES_INSERT = f"""
+INSERT INTO api_book_search (book_id, document)
+SELECT b.id, {weighted('A', 'b.title')} || {weighted('B', AGENTS)}
+    || {weighted('C', SUBJECTS, BOOKSHELVES)} || {weighted('D', 'b.description')}
+FROM api_book b
+"""
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = (SQLITE_CREATE, "DELETE FROM api_book_fts", SQLITE_INSERT)
+    elif vendor == 'postgresql':
+        statements = (*POSTGRES_CREATE, "DELETE FROM api_book_search", POSTGRES_INSERT)
+    else:
+        return
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS api_book_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP TABLE IF EXISTS api_book_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
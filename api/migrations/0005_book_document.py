@@ -0,0 +1,21 @@
+# Generated by Django 4.2.29 on 2026-10-18 06:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_catalogue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookDocument',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='document', serialize=False, to='api.book')),
+                ('json', models.TextField()),
+            ],
+        ),
+    ]
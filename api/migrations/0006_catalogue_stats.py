@@ -0,0 +1,18 @@
+# Generated by Django 4.2.29 on 2026-10-18 07:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_book_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogue',
+            name='stats',
+            field=models.JSONField(null=True),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.29 on 2026-10-18 07:08
+
+import re
+
+from django.db import migrations, models
+
+# A copy of api.delta.YEAR, the year a birth or death date starts with.
+YEAR = re.compile(r'\s*(-?\d+)')
+
+
+def parse_year(date):
+    match = YEAR.match(date or '')
+    return int(match.group(1)) if match else None
+
+
+def fill_years(apps, schema_editor):
+    """Parses the years of the people imported before the year columns existed."""
+    Person = apps.get_model('api', 'Person')
+    people = Person.objects.using(schema_editor.connection.alias)
+    batch = []
+    for person in people.only('birth_date', 'death_date').iterator(chunk_size=5000):
+        person.birth_year = parse_year(person.birth_date)
+        person.death_year = parse_year(person.death_date)
+        if person.birth_year is not None or person.death_year is not None:
+            batch.append(person)
+        if len(batch) >= 5000:
+            people.bulk_update(batch, ('birth_year', 'death_year'))
+            batch = []
+    people.bulk_update(batch, ('birth_year', 'death_year'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_catalogue_stats'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='person',
+            name='person_birth_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='person',
+            name='person_death_date_idx',
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='birth_year',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='person',
+            name='death_year',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.RunPython(fill_years, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['birth_year'], name='person_birth_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='person',
+            index=models.Index(fields=['death_year'], name='person_death_year_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+# (index name, table, column) of the trigram indexes of the `icontains` lookups, see api/postgres.py
+TRIGRAM_INDEXES = (
+    ('book_title_trgm_idx', 'api_book', 'title'),
+    ('book_description_trgm_idx', 'api_book', 'description'),
+    ('person_name_trgm_idx', 'api_person', 'name'),
+    ('person_alias_trgm_idx', 'api_person', 'alias'),
+    ('person_webpage_trgm_idx', 'api_person', 'webpage'),
+    ('bookshelf_name_trgm_idx', 'api_bookshelf', 'name'),
+    ('subject_name_trgm_idx', 'api_subject', 'name'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" USING gin ((UPPER("{column}"::text)) gin_trgm_ops)')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # The extension is kept.
+    for name, _, _ in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_person_years'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
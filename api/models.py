@@ -11,10 +11,19 @@ class Person(models.Model):
     alias = models.CharField(max_length=MAX_UNKNOWN_LENGTH, null=True)
     birth_date = models.CharField(max_length=MAX_UNKNOWN_LENGTH, null=True)
     death_date = models.CharField(max_length=MAX_UNKNOWN_LENGTH, null=True)
+    # The years of birth_date and death_date, for filtering and ordering.
+    birth_year = models.IntegerField(null=True)
+    death_year = models.IntegerField(null=True)
     webpage = models.URLField(null=True)
 
     class Meta:
         ordering = ('-pk',)
+        indexes = [
+            models.Index(fields=['name'], name='person_name_idx'),
+            models.Index(fields=['alias'], name='person_alias_idx'),
+            models.Index(fields=['birth_year'], name='person_birth_year_idx'),
+            models.Index(fields=['death_year'], name='person_death_year_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name}"
@@ -36,6 +45,9 @@ class Agent(models.Model):
 
     class Meta:
         ordering = ('-pk',)
+        indexes = [
+            models.Index(fields=['type', 'person'], name='agent_type_person_idx'),
+        ]
 
     def __str__(self):
         if Person.objects.filter(pk=self.person).exists():
@@ -50,6 +62,9 @@ class Bookshelf(models.Model):
 
     class Meta:
         ordering = ('-pk',)
+        indexes = [
+            models.Index(fields=['name'], name='bookshelf_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name}"
@@ -71,6 +86,9 @@ class Subject(models.Model):
 
     class Meta:
         ordering = ('-pk',)
+        indexes = [
+            models.Index(fields=['name'], name='subject_name_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name}"
@@ -85,6 +103,11 @@ class Resource(models.Model):
 
     class Meta:
         ordering = ('-pk',)
+        indexes = [
+            models.Index(fields=['type'], name='resource_type_idx'),
+            models.Index(fields=['size'], name='resource_size_idx'),
+            models.Index(fields=['modified'], name='resource_modified_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name}"
@@ -106,6 +129,39 @@ class Book(models.Model):
 
     class Meta:
         ordering = ('-downloads',)
+        indexes = [
+            models.Index(fields=['-downloads', '-id'], name='book_downloads_idx'),
+            models.Index(fields=['type', '-downloads'], name='book_type_downloads_idx'),
+            models.Index(fields=['title'], name='book_title_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title}"
+
+
+class Catalogue(models.Model):
+    """Singleton row describing the imported catalogue.
+
+    The version is bumped after every import and is used to invalidate
+    anything derived from the catalogue tables. The statistics of the
+    catalogue are computed at import time as well.
+    """
+    version = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(null=True)
+    stats = models.JSONField(null=True)
+
+    def __str__(self):
+        return f"Catalogue v{self.version}"
+
+
+class BookDocument(models.Model):
+    """The pre-rendered JSON of a book, as BookSerializer outputs it.
+
+    Built by `load_db`, so book responses can be served without serializing
+    the book and its relations on every request.
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='document')
+    json = models.TextField()
+
+    def __str__(self):
+        return f"Document of book {self.book_id}"
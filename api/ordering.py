@@ -0,0 +1,21 @@
+"""Ordering by aliased fields
+
+`AliasedOrderingFilter` lets a viewset keep the ordering names of its API
+while ordering by other columns, e.g. `?ordering=birth_date` ordering
+people by the indexed integer `birth_year`.
+"""
+
+from rest_framework import filters
+
+
+class AliasedOrderingFilter(filters.OrderingFilter):
+    """Ordering filter mapping ordering names through the `ordering_aliases` dict of the view."""
+
+    def remove_invalid_fields(self, queryset, fields, view, request):
+        aliases = getattr(view, 'ordering_aliases', {})
+        ordering = []
+        for term in super().remove_invalid_fields(queryset, fields, view, request):
+            prefix = '-' if term.startswith('-') else ''
+            name = term.lstrip('-')
+            ordering.append(prefix + aliases.get(name, name))
+        return ordering
@@ -0,0 +1,334 @@
+"""Keyset pagination for the list endpoints
+
+Pages are addressed by an opaque cursor holding the ordering values of the
+last row served, so fetching a page is an index seek no matter how deep it is.
+The ordering is the one applied by the filters (or the model default), with
+the primary key appended to break ties.
+Counting the results is opt-in with `?count=true`.
+"""
+
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.db.models.constants import LOOKUP_SEP
+from django.template import loader
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _is_nullable(model, name: str) -> bool:
+    """Whether the values of an ordering field can be NULL.
+
+    :param model: The model being ordered.
+    :param name: Field name or lookup path. Annotations count as nullable.
+    :returns: True if the field can be NULL.
+    """
+    if name == 'pk':
+        return False
+
+    for part in name.split(LOOKUP_SEP):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return True
+        if field.null:
+            return True
+        if field.is_relation:
+            model = field.related_model
+    return False
+
+
+def _get_value(obj, name: str):
+    """Reads the value of an ordering field from a row.
+
+    :param obj: A model instance.
+    :param name: Field name or lookup path.
+    :returns: The value, None if any relation on the path is None.
+    """
+    for part in name.split(LOOKUP_SEP):
+        if obj is None:
+            return None
+        obj = getattr(obj, part)
+    return obj
+
+
+class KeysetPagination(BasePagination):
+    """Pagination on `(ordering fields..., pk)` with opaque cursors.
+
+    Descending fields sort NULLs last and ascending fields sort them first,
+    which is how SQLite orders its indexes.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+    template = 'rest_framework/pagination/previous_and_next.html'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.pk_name = queryset.model._meta.pk.attname
+        values, reverse = self.decode_cursor(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = self.count_rows(queryset)
+
+        results = self.fetch_rows(queryset, values, reverse)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            has_next, has_previous = values is not None, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        self.next_values = self.row_values(results[-1]) if has_next and results else None
+        self.previous_values = self.row_values(results[0]) if has_previous and results else None
+
+        if has_next and not results:
+            # Paged back past the first row: restart from the beginning.
+            self.next_values = []
+
+        self.display_page_controls = self.next_values is not None or self.previous_values is not None
+        return results
+
+    def count_rows(self, queryset) -> int:
+        return queryset.count()
+
+    def fetch_rows(self, queryset, values, reverse: bool) -> list:
+        """Fetches up to `page_size + 1` rows after the cursor.
+
+        :param queryset: The filtered queryset.
+        :param values: The keyset values of the cursor, None for the first page.
+        :param reverse: Fetch the rows before the cursor instead, last one first.
+        :returns: List of rows.
+        """
+        ordering = self.ordering
+        if reverse:
+            ordering = [(name, not descending, nullable) for name, descending, nullable in ordering]
+        queryset = queryset.order_by(*self.order_by(ordering))
+
+        results = []
+        for condition in self.segments(ordering, values):
+            limit = self.page_size + 1 - len(results)
+            segment = queryset if condition is None else queryset.filter(condition)
+            results.extend(segment[:limit])
+            if len(results) > self.page_size:
+                break
+        return results
+
+    def get_page_size(self, request) -> int:
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, queryset) -> list:
+        """Returns the keyset of a queryset.
+
+        :param queryset: The filtered queryset.
+        :returns: List of (name, descending, nullable) tuples ending in the pk.
+        """
+        names = queryset.query.order_by or queryset.model._meta.ordering or ('-pk',)
+        pk_name = queryset.model._meta.pk.name
+
+        ordering = []
+        for name in names:
+            if not isinstance(name, str):
+                raise ImproperlyConfigured(
+                    "KeysetPagination only supports orderings by field name.")
+            if name == '?':
+                continue
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            if name == pk_name:
+                name = 'pk'
+            ordering.append((name, descending, _is_nullable(queryset.model, name)))
+            if name == 'pk':
+                break
+        else:
+            descending = ordering[0][1] if ordering else True
+            ordering.append(('pk', descending, False))
+        return ordering
+
+    @staticmethod
+    def order_by(ordering) -> list:
+        """Builds the order_by expressions of a keyset.
+
+        :param ordering: List of (name, descending, nullable) tuples.
+        :returns: List of expressions.
+        """
+        expressions = []
+        for name, descending, nullable in ordering:
+            if not nullable:
+                expressions.append(F(name).desc() if descending else F(name).asc())
+            elif descending:
+                expressions.append(F(name).desc(nulls_last=True))
+            else:
+                expressions.append(F(name).asc(nulls_first=True))
+        return expressions
+
+    @classmethod
+    def after(cls, ordering, values):
+        """Matches the rows that come after `values` in the keyset order.
+
+        :param ordering: List of (name, descending, nullable) tuples.
+        :param values: The keyset values to start after.
+        :returns: A Q object, or None if no row can come after.
+        """
+        (name, descending, nullable), value = ordering[0], values[0]
+
+        if value is None:
+            strict = None if descending else Q(**{f'{name}__isnull': False})
+            equal = Q(**{f'{name}__isnull': True})
+        else:
+            strict = Q(**{f'{name}__lt' if descending else f'{name}__gt': value})
+            if descending and nullable:
+                strict |= Q(**{f'{name}__isnull': True})
+            equal = Q(**{name: value})
+
+        rest = cls.after(ordering[1:], values[1:]) if len(ordering) > 1 else None
+        if rest is None:
+            return strict
+        if strict is None:
+            return equal & rest
+        return strict | (equal & rest)
+
+    @classmethod
+    def segments(cls, ordering, values) -> list:
+        """Splits the rows after `values` into conditions that can seek an index.
+
+        The NULLs of the leading field are served by a separate condition so
+        that the first one stays a plain range on the index.
+
+        :param ordering: List of (name, descending, nullable) tuples.
+        :param values: The keyset values to start after, None for the first page.
+        :returns: The conditions to query in order. None matches every row.
+        """
+        if not values:
+            return [None]
+
+        (name, descending, nullable), value = ordering[0], values[0]
+        rest = cls.after(ordering[1:], values[1:]) if len(ordering) > 1 else None
+
+        if value is None:
+            segments = [] if rest is None else [Q(**{f'{name}__isnull': True}) & rest]
+            if not descending:
+                segments.append(Q(**{f'{name}__isnull': False}))
+            return segments
+
+        lookup = 'lt' if descending else 'gt'
+        strict = Q(**{f'{name}__{lookup}': value})
+        if rest is not None:
+            strict = Q(**{f'{name}__{lookup}e': value}) & (strict | (Q(**{name: value}) & rest))
+        segments = [strict]
+        if descending and nullable:
+            segments.append(Q(**{f'{name}__isnull': True}))
+        return segments
+
+    def row_values(self, obj) -> list:
+        if isinstance(obj, dict):
+            # A row of a values() queryset, which has the pk under its field name.
+            return [obj[self.pk_name if name == 'pk' else name] for name, _, _ in self.ordering]
+        return [_get_value(obj, name) for name, _, _ in self.ordering]
+
+    def decode_cursor(self, request):
+        """Reads the cursor of the request.
+
+        :param request: The request.
+        :returns: Tuple of (values, reverse). values is None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values, reverse, names = cursor['v'], bool(cursor['r']), cursor['o']
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+        if values and (names != [name for name, _, _ in self.ordering] or len(values) != len(names)):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, values, reverse: bool) -> str:
+        if not values:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+
+        cursor = {'v': values, 'r': reverse, 'o': [name for name, _, _ in self.ordering]}
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(cursor, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8'))
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded.decode('ascii'))
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        return self.encode_cursor(self.next_values, False)
+
+    def get_previous_link(self):
+        if self.previous_values is None:
+            return None
+        return self.encode_cursor(self.previous_values, True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {
+                    'type': 'integer',
+                    'example': 123,
+                },
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'previous': {
+                    'type': 'string',
+                    'nullable': True,
+                    'format': 'uri',
+                },
+                'results': schema,
+            },
+        }
+
+    def get_html_context(self):
+        return {
+            'previous_url': self.get_previous_link(),
+            'next_url': self.get_next_link(),
+        }
+
+    def to_html(self):
+        template = loader.get_template(self.template)
+        context = self.get_html_context()
+        return template.render(context)
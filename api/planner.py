@@ -0,0 +1,127 @@
+"""Query planning for the read-only viewsets
+
+Walks the fields of a serializer and works out which relations it is going
+to touch, so that the viewset queryset can fetch them up front with
+`select_related` and `prefetch_related` instead of one query per row.
+"""
+
+from collections import namedtuple
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import relations, serializers
+
+QueryPlan = namedtuple('QueryPlan', ('select_related', 'prefetch_related'))
+"""The relations a serializer needs.
+
+`select_related` is a tuple of lookups that can be joined.
+`prefetch_related` is a tuple of `(lookup, related_model, QueryPlan)` entries
+for the many valued relations, each with the plan of its own child serializer.
+"""
+
+EMPTY_PLAN = QueryPlan((), ())
+
+
+def _get_field(model, name: str):
+    """Finds a model field, or the reverse relation with the accessor `name`.
+
+    :param model: The model.
+    :param name: Field name or reverse accessor name.
+    :returns: The field or relation, None if there is none.
+    """
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        pass
+    for rel in model._meta.related_objects:
+        if rel.get_accessor_name() == name:
+            return rel
+    return None
+
+
+def _walk(fields, model, prefix, select, prefetch) -> None:
+    """Collects the relations used by `fields` into `select` and `prefetch`.
+
+    :param fields: The bound fields of a serializer.
+    :param model: The model the serializer represents.
+    :param prefix: Lookup prefix of `model` from the root model.
+    :param select: List of select_related lookups. Updated in place.
+    :param prefetch: List of prefetch entries. Updated in place.
+
+    :returns: None
+    """
+    for field in fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        model_field = _get_field(model, field.source_attrs[0])
+        if model_field is None or not model_field.is_relation:
+            continue
+
+        lookup = prefix + field.source_attrs[0]
+        related_model = model_field.related_model
+
+        if model_field.many_to_many or model_field.one_to_many:
+            if isinstance(field, serializers.ListSerializer):
+                child_plan = plan_serializer(field.child, related_model)
+            else:
+                child_plan = EMPTY_PLAN
+            prefetch.append((lookup, related_model, child_plan))
+        elif isinstance(field, serializers.BaseSerializer):
+            select.append(lookup)
+            if isinstance(field, serializers.Serializer):
+                _walk(field.fields, related_model, lookup + '__', select, prefetch)
+        elif isinstance(field, relations.RelatedField) and not field.use_pk_only_optimization():
+            select.append(lookup)
+
+
+def plan_serializer(serializer, model) -> QueryPlan:
+    """Works out the relations a serializer will touch on `model`.
+
+    :param serializer: A serializer instance (or `many=True` list serializer).
+    :param model: The model the serializer represents.
+
+    :returns: The QueryPlan for the serializer.
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    if not isinstance(serializer, serializers.Serializer):
+        return EMPTY_PLAN
+
+    select, prefetch = [], []
+    _walk(serializer.fields, model, '', select, prefetch)
+    return QueryPlan(tuple(select), tuple(prefetch))
+
+
+def apply_plan(queryset, plan: QueryPlan):
+    """Attaches the select_related and prefetch_related calls of a plan.
+
+    :param queryset: The queryset to plan.
+    :param plan: The QueryPlan to apply.
+
+    :returns: The planned queryset.
+    """
+    if plan.select_related:
+        queryset = queryset.select_related(*plan.select_related)
+
+    lookups = []
+    for lookup, related_model, child_plan in plan.prefetch_related:
+        if child_plan == EMPTY_PLAN:
+            lookups.append(lookup)
+        else:
+            lookups.append(Prefetch(lookup, queryset=apply_plan(
+                related_model._default_manager.all(), child_plan)))
+
+    if lookups:
+        queryset = queryset.prefetch_related(*lookups)
+    return queryset
+
+
+class PlannedQuerysetMixin:
+    """Viewset mixin that plans the queryset for the serializer in use."""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        plan = plan_serializer(self.get_serializer(), queryset.model)
+        return apply_plan(queryset, plan)
@@ -0,0 +1,86 @@
+"""PostgreSQL support
+
+`load_db` streams the fixture rows into PostgreSQL with `COPY` instead of
+multi-row INSERT statements, see `copy_instances` and `copy_rows`.
+
+The `*_contains` filters and the `?search=` of the smaller endpoints run
+`icontains` lookups, which Django translates to
+`UPPER(column::text) LIKE UPPER(%s)` on PostgreSQL. A B-tree index cannot
+answer a LIKE with a leading wildcard, so those columns get GIN indexes over
+the same expression with the `gin_trgm_ops` operator class of the pg_trgm
+extension. They are created by migration 0008, when the extension is available.
+"""
+
+from django.core.management.color import no_style
+from django.db import connections
+
+
+def copy_available(using: str = 'default') -> bool:
+    """Whether rows can be loaded into the database with COPY.
+
+    :param using: The database alias.
+    :returns: True for PostgreSQL connected with psycopg 3.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+    # Imports psycopg, which is only installed for PostgreSQL.
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    return is_psycopg3
+
+
+def copy_rows(model, columns, rows, using: str = 'default') -> None:
+    """Inserts rows of column values with one COPY statement.
+
+    :param model: The model whose table the rows are inserted into.
+    :param columns: The names of the columns, in the order of the row values.
+    :param rows: Iterable of row tuples.
+    :param using: The database alias.
+    :returns: None
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    names = ', '.join(quote_name(column) for column in columns)
+
+    with connection.cursor() as cursor:
+        with cursor.cursor.copy(f"COPY {quote_name(model._meta.db_table)} ({names}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+
+
+def copy_instances(model, instances, using: str = 'default') -> None:
+    """Inserts unsaved model instances with one COPY statement.
+
+    Like `bulk_create`, no signals are sent and `save()` is not called. An
+    auto-incremented primary key is left to its sequence when the first
+    instance has no primary key.
+
+    :param model: The model of the instances.
+    :param instances: The model instances.
+    :param using: The database alias.
+    :returns: None
+    """
+    if not instances:
+        return
+
+    connection = connections[using]
+    opts = model._meta
+    fields = [field for field in opts.concrete_fields
+              if not (field is opts.auto_field and instances[0].pk is None)]
+    copy_rows(model, [field.column for field in fields], (
+        [field.get_db_prep_save(getattr(instance, field.attname), connection) for field in fields]
+        for instance in instances
+    ), using)
+
+
+def reset_sequences(model_list, using: str = 'default') -> None:
+    """Moves the primary key sequences of models past their largest imported id.
+
+    :param model_list: The models.
+    :param using: The database alias.
+    :returns: None
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), model_list):
+            cursor.execute(sql)
@@ -0,0 +1,107 @@
+"""Renderers for the API"""
+
+import csv
+import io
+import re
+import uuid
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class RawJSON(str):
+    """A string holding a JSON value that is already rendered."""
+    __slots__ = ()
+
+
+class DocumentJSONRenderer(JSONRenderer):
+    """JSON renderer that splices RawJSON values into the output as they are.
+
+    Every RawJSON value is swapped for a unique marker string, the data is
+    rendered as usual and the quoted markers are then replaced by the raw JSON.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        raw = []
+        marker = uuid.uuid4().hex
+
+        def collect(value):
+            if isinstance(value, RawJSON):
+                raw.append(value)
+                return f"{marker}{len(raw) - 1}"
+            if isinstance(value, dict):
+                return {key: collect(item) for key, item in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [collect(item) for item in value]
+            return value
+
+        data = collect(data)
+        rendered = super().render(data, accepted_media_type, renderer_context)
+        if not raw:
+            return rendered
+
+        pattern = re.compile(rb'"%s(\d+)"' % marker.encode('ascii'))
+        return pattern.sub(lambda match: raw[int(match.group(1))].encode('utf-8'), rendered)
+
+
+class NDJSONRenderer(JSONRenderer):
+    """Renders a list of items as newline delimited JSON, one item per line."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render_rows(self, rows):
+        """Yields the encoded lines of `rows`.
+
+        :param rows: Iterable of items.
+        :returns: Iterator of bytes.
+        """
+        for row in rows:
+            yield super().render(row) + b'\n'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return b''.join(self.render_rows(data))
+
+
+class CSVRenderer(BaseRenderer):
+    """Renders a list of flat items as CSV with a header row.
+
+    Lists are joined with `|`. Nested objects are written as their values,
+    without the id, joined with ` / `.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+    separator = '|'
+
+    def flatten(self, value) -> str:
+        if value is None:
+            return ''
+        if isinstance(value, (list, tuple)):
+            return self.separator.join(self.flatten(item) for item in value)
+        if isinstance(value, dict):
+            return ' / '.join(self.flatten(item) for key, item in value.items() if key != 'id')
+        return str(value)
+
+    def render_rows(self, rows):
+        """Yields the encoded CSV lines of `rows`, starting with the header.
+
+        :param rows: Iterable of dicts with the same keys.
+        :returns: Iterator of bytes.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header = None
+        for row in rows:
+            if header is None:
+                header = list(row)
+                writer.writerow(header)
+            writer.writerow([self.flatten(row[name]) for name in header])
+            yield buffer.getvalue().encode(self.charset)
+            buffer.seek(0)
+            buffer.truncate()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return b''.join(self.render_rows(data))
@@ -0,0 +1,104 @@
+"""In-memory replica of the catalogue database
+
+With the `API_MEMORY_REPLICA` setting on, every server process copies the
+SQLite database into an in-memory database with the backup API, before its
+first request, and `ReplicaRouter` sends all reads there, over read-only
+connections. The catalogue is
+read-only between imports and tens of megabytes in size, so the copy is
+cheap and no query touches the disk afterwards.
+
+Reads of the Catalogue row still go to the database on disk, so the process
+notices new imports. When the catalogue version changes, the next request
+loads a fresh copy under a new name; the connections to the previous copy
+are closed by `api.sqlite.close_replaced_connections` at the start of
+their next request.
+
+Only requests load the replica. Management commands such as `load_db`
+always work on the database on disk.
+"""
+
+import itertools
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.db import connections
+
+from api import catalogue, models, sqlite
+
+REPLICA_ALIAS = 'replica'
+
+# (catalogue version, connection keeping the in-memory database alive)
+_replica = None
+_lock = threading.Lock()
+_counter = itertools.count(1)
+
+
+def load_replica(version, using: str = 'default') -> None:
+    """Copies a database into a new in-memory database and points the replica alias to it.
+
+    :param version: The catalogue version being copied.
+    :param using: The database alias to copy.
+    :returns: None
+    """
+    global _replica
+
+    # An in-memory database of the memdb VFS is shared by the connections of the process
+    # and lives as long as one of them is open. Unlike `mode=memory`, Django closes such
+    # connections normally, which lets them move to the next copy.
+    name = f"file:/catalogue-replica-{os.getpid()}-{next(_counter)}?vfs=memdb"
+    keeper = sqlite3.connect(name, uri=True, check_same_thread=False)
+    source = connections[using]
+    source.ensure_connection()
+    source.connection.backup(keeper)
+
+    settings_dict = connections.databases.get(REPLICA_ALIAS)
+    if settings_dict is None:
+        connections.databases[REPLICA_ALIAS] = {
+            **connections.databases[using], 'NAME': f"{name}&mode=ro", 'OPTIONS': {}}
+    else:
+        settings_dict['NAME'] = f"{name}&mode=ro"
+
+    previous, _replica = _replica, (version, keeper)
+    if previous is not None:
+        previous[1].close()
+
+
+def refresh_replica(**kwargs) -> None:
+    """Receiver of `request_started` loading the replica, or reloading it after an import.
+
+    :returns: None
+    """
+    if not settings.API_MEMORY_REPLICA:
+        return
+
+    version = catalogue.get_version()
+    if _replica is not None and _replica[0] == version:
+        return
+
+    with _lock:
+        if _replica is None or _replica[0] != version:
+            load_replica(version)
+    sqlite.close_replaced_connections()
+
+
+def invalidate() -> None:
+    """Drops the replica, so reads go to the database on disk again.
+
+    :returns: None
+    """
+    global _replica
+
+    previous, _replica = _replica, None
+    if previous is not None:
+        previous[1].close()
+
+
+class ReplicaRouter:
+    """Database router sending the reads of the catalogue to the in-memory replica once it is loaded."""
+
+    def db_for_read(self, model, **hints):
+        if settings.API_MEMORY_REPLICA and _replica is not None and model is not models.Catalogue:
+            return REPLICA_ALIAS
+        return None
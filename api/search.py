@@ -0,0 +1,222 @@
+"""Full text search over the book catalogue
+
+The search index holds the title, description, author names, subjects and
+bookshelves of every book, keyed by the book id. On SQLite it is an FTS5
+table, on PostgreSQL a table of weighted `tsvector` documents with a GIN
+index. It is rebuilt by `load_db` after every import.
+On other database backends the search filter falls back to the
+default `icontains` based search.
+"""
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from api import models
+
+SEARCH_TABLE = 'api_book_fts'
+TSVECTOR_TABLE = 'api_book_search'
+
+# Column weights for bm25(): title, description, agents, subjects, bookshelves
+RANK_WEIGHTS = (10.0, 1.0, 5.0, 2.0, 2.0)
+
+# The same weights for ts_rank(), by tsvector weight D, C, B, A:
+# description, subjects and bookshelves, agents, title
+TSVECTOR_RANK_WEIGHTS = (0.1, 0.2, 0.5, 1.0)
+
+# Text search configuration of the tsvector documents. Like the FTS5 tokenizer it does no stemming.
+TSVECTOR_CONFIG = 'simple'
+
+
+def search_index_available(using: str = 'default') -> bool:
+    """Whether the database supports the full text search index.
+
+    :param using: The database alias.
+    :returns: True if the index can be used.
+    """
+    return connections[using].vendor in ('sqlite', 'postgresql')
+
+
+def create_search_index(cursor) -> None:
+    """Creates the FTS5 table, or the tsvector table on PostgreSQL, if it does not exist.
+
+    :param cursor: A cursor to an SQLite or PostgreSQL database.
+    :returns: None
+    """
+    if cursor.db.vendor == 'postgresql':
+        # Like the FTS5 table, without a foreign key, so flushing the book table does not cascade.
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TSVECTOR_TABLE} (
+            book_id integer PRIMARY KEY,
+            document tsvector NOT NULL
+        )
+        """)
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TSVECTOR_TABLE}_document_idx ON {TSVECTOR_TABLE} USING gin (document)")
+        return
+
+    cursor.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        title, description, agents, subjects, bookshelves,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """)
+
+
+def drop_search_index(cursor) -> None:
+    """Drops the search index table.
+
+    :param cursor: A cursor to an SQLite or PostgreSQL database.
+    :returns: None
+    """
+    table = TSVECTOR_TABLE if cursor.db.vendor == 'postgresql' else SEARCH_TABLE
+    cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def rebuild_search_index(using: str = 'default', book_ids=None) -> None:
+    """Repopulates the search index from the catalogue tables.
+
+    :param using: The database alias.
+    :param book_ids: Only reindex these books. Books that no longer exist are
+        removed from the index. Reindexes everything if None.
+    :returns: None
+    """
+    if not search_index_available(using):
+        return
+
+    book = models.Book._meta.db_table
+    agents = models.Book.agents.through._meta.db_table
+    subjects = models.Book.subjects.through._meta.db_table
+    bookshelves = models.Book.bookshelves.through._meta.db_table
+    agent = models.Agent._meta.db_table
+    person = models.Person._meta.db_table
+    subject = models.Subject._meta.db_table
+    bookshelf = models.Bookshelf._meta.db_table
+
+    if book_ids is None:
+        chunks = [None]
+    else:
+        book_ids = list(book_ids)
+        chunks = [book_ids[i:i + 500] for i in range(0, len(book_ids), 500)]
+
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        table, key, concat = TSVECTOR_TABLE, 'book_id', 'string_agg'
+    else:
+        table, key, concat = SEARCH_TABLE, 'rowid', 'group_concat'
+
+    columns = {
+        'title': "b.title",
+        'description': "b.description",
+        'agents': f"""(SELECT {concat}(p.name, ' ') FROM {agents} ba
+            JOIN {agent} a ON a.id = ba.agent_id
+            JOIN {person} p ON p.id = a.person_id
+            WHERE ba.book_id = b.id)""",
+        'subjects': f"""(SELECT {concat}(s.name, ' ') FROM {subjects} bs
+            JOIN {subject} s ON s.id = bs.subject_id
+            WHERE bs.book_id = b.id)""",
+        'bookshelves': f"""(SELECT {concat}(sh.name, ' ') FROM {bookshelves} bsh
+            JOIN {bookshelf} sh ON sh.id = bsh.bookshelf_id
+            WHERE bsh.book_id = b.id)""",
+    }
+    if connection.vendor == 'postgresql':
+        def weighted(weight, *names):
+            text = " || ' ' || ".join(f"coalesce({columns[name]}, '')" for name in names)
+            return f"setweight(to_tsvector('{TSVECTOR_CONFIG}', {text}), '{weight}')"
+
+        insert = f"""
+        INSERT INTO {TSVECTOR_TABLE} (book_id, document)
+        SELECT b.id, {weighted('A', 'title')} || {weighted('B', 'agents')}
+            || {weighted('C', 'subjects', 'bookshelves')} || {weighted('D', 'description')}
+        FROM {book} b"""
+    else:
+        insert = f"""
+        INSERT INTO {SEARCH_TABLE} (rowid, title, description, agents, subjects, bookshelves)
+        SELECT b.id, {columns['title']}, {columns['description']},
+            {columns['agents']}, {columns['subjects']}, {columns['bookshelves']}
+        FROM {book} b"""
+
+    with connection.cursor() as cursor:
+        create_search_index(cursor)
+        for chunk in chunks:
+            if chunk is None:
+                keys, where, params = "", "", ()
+            else:
+                placeholders = ', '.join(['%s'] * len(chunk))
+                keys = f" WHERE {key} IN ({placeholders})"
+                where = f" WHERE b.id IN ({placeholders})"
+                params = tuple(chunk)
+            cursor.execute(f"DELETE FROM {table}{keys}", params)
+            cursor.execute(insert + where, params)
+
+
+def build_match_query(terms) -> str:
+    """Builds an FTS5 query matching books that contain every term.
+
+    Each term is quoted as a phrase and matched as a prefix, similar to the
+    substring matching of the default search.
+
+    :param terms: The search terms.
+    :returns: The FTS5 MATCH expression.
+    """
+    return ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def build_tsquery(terms) -> str:
+    """Builds a `to_tsquery` query matching books that contain every term, as a prefix.
+
+    :param terms: The search terms.
+    :returns: The tsquery text.
+    """
+    return ' & '.join("'{}':*".format(term.replace('\\', '\\\\').replace("'", "''")) for term in terms)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """Search filter backed by the full text search index.
+
+    Add `?rank=true` to order the results by relevance, bm25 on SQLite and ts_rank on PostgreSQL.
+    """
+    rank_param = 'rank'
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms or not search_index_available(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+        rank = request.query_params.get(self.rank_param, '').lower() in ('1', 'true')
+
+        if connections[queryset.db].vendor == 'postgresql':
+            return self.filter_tsvector(queryset, build_tsquery(search_terms), rank)
+
+        match = build_match_query(search_terms)
+        queryset = queryset.filter(pk__in=RawSQL(
+            f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", (match,)))
+
+        if rank:
+            weights = ', '.join(map(str, RANK_WEIGHTS))
+            table = queryset.model._meta.db_table
+            queryset = queryset.annotate(search_rank=RawSQL(
+                f"SELECT bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} "
+                f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = {table}.id", (match,)
+            )).order_by('search_rank', 'pk')
+        return queryset
+
+    def filter_tsvector(self, queryset, query: str, rank: bool):
+        """Filters the books with the tsvector index of PostgreSQL.
+
+        :param queryset: The book queryset.
+        :param query: The tsquery text.
+        :param rank: Whether to order the books by ts_rank.
+        :returns: The filtered queryset.
+        """
+        tsquery = f"to_tsquery('{TSVECTOR_CONFIG}', %s)"
+        queryset = queryset.filter(pk__in=RawSQL(
+            f"SELECT book_id FROM {TSVECTOR_TABLE} WHERE document @@ {tsquery}", (query,)))
+
+        if rank:
+            weights = ', '.join(map(str, TSVECTOR_RANK_WEIGHTS))
+            table = queryset.model._meta.db_table
+            queryset = queryset.annotate(search_rank=RawSQL(
+                f"SELECT ts_rank('{{{weights}}}', document, {tsquery}) FROM {TSVECTOR_TABLE} "
+                f"WHERE book_id = {table}.id", (query,)
+            )).order_by('-search_rank', 'pk')
+        return queryset
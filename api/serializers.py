@@ -1,5 +1,50 @@
 from rest_framework import serializers
 from . import models
+from .planner import apply_plan, plan_serializer
+from .renderers import RawJSON
+
+
+class DynamicFieldsMixin:
+    """
+    Serializer mixin for the `fields`, `exclude` and `expand` query parameters,
+    which take comma separated field names.
+    `expand` replaces the fields listed in `expandable_fields` by their expanded
+    serializer, then `fields` and `exclude` trim the output.
+    Only the serializer of the view is affected, not the nested ones.
+    """
+    field_params = ('fields', 'exclude', 'expand')
+    expandable_fields = {}
+
+    @classmethod
+    def has_field_params(cls, request) -> bool:
+        return request is not None and any(request.query_params.get(param) for param in cls.field_params)
+
+    @staticmethod
+    def get_param(request, param: str, known) -> list:
+        names = [name for name in request.query_params.get(param, '').split(',') if name]
+        unknown = [name for name in names if name not in known]
+        if unknown:
+            raise serializers.ValidationError({param: [f"Unknown field: {name}" for name in unknown]})
+        return names
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        nested = self.parent is not None and not (
+            isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None)
+        if nested or not self.has_field_params(request):
+            return fields
+
+        known = set(fields) | set(self.expandable_fields)
+        for name in self.get_param(request, 'expand', self.expandable_fields):
+            fields[name] = self.expandable_fields[name]()
+
+        only = self.get_param(request, 'fields', known)
+        if only:
+            fields = {name: field for name, field in fields.items() if name in only}
+        for name in self.get_param(request, 'exclude', known):
+            fields.pop(name, None)
+        return fields
 
 
 class PersonSerializer(serializers.ModelSerializer):
@@ -14,10 +59,19 @@ class AgentTypeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class AgentSerializer(serializers.ModelSerializer):
+class AgentBookSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+
+
+class AgentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     person = PersonSerializer()
     type = AgentTypeSerializer()
 
+    expandable_fields = {
+        'books': lambda: AgentBookSerializer(many=True, source='book_set'),
+    }
+
     class Meta:
         model = models.Agent
         fields = '__all__'
@@ -47,7 +101,13 @@ class ResourceSerializer(serializers.ModelSerializer):
         fields = ('id', 'uri', 'type', 'size', 'modified')
 
 
-class BookSerializer(serializers.ModelSerializer):
+class ExpandedBookAgentSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    person = PersonSerializer()
+    type = serializers.SlugRelatedField(read_only=True, slug_field="name")
+
+
+class BookSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     subjects = serializers.SlugRelatedField(many=True, read_only=True, slug_field="name")
     bookshelves = serializers.SlugRelatedField(many=True, read_only=True, slug_field="name")
 
@@ -63,7 +123,133 @@ class BookSerializer(serializers.ModelSerializer):
         type = serializers.CharField()
     resources = BookResourceSerializer(many=True)
 
+    expandable_fields = {
+        'agents': lambda: ExpandedBookAgentSerializer(many=True),
+        'resources': lambda: ResourceSerializer(many=True),
+    }
+
     class Meta:
         model = models.Book
         fields = ('id', 'type', 'title', 'description', 'downloads', 'license', 'subjects',
                   'bookshelves', 'languages', 'agents', 'resources')
+
+
+class BookDocumentListSerializer(serializers.ListSerializer):
+    """Serializes the books of a page without a document with one planned query."""
+
+    def to_representation(self, data):
+        books = list(data)
+        missing = [book.pk for book in books if not hasattr(book, 'document')]
+        fallback = {}
+        if missing:
+            serializer = BookSerializer(many=True, context=self.context)
+            queryset = models.Book.objects.using(books[0]._state.db).filter(pk__in=missing)
+            fallback_books = list(apply_plan(queryset, plan_serializer(serializer, models.Book)))
+            fallback = dict(zip((book.pk for book in fallback_books), serializer.to_representation(fallback_books)))
+        return [fallback[book.pk] if book.pk in fallback else RawJSON(book.document.json) for book in books]
+
+
+class BookDocumentSerializer(serializers.BaseSerializer):
+    """
+    Serves books from their pre-rendered BookDocument.
+    The queryset should select the related document.
+    Books without a document are serialized with BookSerializer.
+    """
+
+    class Meta:
+        list_serializer_class = BookDocumentListSerializer
+
+    def to_representation(self, instance):
+        try:
+            return RawJSON(instance.document.json)
+        except models.BookDocument.DoesNotExist:
+            return BookSerializer(instance, context=self.context).data
+
+
+class ValuesSerializer(serializers.BaseSerializer):
+    """
+    Base of the fast path serializers, which read the rows of a `.values()`
+    queryset into plain dicts instead of going through model instances and
+    serializer fields.
+    `fields` are copied as they are, except for the ones with a converter in `converters`.
+    `value_fields` are the fields the queryset must select.
+    The output must stay identical to the matching ModelSerializer.
+    """
+    fields = ()
+    value_fields = ()
+    converters = {}
+
+    def to_representation(self, row):
+        converters = self.converters
+        data = {}
+        for name in self.fields:
+            value = row[name]
+            if value is not None and name in converters:
+                value = converters[name](value)
+            data[name] = value
+        return data
+
+
+class FastPersonSerializer(ValuesSerializer):
+    fields = PersonSerializer.Meta.fields
+    # The years are the ordering columns of `?ordering=birth_date`, which the cursors read.
+    value_fields = ('id',) + fields + ('birth_year', 'death_year')
+
+
+class FastResourceSerializer(ValuesSerializer):
+    fields = ResourceSerializer.Meta.fields
+    value_fields = fields
+    converters = {'modified': serializers.DateTimeField().to_representation}
+
+
+class FastBookListSerializer(serializers.ListSerializer):
+    """Fetches the relations of all books on the page with one query per relation."""
+
+    def to_representation(self, data):
+        rows = list(data)
+        return [self.child.to_representation(row) for row in self.child.add_relations(rows)]
+
+
+class FastBookSerializer(ValuesSerializer):
+    fields = BookSerializer.Meta.fields
+    value_fields = ('id', 'type', 'title', 'description', 'downloads', 'license')
+    relations = ('subjects', 'bookshelves', 'languages', 'agents', 'resources')
+
+    class Meta:
+        list_serializer_class = FastBookListSerializer
+
+    @classmethod
+    def add_relations(cls, rows) -> list:
+        """
+        Returns copies of book rows with their relations, in the order BookSerializer lists them.
+        """
+        rows = [{**row, **{relation: [] for relation in cls.relations}} for row in rows]
+        books = {row['id']: row for row in rows}
+        ids = list(books)
+        if not ids:
+            return rows
+
+        Book = models.Book
+        for book_id, name in Book.subjects.through.objects.filter(
+                book_id__in=ids).order_by('-subject_id').values_list('book_id', 'subject__name'):
+            books[book_id]['subjects'].append(name)
+        for book_id, name in Book.bookshelves.through.objects.filter(
+                book_id__in=ids).order_by('-bookshelf_id').values_list('book_id', 'bookshelf__name'):
+            books[book_id]['bookshelves'].append(name)
+        for book_id, name in Book.languages.through.objects.filter(
+                book_id__in=ids).order_by('-language_id').values_list('book_id', 'language_id'):
+            books[book_id]['languages'].append(name)
+        for book_id, id, person, type in Book.agents.through.objects.filter(
+                book_id__in=ids).order_by('-agent_id').values_list(
+                    'book_id', 'agent_id', 'agent__person__name', 'agent__type_id'):
+            books[book_id]['agents'].append({'id': id, 'person': person, 'type': type})
+        for book_id, id, uri, type in Book.resources.through.objects.filter(
+                book_id__in=ids).order_by('-resource_id').values_list(
+                    'book_id', 'resource_id', 'resource__uri', 'resource__type'):
+            books[book_id]['resources'].append({'id': id, 'uri': uri, 'type': type})
+        return rows
+
+    def to_representation(self, row):
+        if 'resources' not in row:
+            row, = self.add_relations([row])
+        return super().to_representation(row)
@@ -0,0 +1,58 @@
+"""SQLite connection tuning
+
+`configure_connection` runs the PRAGMA statements of the `SQLITE_PRAGMAS`
+setting on every new SQLite connection, e.g. a larger page cache and
+memory mapped reads for the production profile.
+
+With persistent connections (`CONN_MAX_AGE`), a connection would keep
+reading the old database file after `load_db --staging` renames a new one
+over it, or the old in-memory copy after `api.replica` loads a new one.
+`close_replaced_connections` runs at the start of every request and closes
+the connections whose file was replaced or whose database NAME changed, so
+the request opens the new catalogue.
+"""
+
+import os
+
+from django.conf import settings
+from django.db import connections
+
+
+def _get_database(connection) -> tuple:
+    """Returns the NAME of the database of a connection and the inode of its file, None if it has no file."""
+    name = connection.settings_dict['NAME']
+    if connection.is_in_memory_db():
+        return name, None
+    try:
+        return name, os.stat(name).st_ino
+    except OSError:
+        return name, None
+
+
+def configure_connection(sender, connection, **kwargs) -> None:
+    """Receiver of `connection_created` applying `SQLITE_PRAGMAS` to SQLite connections.
+
+    :param sender: The database wrapper class.
+    :param connection: The new connection.
+    :returns: None
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+    connection.sqlite_database = _get_database(connection)
+
+
+def close_replaced_connections(**kwargs) -> None:
+    """Receiver of `request_started` closing the SQLite connections whose database was replaced.
+
+    :returns: None
+    """
+    for connection in connections.all(initialized_only=True):
+        database = getattr(connection, 'sqlite_database', None)
+        if database is not None and connection.connection is not None and _get_database(connection) != database:
+            connection.close()
@@ -0,0 +1,89 @@
+"""Blue/green catalogue imports for SQLite
+
+A staging import copies the live database to a separate file, imports into
+the copy through a temporary database alias and finally renames the copy over
+the live file. The rename is atomic, so the API either sees the old or the new
+catalogue and never a partially loaded one.
+
+Connections opened before the swap keep reading the old file until they are
+closed, which happens after every request, or at the start of the next one
+with CONN_MAX_AGE (see `api.sqlite`).
+"""
+
+import os
+import sqlite3
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+STAGING_ALIAS = 'staging'
+
+
+def get_staging_path(using: str = 'default') -> str:
+    """Returns the path of the staging copy of a database.
+
+    :param using: The database alias of the live database.
+    :returns: The path of the staging file.
+    """
+    return f"{connections.databases[using]['NAME']}.staging"
+
+
+def check_swappable(using: str = 'default') -> None:
+    """Raises ImproperlyConfigured if the database cannot be swapped with a rename.
+
+    :param using: The database alias of the live database.
+    :returns: None
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        raise ImproperlyConfigured("Staging imports need a file based SQLite database.")
+
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        journal_mode, = cursor.fetchone()
+    if journal_mode.lower() == 'wal':
+        # Readers of the old file share the -wal and -shm files with the new one.
+        raise ImproperlyConfigured("Staging imports cannot replace a database in WAL mode.")
+
+
+@contextmanager
+def staging_database(using: str = 'default'):
+    """Provides a staging copy of a live SQLite database and swaps it in on success.
+
+    The copy keeps the schema and every non-catalogue table of the live
+    database. Nothing is swapped if the block raises.
+
+    :param using: The database alias of the live database.
+    :returns: A context manager yielding the alias of the staging database.
+    """
+    check_swappable(using)
+
+    live_path = str(connections.databases[using]['NAME'])
+    staging_path = get_staging_path(using)
+    if os.path.exists(staging_path):
+        os.remove(staging_path)
+
+    live = connections[using]
+    live.ensure_connection()
+    target = sqlite3.connect(staging_path)
+    try:
+        live.connection.backup(target)
+    finally:
+        target.close()
+
+    settings_dict = connections.databases[using]
+    # Drop a read-only connection URI, which would open the live file instead of the copy.
+    options = {key: value for key, value in settings_dict.get('OPTIONS', {}).items() if key != 'database'}
+    connections.databases[STAGING_ALIAS] = {**settings_dict, 'NAME': staging_path, 'OPTIONS': options}
+    try:
+        yield STAGING_ALIAS
+        connections[STAGING_ALIAS].close()
+        live.close()
+        os.replace(staging_path, live_path)
+    finally:
+        connections[STAGING_ALIAS].close()
+        del connections[STAGING_ALIAS]
+        del connections.databases[STAGING_ALIAS]
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
@@ -0,0 +1,84 @@
+"""Catalogue statistics
+
+The statistics are computed by `load_db` after every import and stored on
+the Catalogue row, so serving them never scans the catalogue tables.
+`get_stats` keeps them in process memory until the catalogue version changes.
+"""
+
+from django.db.models import Count
+
+from api import catalogue, models
+
+TOP_DOWNLOADS = 10
+
+_stats = None
+
+
+def compute_stats(using: str = 'default') -> dict:
+    """Computes the statistics of the catalogue.
+
+    :param using: The database alias.
+    :returns: A dict of the counts of every table, the number of books per
+        language and per type, and the most downloaded books.
+    """
+    books = models.Book.objects.using(using)
+    Languages = models.Book.languages.through
+
+    return {
+        'counts': {
+            'books': books.count(),
+            'people': models.Person.objects.using(using).count(),
+            'bookshelves': models.Bookshelf.objects.using(using).count(),
+            'subjects': models.Subject.objects.using(using).count(),
+            'resources': models.Resource.objects.using(using).count(),
+            'languages': models.Language.objects.using(using).count(),
+        },
+        'languages': [
+            {'name': name, 'books': count}
+            for name, count in Languages.objects.using(using).values_list('language_id').annotate(
+                count=Count('book_id')).order_by('-count', 'language_id')
+        ],
+        'types': [
+            {'name': name, 'books': count}
+            for name, count in books.values_list('type').annotate(
+                count=Count('id')).order_by('-count', 'type')
+        ],
+        'top_downloads': list(books.filter(downloads__isnull=False).order_by(
+            '-downloads', '-id').values('id', 'title', 'downloads')[:TOP_DOWNLOADS]),
+    }
+
+
+def update_stats(using: str = 'default') -> dict:
+    """Computes the statistics and stores them on the Catalogue row.
+
+    :param using: The database alias.
+    :returns: The statistics.
+    """
+    stats = compute_stats(using)
+    models.Catalogue.objects.using(using).update_or_create(pk=1, defaults={'stats': stats})
+    return stats
+
+
+def get_stats() -> dict:
+    """Returns the statistics of the current catalogue.
+
+    Computes them if the catalogue was imported before statistics were stored.
+
+    :returns: The statistics.
+    """
+    global _stats
+
+    version = catalogue.get_version()
+    if _stats is None or _stats[0] != version:
+        stored = models.Catalogue.objects.filter(pk=1).values_list('stats', flat=True).first()
+        _stats = (version, stored if stored is not None else compute_stats())
+    return _stats[1]
+
+
+def invalidate() -> None:
+    """Forgets the statistics kept in memory.
+
+    :returns: None
+    """
+    global _stats
+    _stats = None
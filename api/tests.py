@@ -1,3 +1,1032 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+import pytz
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api import async_views, bitmaps, catalogue, models, postgres, replica, sqlite, staging, stats
+from api.delta import compute_delta, hash_snapshot, parse_year
+from api.documents import build_documents
+from api.management.commands.load_db import import_catalogue, import_delta
+from api.search import rebuild_search_index
+
+FIXTURE_SCHEMA = """
+CREATE TABLE Book (id INTEGER PRIMARY KEY, format TEXT, title TEXT, description TEXT, license TEXT, downloads INTEGER);
+CREATE TABLE AgentType (name TEXT PRIMARY KEY);
+CREATE TABLE Person (id INTEGER PRIMARY KEY, name TEXT, alias TEXT, birth_date TEXT, death_date TEXT, webpage TEXT);
+CREATE TABLE Agent (id INTEGER PRIMARY KEY, person INTEGER, type TEXT);
+CREATE TABLE Bookshelf (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE Subject (id INTEGER PRIMARY KEY, name TEXT);
+CREATE TABLE Language (name TEXT PRIMARY KEY);
+CREATE TABLE Resource (id INTEGER PRIMARY KEY, url TEXT, size INTEGER, modified TEXT, type TEXT);
+CREATE TABLE Book_Subject (book INTEGER, subject INTEGER);
+CREATE TABLE Book_Agent (book INTEGER, agent INTEGER);
+CREATE TABLE Book_Resource (book INTEGER, resource INTEGER);
+CREATE TABLE Book_Language (book INTEGER, language TEXT);
+CREATE TABLE Book_Bookshelf (book INTEGER, bookshelf INTEGER);
+"""
+
+
+def create_catalogue(book_count: int) -> None:
+    """Creates a small catalogue where every book has all of its relations.
+
+    :param book_count: The number of books to create.
+    :returns: None
+    """
+    author = models.AgentType.objects.create(name="Author")
+    editor = models.AgentType.objects.create(name="Editor")
+    english = models.Language.objects.create(name="en")
+    french = models.Language.objects.create(name="fr")
+
+    for i in range(1, book_count + 1):
+        book = models.Book.objects.create(
+            id=i, type="Text", title=f"Book {i}", description=f"Description {i}",
+            downloads=i * 10, license="http://www.gutenberg.org/license")
+
+        person = models.Person.objects.create(
+            name=f"Person {i}", alias=f"Alias {i}", birth_date=str(1800 + i), birth_year=1800 + i,
+            death_date=str(1870 + i), death_year=1870 + i, webpage=f"https://example.org/{i}")
+        book.agents.add(
+            models.Agent.objects.create(person=person, type=author),
+            models.Agent.objects.create(person=person, type=editor))
+        book.subjects.add(
+            models.Subject.objects.create(id=i, name=f"Subject {i}"))
+        book.bookshelves.add(
+            models.Bookshelf.objects.create(id=i, name=f"Bookshelf {i}"))
+        book.languages.add(english if i % 2 else french)
+        book.resources.add(
+            models.Resource.objects.create(
+                id=2 * i, uri=f"https://www.gutenberg.org/ebooks/{i}.txt", size=i,
+                modified=datetime(2022, 1, 1, tzinfo=pytz.UTC), type="text/plain"),
+            models.Resource.objects.create(
+                id=2 * i + 1, uri=f"https://www.gutenberg.org/ebooks/{i}.epub", size=i,
+                modified=datetime(2022, 1, 1, tzinfo=pytz.UTC), type="application/epub+zip"))
+
+
+def create_fixture(path: str, book_count: int) -> None:
+    """Writes a fixture database like the one books_db creates.
+
+    :param path: The path of the SQLite file.
+    :param book_count: The number of books, each with one author, subject,
+        bookshelf, language and resource.
+    :returns: None
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript(FIXTURE_SCHEMA)
+    conn.execute("INSERT INTO AgentType VALUES ('Author')")
+    conn.execute("INSERT INTO Language VALUES ('en')")
+    for i in range(1, book_count + 1):
+        conn.execute("INSERT INTO Book VALUES (?, 'Text', ?, NULL, 'Public domain', ?)", (i, f"Book {i}", i))
+        conn.execute("INSERT INTO Person VALUES (?, ?, NULL, '1800', '1870', NULL)", (i, f"Person {i}"))
+        conn.execute("INSERT INTO Agent VALUES (?, ?, 'Author')", (i, i))
+        conn.execute("INSERT INTO Subject VALUES (?, ?)", (i, f"Subject {i}"))
+        conn.execute("INSERT INTO Bookshelf VALUES (?, ?)", (i, f"Bookshelf {i}"))
+        conn.execute("INSERT INTO Resource VALUES (?, ?, 10, '2022-01-01T00:00:00.123', 'text/plain')",
+                     (i, f"https://www.gutenberg.org/ebooks/{i}.txt"))
+        for table, value in (("Agent", i), ("Subject", i), ("Bookshelf", i), ("Resource", i), ("Language", "en")):
+            conn.execute(f"INSERT INTO Book_{table} VALUES (?, ?)", (i, value))
+    conn.commit()
+    conn.close()
+
+
+class APITestCase(TestCase):
+    """Starts every test with empty response caches."""
+
+    def setUp(self):
+        self.client = APIClient()
+        catalogue.invalidate()
+        stats.invalidate()
+        bitmaps.invalidate()
+        caches["api"].clear()
+
+
+@override_settings(API_RESPONSE_CACHE=None, API_BOOK_DOCUMENTS=False, API_FAST_SERIALIZERS=False)
+class QueryPlanTests(APITestCase):
+    """The number of queries must not depend on the number of rows served."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(12)
+
+    def test_book_list_query_count_is_constant(self):
+        # books + subjects + bookshelves + languages + agents + resources
+        for page_size in (1, 10, 12):
+            with self.assertNumQueries(6):
+                response = self.client.get("/api/book/", {"page_size": page_size})
+            self.assertEqual(len(response.data["results"]), page_size)
+
+    def test_book_detail(self):
+        with self.assertNumQueries(6):
+            response = self.client.get("/api/book/3/")
+        self.assertEqual(response.data["subjects"], ["Subject 3"])
+        self.assertEqual(response.data["languages"], ["en"])
+        self.assertEqual(
+            sorted((agent["person"], agent["type"]) for agent in response.data["agents"]),
+            [("Person 3", "Author"), ("Person 3", "Editor")])
+
+    def test_agent_list_query_count_is_constant(self):
+        # agents joined with person and type
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/agent/")
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertEqual(response.data["results"][0]["person"]["name"], "Person 12")
+
+
+class FullTextSearchTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(12)
+        models.Book.objects.filter(pk=3).update(title="Pride and Préjudice")
+        models.Person.objects.filter(agent__book=5).update(name="Austen, Jane")
+        rebuild_search_index()
+
+    def search(self, query):
+        response = self.client.get("/api/book/", {"search": query})
+        return [book["id"] for book in response.data["results"]]
+
+    @skipUnless(connection.vendor == 'sqlite', "The tsvector index of PostgreSQL keeps diacritics")
+    def test_search_title_ignores_case_and_diacritics(self):
+        self.assertEqual(self.search("PREJUDICE"), [3])
+
+    def test_search_author_prefix(self):
+        self.assertEqual(self.search("aust"), [5])
+        self.assertEqual(self.search("PRIDE"), [3])
+
+    def test_search_requires_every_term(self):
+        self.assertEqual(self.search("Subject 7"), [7])
+        self.assertEqual(self.search("pride austen"), [])
+
+    def test_rank_ordering(self):
+        models.Book.objects.filter(pk=9).update(description="bookshelf")
+        rebuild_search_index()
+        catalogue.bump_version()
+        response = self.client.get("/api/book/", {"search": "bookshelf 9", "rank": "true"})
+        self.assertEqual([book["id"] for book in response.data["results"]], [9])
+        response = self.client.get("/api/book/", {"search": "bookshelf", "rank": "true", "count": "true"})
+        self.assertEqual(response.data["count"], 12)
+        self.assertEqual(response.data["results"][0]["id"], 9)
+
+
+class ExplainFiltersTests(TestCase):
+
+    def test_indexed_filters_do_not_scan(self):
+        stdout = StringIO()
+        call_command("explain_filters", stdout=stdout)
+        report = stdout.getvalue().split("queries scan a whole table:")[-1]
+        self.assertNotIn("book?type:", report)
+        self.assertNotIn("book?has_resource_type:", report)
+        self.assertIn("book?title_contains:", report)
+
+
+@override_settings(API_RESPONSE_CACHE=None)
+class KeysetPaginationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(25)
+        # Ties and NULLs in the leading ordering field.
+        models.Book.objects.filter(pk__in=(3, 4, 5)).update(downloads=100)
+        models.Book.objects.filter(pk__in=(7, 8)).update(downloads=None)
+
+    def walk(self, url):
+        """Follows the next links and returns the ids served, then walks back."""
+        pages = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row["id"] for row in response.data["results"]])
+            last = response.data
+            url = response.data["next"]
+
+        backwards = []
+        url = last["previous"]
+        while url is not None:
+            response = self.client.get(url)
+            backwards.insert(0, [row["id"] for row in response.data["results"]])
+            url = response.data["previous"]
+        self.assertEqual(backwards, pages[:-1])
+        return [id for page in pages for id in page]
+
+    def test_default_ordering(self):
+        expected = [book.pk for book in sorted(
+            models.Book.objects.all(),
+            key=lambda book: (book.downloads is not None, book.downloads or 0, book.pk),
+            reverse=True)]
+        self.assertEqual(self.walk("/api/book/?page_size=4"), expected)
+
+    def test_ascending_ordering(self):
+        expected = [book.pk for book in sorted(
+            models.Book.objects.all(),
+            key=lambda book: (book.downloads is not None, book.downloads or 0, book.pk))]
+        self.assertEqual(self.walk("/api/book/?page_size=3&ordering=downloads"), expected)
+
+    def test_filtered_ordering(self):
+        expected = list(models.Book.objects.filter(languages="en").order_by("title", "pk")
+                        .values_list("pk", flat=True))
+        self.assertEqual(self.walk("/api/book/?page_size=2&languages=en&ordering=title"), expected)
+
+    def test_other_endpoints_use_pk(self):
+        expected = list(models.Person.objects.order_by("-pk").values_list("name", flat=True))
+        names = []
+        url = "/api/person/"
+        while url is not None:
+            response = self.client.get(url)
+            names.extend(person["name"] for person in response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(names, expected)
+
+    def test_count_is_optional(self):
+        response = self.client.get("/api/book/")
+        self.assertNotIn("count", response.data)
+        response = self.client.get("/api/book/", {"count": "true", "languages": "en"})
+        self.assertEqual(response.data["count"], 13)
+
+    def test_deep_page_query_count(self):
+        url = "/api/resource/?page_size=5"
+        for _ in range(8):
+            url = self.client.get(url).data["next"]
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data["results"]), 5)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get("/api/book/", {"cursor": "garbage"}).status_code, 404)
+        response = self.client.get("/api/book/")
+        cursor = response.data["next"].split("cursor=")[1]
+        response = self.client.get("/api/book/", {"cursor": cursor, "ordering": "title"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ResponseCacheTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(3)
+        catalogue.bump_version()
+
+    def test_cached_until_catalogue_version_changes(self):
+        first = self.client.get("/api/book/")
+        models.Book.objects.filter(pk=3).update(title="Changed")
+
+        with self.assertNumQueries(0):
+            cached = self.client.get("/api/book/")
+        self.assertEqual(cached.data, first.data)
+
+        catalogue.bump_version()
+        fresh = self.client.get("/api/book/")
+        self.assertEqual(fresh.data["results"][0]["title"], "Changed")
+
+    def test_query_string_is_normalized(self):
+        self.client.get("/api/book/?languages=en&page_size=2")
+        with self.assertNumQueries(0):
+            self.client.get("/api/book/?page_size=2&languages=en")
+
+    def test_conditional_get(self):
+        response = self.client.get("/api/book/1/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/person/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+        catalogue.bump_version()
+        response = self.client.get("/api/book/1/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+
+
+class LoadDBTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.fixture = os.path.join(self.directory.name, "fixture.sqlite3")
+        self.logger = logging.getLogger("api.tests")
+        self.logger.disabled = True
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_import_in_chunks(self):
+        create_fixture(self.fixture, 5)
+        import_catalogue(self.logger, self.fixture, clear=False, batch_size=2)
+
+        self.assertEqual(models.Book.objects.count(), 5)
+        self.assertEqual(models.Book.agents.through.objects.count(), 5)
+        book = models.Book.objects.get(pk=3)
+        self.assertEqual(book.agents.get().person.name, "Person 3")
+        self.assertEqual(book.agents.get().person.birth_year, 1800)
+        self.assertEqual(book.resources.get().modified, datetime(2022, 1, 1, tzinfo=pytz.UTC))
+        self.assertEqual(catalogue.get_version().number, 1)
+        self.assertEqual(models.Catalogue.objects.get().stats["counts"]["books"], 5)
+
+    def test_fixture_closed_when_attach_fails(self):
+        create_fixture(self.fixture, 1)
+        opened = []
+
+        def connect(path, connect=sqlite3.connect):
+            opened.append(connect(path))
+            return opened[-1]
+
+        with patch("api.management.commands.load_db.sqlite3.connect", side_effect=connect), \
+                patch("api.management.commands.load_db.attach_fixture", side_effect=sqlite3.OperationalError), \
+                self.assertRaises(sqlite3.OperationalError):
+            import_catalogue(self.logger, self.fixture, clear=False)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            opened[0].execute("SELECT 1")
+
+    def test_clear(self):
+        create_catalogue(2)
+        create_fixture(self.fixture, 1)
+        import_catalogue(self.logger, self.fixture, clear=True)
+
+        self.assertEqual(list(models.Book.objects.values_list("title", flat=True)), ["Book 1"])
+
+    def test_delta_import(self):
+        create_fixture(self.fixture, 5)
+        import_catalogue(self.logger, self.fixture, clear=False)
+
+        new_fixture = os.path.join(self.directory.name, "new.sqlite3")
+        create_fixture(new_fixture, 6)
+        conn = sqlite3.connect(new_fixture)
+        conn.executescript("""
+        UPDATE Book SET title = 'Changed' WHERE id = 2;
+        DELETE FROM Book WHERE id = 3;
+        UPDATE Subject SET id = id + 100;
+        UPDATE Book_Subject SET subject = subject + 100;
+        UPDATE Subject SET name = 'New subject' WHERE id = 104;
+        """)
+        conn.commit()
+        conn.close()
+
+        delta = compute_delta(hash_snapshot(self.fixture), hash_snapshot(new_fixture))
+        self.assertEqual(delta, ([6], [2, 4], [3]))
+
+        import_delta(self.logger, new_fixture, self.fixture)
+
+        self.assertEqual(sorted(models.Book.objects.values_list("id", flat=True)), [1, 2, 4, 5, 6])
+        self.assertEqual(models.Book.objects.get(pk=2).title, "Changed")
+        self.assertEqual(list(models.Book.objects.get(pk=4).subjects.values_list("name", flat=True)),
+                         ["New subject"])
+        self.assertEqual(models.Book.objects.get(pk=6).agents.get().person.name, "Person 6")
+        self.assertEqual(models.Book.objects.get(pk=6).agents.get().person.death_year, 1870)
+        self.assertEqual(models.Person.objects.filter(name="Person 2").count(), 1)
+        self.assertEqual(models.Resource.objects.count(), 5)
+        self.assertEqual(catalogue.get_version().number, 2)
+
+        response = APIClient().get("/api/book/?search=changed")
+        self.assertEqual([book["title"] for book in response.json()["results"]], ["Changed"])
+
+    def new_fixture(self, book_count: int, sql: str) -> str:
+        path = os.path.join(self.directory.name, "new.sqlite3")
+        create_fixture(path, book_count)
+        conn = sqlite3.connect(path)
+        conn.executescript(sql)
+        conn.commit()
+        conn.close()
+        return path
+
+    def test_delta_of_downloads_only(self):
+        create_fixture(self.fixture, 3)
+        import_catalogue(self.logger, self.fixture, clear=False)
+        resource_ids = sorted(models.Resource.objects.values_list("id", flat=True))
+
+        new_fixture = self.new_fixture(3, "UPDATE Book SET downloads = downloads + 100 WHERE id != 2;")
+        self.assertEqual(compute_delta(hash_snapshot(self.fixture), hash_snapshot(new_fixture)), ([], [], []))
+
+        with patch("api.management.commands.load_db.build_documents", wraps=build_documents) as build:
+            import_delta(self.logger, new_fixture, self.fixture)
+        build.assert_called_once_with("default", [])
+
+        self.assertEqual(list(models.Book.objects.order_by("id").values_list("downloads", flat=True)), [101, 2, 103])
+        # The books were updated in place, not replaced.
+        self.assertEqual(sorted(models.Resource.objects.values_list("id", flat=True)), resource_ids)
+        documents = dict(models.BookDocument.objects.values_list("pk", "json"))
+        build_documents()
+        self.assertEqual(documents, dict(models.BookDocument.objects.values_list("pk", "json")))
+        self.assertEqual(json.loads(documents[3])["downloads"], 103)
+        self.assertEqual(catalogue.get_version().number, 2)
+
+    def test_delta_matches_full_import(self):
+        def state():
+            return {
+                "people": sorted(models.Person.objects.values_list("name", flat=True)),
+                "agents": sorted(models.Agent.objects.values_list("person__name", "type")),
+                "subjects": sorted(models.Subject.objects.values_list("name", flat=True)),
+                "bookshelves": sorted(models.Bookshelf.objects.values_list("name", flat=True)),
+                "resources": sorted(models.Resource.objects.values_list("uri", flat=True)),
+                "books": sorted(models.Book.objects.values_list(
+                    "id", "downloads", "subjects__name", "agents__person__name", "resources__uri")),
+            }
+
+        create_fixture(self.fixture, 4)
+        import_catalogue(self.logger, self.fixture, clear=False)
+        new_fixture = self.new_fixture(4, """
+        UPDATE Book SET downloads = 50 WHERE id = 1;
+        DELETE FROM Book WHERE id = 3;
+        DELETE FROM Person WHERE id IN (2, 3);
+        DELETE FROM Agent WHERE id IN (2, 3);
+        DELETE FROM Subject WHERE id IN (2, 3);
+        DELETE FROM Bookshelf WHERE id = 3;
+        DELETE FROM Resource WHERE id = 3;
+        INSERT INTO Subject VALUES (10, 'New subject');
+        UPDATE Book_Subject SET subject = 10 WHERE book = 2;
+        UPDATE Book_Agent SET agent = 1 WHERE book = 2;
+        DELETE FROM Book_Agent WHERE book = 3;
+        DELETE FROM Book_Subject WHERE book = 3;
+        DELETE FROM Book_Bookshelf WHERE book = 3;
+        DELETE FROM Book_Resource WHERE book = 3;
+        DELETE FROM Book_Language WHERE book = 3;
+        """)
+
+        import_delta(self.logger, new_fixture, self.fixture)
+        delta = state()
+        import_catalogue(self.logger, new_fixture, clear=True)
+        self.assertEqual(delta, state())
+        self.assertEqual(delta["people"], ["Person 1", "Person 4"])
+
+    def test_delta_rejects_full_import_options(self):
+        create_fixture(self.fixture, 1)
+        for option in ({"clear": True}, {"batch_size": 10}):
+            with self.subTest(option=option), self.assertRaises(CommandError):
+                call_command("load_db", self.fixture, since=self.fixture, **option)
+
+
+@skipUnless(connection.vendor == 'sqlite', "Attaching the fixture needs an SQLite database")
+class AttachedFixtureImportTests(TransactionTestCase):
+    """The fixture can only be attached when the import runs its own transaction."""
+
+    def test_through_tables_copied_from_attached_fixture(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        fixture = os.path.join(directory.name, "fixture with spaces.sqlite3")
+        create_fixture(fixture, 4)
+        logger = logging.getLogger("api.tests")
+        logger.disabled = True
+
+        with patch("api.management.commands.load_db.insert_rows") as insert_rows:
+            import_catalogue(logger, fixture, clear=True)
+        insert_rows.assert_not_called()
+
+        self.assertEqual(models.Book.agents.through.objects.count(), 4)
+        self.assertEqual(list(models.Book.objects.get(pk=2).subjects.values_list("name", flat=True)), ["Subject 2"])
+        self.assertEqual(list(models.Book.objects.get(pk=4).languages.values_list("name", flat=True)), ["en"])
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA database_list")
+            self.assertNotIn("fixture", [name for _, name, _ in cursor.fetchall()])
+
+
+@skipUnless(connection.vendor == 'sqlite', "Staging imports need an SQLite database")
+class StagingImportTests(TransactionTestCase):
+    """Imports into a staging copy of a live database file, a copy of the migrated test database."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "live.sqlite3")
+        self.fixture = os.path.join(directory.name, "fixture.sqlite3")
+        create_fixture(self.fixture, 3)
+        self.logger = logging.getLogger("api.tests")
+        self.logger.disabled = True
+
+        connection.ensure_connection()
+        target = sqlite3.connect(self.path)
+        connection.connection.backup(target)
+        target.close()
+
+        connections.databases["live"] = {**connection.settings_dict, "NAME": self.path, "OPTIONS": {}}
+        self.addCleanup(self.remove_live)
+        # A connection of a web process, opened before the swap.
+        self.reader = DatabaseWrapper(connections.databases["live"], alias="reader")
+        self.addCleanup(self.reader.close)
+
+    def remove_live(self):
+        connections["live"].close()
+        del connections["live"]
+        del connections.databases["live"]
+
+    def count_books(self, wrapper):
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM api_book")
+            return cursor.fetchone()[0]
+
+    def test_in_memory_database_is_not_swappable(self):
+        with self.assertRaises(ImproperlyConfigured):
+            staging.check_swappable()
+
+    def test_swap(self):
+        self.assertEqual(self.count_books(self.reader), 0)
+
+        with staging.staging_database("live") as alias:
+            import_catalogue(self.logger, self.fixture, True, using=alias)
+            self.assertEqual(self.count_books(self.reader), 0)
+
+        self.assertFalse(os.path.exists(staging.get_staging_path("live")))
+        self.assertNotIn(staging.STAGING_ALIAS, connections.databases)
+        self.assertEqual(self.count_books(connections["live"]), 3)
+
+        with patch("api.sqlite.connections.all", return_value=[self.reader]):
+            sqlite.close_replaced_connections()
+        self.assertIsNone(self.reader.connection)
+        self.assertEqual(self.count_books(self.reader), 3)
+
+    def test_failed_import_keeps_live_database(self):
+        self.count_books(self.reader)
+        with patch("api.management.commands.load_db.update_stats", side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            with staging.staging_database("live") as alias:
+                import_catalogue(self.logger, self.fixture, True, using=alias)
+
+        self.assertFalse(os.path.exists(staging.get_staging_path("live")))
+        self.assertNotIn(staging.STAGING_ALIAS, connections.databases)
+        self.assertEqual(self.count_books(connections["live"]), 0)
+        with patch("api.sqlite.connections.all", return_value=[self.reader]):
+            sqlite.close_replaced_connections()
+        self.assertIsNotNone(self.reader.connection)
+
+
+@override_settings(API_RESPONSE_CACHE=None)
+class BookDocumentTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(3)
+        build_documents()
+
+    def test_documents_match_serializer(self):
+        for url in ("/api/book/", "/api/book/2/", "/api/book/?page_size=2&ordering=title"):
+            with override_settings(API_BOOK_DOCUMENTS=False):
+                expected = self.client.get(url).content
+            self.assertEqual(self.client.get(url).content, expected)
+
+    def test_list_is_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/book/?page_size=2")
+        self.assertEqual([book["id"] for book in response.json()["results"]], [3, 2])
+
+    def test_books_without_document(self):
+        models.BookDocument.objects.filter(pk=1).delete()
+        self.assertEqual(self.client.get("/api/book/1/").json()["title"], "Book 1")
+
+    def test_page_without_documents(self):
+        with override_settings(API_BOOK_DOCUMENTS=False):
+            expected = self.client.get("/api/book/").content
+        models.BookDocument.objects.filter(pk__in=[1, 2]).delete()
+        with self.assertNumQueries(7):
+            response = self.client.get("/api/book/")
+        self.assertEqual(response.content, expected)
+
+
+@override_settings(API_RESPONSE_CACHE=None, API_BOOK_DOCUMENTS=False)
+class FastSerializerTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(4)
+        models.Person.objects.filter(pk=2).update(alias=None, webpage=None)
+        models.Resource.objects.filter(pk=5).update(type=None, modified=None)
+        models.Agent.objects.filter(person=3).update(person=None)
+
+    def test_output_matches_model_serializers(self):
+        urls = (
+            "/api/book/", "/api/book/?ordering=title&page_size=2", "/api/book/3/",
+            "/api/person/", "/api/person/?ordering=-birth_date&page_size=3", "/api/person/2/",
+            "/api/resource/", "/api/resource/?ordering=modified&page_size=3", "/api/resource/5/",
+        )
+        for url in urls:
+            with override_settings(API_FAST_SERIALIZERS=False):
+                expected = self.client.get(url).content
+            self.assertEqual(self.client.get(url).content, expected, url)
+
+    def test_book_list_queries(self):
+        with self.assertNumQueries(6):
+            response = self.client.get("/api/book/?page_size=2")
+        response = self.client.get(response.json()["next"])
+        self.assertEqual([book["id"] for book in response.json()["results"]], [2, 1])
+
+
+@override_settings(API_RESPONSE_CACHE=None)
+class FieldSelectionTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(3)
+        build_documents()
+
+    def test_fields_prune_relations(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/book/?fields=id,title,downloads")
+        self.assertEqual(response.json()["results"][0], {"id": 3, "title": "Book 3", "downloads": 30})
+
+    def test_exclude(self):
+        with self.assertNumQueries(4):
+            response = self.client.get("/api/book/2/?exclude=agents,resources")
+        self.assertNotIn("agents", response.json())
+        self.assertEqual(response.json()["subjects"], ["Subject 2"])
+
+    def test_expand(self):
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/book/?fields=id,agents&expand=agents&page_size=2")
+        agent = response.json()["results"][0]["agents"][0]
+        self.assertEqual(agent["person"]["alias"], "Alias 3")
+        self.assertEqual(agent["type"], "Editor")
+
+        with self.assertNumQueries(2):
+            response = self.client.get("/api/agent/?expand=books&fields=id,books&page_size=2")
+        self.assertEqual(response.json()["results"][0]["books"], [{"id": 3, "title": "Book 3"}])
+
+    def test_unknown_field(self):
+        response = self.client.get("/api/agent/?fields=id,nope")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"fields": ["Unknown field: nope"]})
+
+
+@override_settings(API_RESPONSE_CACHE=None)
+class BulkLookupTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(4)
+        build_documents()
+
+    def bulk(self, response):
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_get_in_requested_order(self):
+        with self.assertNumQueries(1):
+            data = self.bulk(self.client.get("/api/book/bulk/?ids=2,9,4,2,1"))
+        self.assertEqual([book["id"] for book in data["results"]], [2, 4, 1])
+        self.assertEqual(data["results"][0], self.client.get("/api/book/2/").json())
+        self.assertEqual(data["missing"], [9])
+
+    def test_post_in_chunks(self):
+        with override_settings(API_BOOK_DOCUMENTS=False), patch("api.bulk.CHUNK_SIZE", 2):
+            with self.assertNumQueries(12):
+                data = self.bulk(self.client.post("/api/book/bulk/", {"ids": [3, 1, 4, 2]}, format="json"))
+        self.assertEqual([book["id"] for book in data["results"]], [3, 1, 4, 2])
+        self.assertEqual(data["missing"], [])
+
+    def test_invalid_ids(self):
+        self.assertEqual(self.client.get("/api/book/bulk/?ids=1,x").status_code, 400)
+        self.assertEqual(self.client.get("/api/book/bulk/").status_code, 400)
+        with override_settings(API_BULK_MAX_IDS=2):
+            self.assertEqual(self.client.get("/api/book/bulk/?ids=1,2,3").status_code, 400)
+
+
+class ExportTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(5)
+        rebuild_search_index()
+
+    def export(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content)
+
+    def test_ndjson(self):
+        with patch("api.export.CHUNK_SIZE", 2):
+            response, content = self.export("/api/book/export/?languages=en")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson; charset=utf-8")
+        books = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([book["id"] for book in books], [5, 3, 1])
+        self.assertEqual(books[0], self.client.get("/api/book/5/").json())
+
+    def test_csv(self):
+        _, content = self.export("/api/book/export/?format=csv&ordering=title&search=book")
+        rows = list(csv.DictReader(content.decode().splitlines()))
+        self.assertEqual([row["id"] for row in rows], ["1", "2", "3", "4", "5"])
+        self.assertEqual(rows[0]["agents"], "Person 1 / Editor|Person 1 / Author")
+        self.assertEqual(rows[0]["subjects"], "Subject 1")
+
+    def test_gzip(self):
+        response, content = self.export("/api/book/export/", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(len(gzip.decompress(content).splitlines()), 5)
+
+    def test_invalid_filter(self):
+        for url in ("/api/book/export/?languages=zz", "/api/book/export/?format=csv&languages=zz"):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.streaming)
+                self.assertEqual(response["Content-Type"], "application/json")
+                self.assertEqual(list(response.json()), ["languages"])
+                self.assertIn("Select a valid choice", response.json()["languages"][0])
+
+
+class StatsTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(3)
+        stats.update_stats()
+        catalogue.bump_version()
+
+    def test_stats_endpoint(self):
+        with self.assertNumQueries(2):
+            data = self.client.get("/api/stats/").json()
+        self.assertEqual(data["counts"], {
+            "books": 3, "people": 3, "bookshelves": 3, "subjects": 3, "resources": 6, "languages": 2})
+        self.assertEqual(data["languages"], [{"name": "en", "books": 2}, {"name": "fr", "books": 1}])
+        self.assertEqual(data["types"], [{"name": "Text", "books": 3}])
+        self.assertEqual([book["id"] for book in data["top_downloads"]], [3, 2, 1])
+        self.assertEqual(self.client.get("/api/").json()["stats"], "http://testserver/api/stats/")
+
+    def test_stored_until_next_import(self):
+        self.client.get("/api/stats/")
+        models.Book.objects.filter(pk=1).delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.get_stats()["counts"]["books"], 3)
+        stats.update_stats()
+        catalogue.bump_version()
+        self.assertEqual(self.client.get("/api/stats/").json()["counts"]["books"], 2)
+
+
+class FacetTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(5)
+        models.Book.objects.get(pk=2).subjects.add(models.Subject.objects.get(pk=1))
+
+    def test_counts_in_one_query(self):
+        url = "/api/book/?facets=languages,subjects,agent_types,resource_types&downloads_range_min=20&downloads_range_max=50"
+        with override_settings(API_RESPONSE_CACHE=None), self.assertNumQueries(2):
+            response = self.client.get(url + "&fields=id")
+        facets = response.json()["facets"]
+        self.assertEqual(facets["languages"], [{"value": "en", "count": 2}, {"value": "fr", "count": 2}])
+        self.assertEqual(facets["subjects"][0], {"value": "Subject 1", "count": 1})
+        self.assertEqual(len(facets["subjects"]), 5)
+        self.assertEqual(facets["agent_types"], [{"value": "Author", "count": 4}, {"value": "Editor", "count": 4}])
+        self.assertEqual(facets["resource_types"][0], {"value": "application/epub+zip", "count": 4})
+
+    def test_limit_and_cache(self):
+        response = self.client.get("/api/book/?facets=subjects&facet_limit=2&page_size=2")
+        self.assertEqual(response.json()["facets"]["subjects"],
+                         [{"value": "Subject 1", "count": 2}, {"value": "Subject 2", "count": 1}])
+
+        # The next page reuses the cached counts.
+        with self.assertNumQueries(1):
+            response = self.client.get(response.json()["next"] + "&fields=id&facets=subjects&facet_limit=2")
+        self.assertEqual(len(response.json()["facets"]["subjects"]), 2)
+
+    def test_unknown_facet(self):
+        self.assertEqual(self.client.get("/api/book/?facets=nope").status_code, 400)
+
+
+@override_settings(API_RESPONSE_CACHE=None)
+class BitmapFilterTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        create_catalogue(12)
+        shelf = models.Bookshelf.objects.create(id=100, name="Shared")
+        for book in models.Book.objects.filter(pk__in=[2, 3, 5, 8, 9]):
+            book.bookshelves.add(shelf)
+        models.Book.objects.filter(pk__in=[3, 9]).update(downloads=50)
+        models.Book.objects.filter(pk=8).update(downloads=None)
+
+    def collect(self, url):
+        """Follows the next links of a list, then the previous links back."""
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json())
+            ids.extend(book["id"] for book in pages[-1]["results"])
+            url = pages[-1]["next"]
+
+        back = []
+        url = pages[-1]["previous"]
+        while url:
+            response = self.client.get(url).json()
+            back = [book["id"] for book in response["results"]] + back
+            url = response["previous"]
+        return ids, back
+
+    def test_same_results_as_sql(self):
+        urls = [
+            "/api/book/?page_size=2",
+            "/api/book/?has_bookshelf=Shared&page_size=2&count=true",
+            "/api/book/?has_bookshelf=Shared&languages=fr&has_agent_type=Author&page_size=1",
+            "/api/book/?has_resource_type=text/plain&downloads_range_min=30&downloads_range_max=90&page_size=3",
+            "/api/book/?has_subject=Subject 4&type=Text",
+            "/api/book/?has_bookshelf=Nope",
+            "/api/book/?has_bookshelf=Shared&ordering=title&page_size=2",
+            "/api/book/?has_bookshelf=Shared&downloads_range_min=5&page_size=2",
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                with override_settings(API_BITMAP_FILTERS=False):
+                    expected = self.collect(url)
+                with override_settings(API_BITMAP_FILTERS=True):
+                    self.assertEqual(self.collect(url), expected)
+
+        with override_settings(API_BITMAP_FILTERS=True):
+            response = self.client.get("/api/book/?has_bookshelf=Shared&count=true").json()
+        self.assertEqual(response["count"], 5)
+        self.assertEqual([book["id"] for book in response["results"]], [9, 5, 3, 2, 8])
+
+    @override_settings(API_BITMAP_FILTERS=True)
+    def test_page_read_by_id(self):
+        bitmaps.get_index()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/book/?has_bookshelf=Shared&has_agent_type=Author&fields=id")
+        self.assertEqual(response.json()["results"], [{"id": 9}, {"id": 5}, {"id": 3}, {"id": 2}, {"id": 8}])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("api_book_bookshelves", queries[0]["sql"])
+
+    @override_settings(API_BITMAP_FILTERS=True)
+    def test_rebuilt_after_import(self):
+        self.assertEqual(self.client.get("/api/book/?has_subject=Subject 4").json()["results"][0]["id"], 4)
+        models.Book.objects.get(pk=5).subjects.add(models.Subject.objects.get(pk=4))
+        catalogue.bump_version()
+        ids = [book["id"] for book in self.client.get("/api/book/?has_subject=Subject 4").json()["results"]]
+        self.assertEqual(ids, [5, 4])
+
+
+class PersonYearTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for birth_date in ("1850", "999", "-50", "1000", None):
+            models.Person.objects.create(
+                name=f"Born {birth_date}", birth_date=birth_date, birth_year=parse_year(birth_date))
+
+    def names(self, url):
+        return [person["name"] for person in self.client.get(url).json()["results"]]
+
+    def test_parse_year(self):
+        self.assertEqual(parse_year("1812"), 1812)
+        self.assertEqual(parse_year("-384"), -384)
+        self.assertEqual(parse_year("1850?"), 1850)
+        self.assertIsNone(parse_year("unknown"))
+        self.assertIsNone(parse_year(None))
+
+    def test_range_is_numeric(self):
+        self.assertEqual(self.names("/api/person/?birth_date_range_min=900&birth_date_range_max=1000"),
+                         ["Born 1000", "Born 999"])
+        self.assertEqual(self.names("/api/person/?birth_date_range_min=1000"), ["Born 1000", "Born 1850"])
+        self.assertEqual(self.names("/api/person/?birth_date_range_max=0"), ["Born -50"])
+
+    def test_ordering_by_year(self):
+        response = self.client.get("/api/person/?ordering=birth_date&page_size=3").json()
+        self.assertEqual([person["birth_date"] for person in response["results"]], [None, "-50", "999"])
+        response = self.client.get(response["next"]).json()
+        self.assertEqual([person["birth_date"] for person in response["results"]], ["1000", "1850"])
+
+
+class SQLiteTuningTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "db.sqlite3")
+        sqlite3.connect(self.path).close()
+
+        self.connection = DatabaseWrapper({**connection.settings_dict, "NAME": self.path}, alias="tuning")
+        self.addCleanup(self.connection.close)
+
+    @override_settings(SQLITE_PRAGMAS={"cache_size": -1024, "temp_store": "MEMORY"})
+    def test_pragmas(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute("PRAGMA cache_size")
+            self.assertEqual(cursor.fetchone(), (-1024,))
+            cursor.execute("PRAGMA temp_store")
+            self.assertEqual(cursor.fetchone(), (2,))
+
+    def test_replaced_file_is_reopened(self):
+        self.connection.ensure_connection()
+        with patch("api.sqlite.connections.all", return_value=[self.connection]):
+            sqlite.close_replaced_connections()
+            self.assertIsNotNone(self.connection.connection)
+
+            sqlite3.connect(self.path + ".new").close()
+            os.replace(self.path + ".new", self.path)
+            sqlite.close_replaced_connections()
+            self.assertIsNone(self.connection.connection)
+
+
+class AsyncViewTests(TransactionTestCase):
+    """The async views run on other threads, which only see committed rows."""
+
+    def setUp(self):
+        catalogue.invalidate()
+        stats.invalidate()
+        bitmaps.invalidate()
+        caches["api"].clear()
+        create_catalogue(3)
+
+    async def test_same_response_as_sync_views(self):
+        for path in ("book/?page_size=2&languages=en", "book/2/", "person/?ordering=-birth_date", "language/fr/"):
+            with self.subTest(path=path):
+                response = await self.async_client.get(f"/api/async/{path}")
+                self.assertEqual(response.status_code, 200)
+                expected = await sync_to_async(self.client.get)(f"/api/{path}")
+                self.assertEqual(response.content.replace(b"/api/async/", b"/api/"), expected.content)
+        self.assertTrue(all(thread.name.startswith("api-db") for thread in async_views.get_executor()._threads))
+
+    async def test_not_found(self):
+        response = await self.async_client.get("/api/async/book/100/")
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(connection.vendor == 'sqlite', "The replica is a copy of an SQLite database")
+@override_settings(API_MEMORY_REPLICA=True, API_RESPONSE_CACHE=None)
+class MemoryReplicaTests(TransactionTestCase):
+    """The replica is copied with the backup API, which only sees committed rows."""
+
+    def setUp(self):
+        catalogue.invalidate()
+        stats.invalidate()
+        create_catalogue(3)
+        catalogue.bump_version()
+        self.addCleanup(self.remove_replica)
+
+    def remove_replica(self):
+        replica.invalidate()
+        connections[replica.REPLICA_ALIAS].close()
+        del connections[replica.REPLICA_ALIAS]
+        del connections.databases[replica.REPLICA_ALIAS]
+
+    def ids(self):
+        return [book["id"] for book in self.client.get("/api/book/?fields=id").json()["results"]]
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.ids(), [3, 2, 1])
+
+        with CaptureQueriesContext(connections[replica.REPLICA_ALIAS]) as queries, self.assertNumQueries(0):
+            self.assertEqual(self.ids(), [3, 2, 1])
+        self.assertEqual(len(queries), 1)
+
+    def test_reloaded_after_import(self):
+        self.assertEqual(self.ids(), [3, 2, 1])
+        models.Book.objects.create(id=4, title="Book 4", downloads=100)
+        self.assertEqual(self.ids(), [3, 2, 1])
+
+        catalogue.bump_version()
+        self.assertEqual(self.ids(), [4, 3, 2, 1])
+
+
+@skipUnless(connection.vendor == 'postgresql', "Runs against PostgreSQL only, see POSTGRES_DB")
+class PostgresTests(APITestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.fixture = os.path.join(directory.name, "fixture.sqlite3")
+        self.logger = logging.getLogger("api.tests")
+        self.logger.disabled = True
+
+    def test_import_with_copy(self):
+        create_fixture(self.fixture, 5)
+        with patch("api.management.commands.load_db.copy_instances", wraps=postgres.copy_instances) as copy:
+            import_catalogue(self.logger, self.fixture, clear=False, batch_size=2)
+
+        self.assertTrue(copy.called)
+        self.assertEqual(models.Book.agents.through.objects.count(), 5)
+        self.assertEqual(models.Book.objects.get(pk=3).resources.get().modified, datetime(2022, 1, 1, tzinfo=pytz.UTC))
+        # The sequences continue after the imported ids.
+        self.assertEqual(models.Person.objects.create(name="Person 6").pk, 6)
+
+    def test_search_quotes_terms(self):
+        create_fixture(self.fixture, 3)
+        import_catalogue(self.logger, self.fixture, clear=False)
+        for query in ("person's", "3 \\", "book & !3"):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get("/api/book/", {"search": query}).status_code, 200)
+        response = self.client.get("/api/book/", {"search": "book 3", "rank": "true"})
+        self.assertEqual([book["id"] for book in response.json()["results"]], [3])
+
+    def test_trigram_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                self.skipTest("The pg_trgm extension is not available")
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE indexname LIKE %s", ["%_trgm_idx"])
+            self.assertEqual({name for name, in cursor.fetchall()}, {
+                'book_title_trgm_idx', 'book_description_trgm_idx', 'person_name_trgm_idx',
+                'person_alias_trgm_idx', 'person_webpage_trgm_idx', 'bookshelf_name_trgm_idx',
+                'subject_name_trgm_idx',
+            })
@@ -1,6 +1,7 @@
 from django.urls import path, include
 
 from . import views
+from .async_views import get_async_urls
 from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
@@ -17,5 +18,7 @@ router.register('subject', views.SubjectViewSet)
 app_name = "api"
 urlpatterns = [
     path("", router.get_api_root_view(), name="index"),
+    path("stats/", views.StatsView.as_view(), name="stats"),
+    *get_async_urls(router),
     path("", include(router.urls)),
 ]
\ No newline at end of file
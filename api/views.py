@@ -1,7 +1,12 @@
+from django.conf import settings
 from django.shortcuts import render
 
 from rest_framework import viewsets
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.routers import APIRootView
+from rest_framework.views import APIView
 
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
@@ -9,18 +14,56 @@ import django_filters
 
 from . import models
 from . import serializers
-
-
-class BookViewSet(viewsets.ReadOnlyModelViewSet):
+from .bitmaps import BitmapFilterBackend, BitmapKeysetPagination
+from .bulk import BulkLookupMixin
+from .cache import CachedResponseMixin
+from .export import ExportMixin
+from .facets import FacetMixin
+from .fast import FastSerializerMixin
+from .ordering import AliasedOrderingFilter
+from .planner import PlannedQuerysetMixin
+from .renderers import DocumentJSONRenderer
+from .search import FullTextSearchFilter
+from .stats import get_stats
+
+
+class BookViewSet(BulkLookupMixin, ExportMixin, CachedResponseMixin, FacetMixin, FastSerializerMixin,
+                  PlannedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and view details for books.
     """
     queryset = models.Book.objects.all()
     serializer_class = serializers.BookSerializer
-    filter_backends = (filters.SearchFilter,
-                       DjangoFilterBackend, filters.OrderingFilter)
+    fast_serializer_class = serializers.FastBookSerializer
+    renderer_classes = (DocumentJSONRenderer, BrowsableAPIRenderer)
+    filter_backends = (FullTextSearchFilter,
+                       BitmapFilterBackend, filters.OrderingFilter)
+    pagination_class = BitmapKeysetPagination
     search_fields = ('title', 'agents__person__name')
 
+    def use_documents(self) -> bool:
+        """Whether the books are served from their pre-rendered documents."""
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        return (settings.API_BOOK_DOCUMENTS
+                and isinstance(renderer, (DocumentJSONRenderer, BrowsableAPIRenderer))
+                and not serializers.BookSerializer.has_field_params(self.request))
+
+    def use_fast_serializer(self) -> bool:
+        return (not self.use_documents()
+                and not serializers.BookSerializer.has_field_params(self.request)
+                and super().use_fast_serializer())
+
+    def get_serializer_class(self):
+        if self.use_documents():
+            return serializers.BookDocumentSerializer
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.use_documents():
+            queryset = queryset.select_related('document')
+        return queryset
+
     class BookFilter(django_filters.FilterSet):
         type = django_filters.CharFilter(
             field_name="type", lookup_expr="exact")
@@ -34,6 +77,8 @@ class BookViewSet(viewsets.ReadOnlyModelViewSet):
             field_name="downloads", lookup_expr="range")
         has_bookshelf = django_filters.CharFilter(
             field_name="bookshelves__name", lookup_expr="exact")
+        has_subject = django_filters.CharFilter(
+            field_name="subjects__name", lookup_expr="exact")
         has_resource_type = django_filters.CharFilter(
             field_name="resources__type", lookup_expr="exact")
         has_agent_type = django_filters.CharFilter(
@@ -44,10 +89,10 @@ class BookViewSet(viewsets.ReadOnlyModelViewSet):
             field_name="agents__person__alias", lookup_expr="icontains")
         agent_webpage_contains = django_filters.CharFilter(
             field_name="agents__person__webpage", lookup_expr="icontains")
-        agent_birth_date_range = django_filters.NumericRangeFilter(
-            field_name="agents__person__birth_date", lookup_expr="range")
-        agent_death_date_range = django_filters.NumericRangeFilter(
-            field_name="agents__person__death_date", lookup_expr="range")
+        agent_birth_date_range = django_filters.RangeFilter(
+            field_name="agents__person__birth_year")
+        agent_death_date_range = django_filters.RangeFilter(
+            field_name="agents__person__death_year")
 
         class Meta:
             model = models.Book
@@ -58,7 +103,7 @@ class BookViewSet(viewsets.ReadOnlyModelViewSet):
     ordering_fields = ('downloads', 'title')
 
 
-class BookshelfViewSet(viewsets.ReadOnlyModelViewSet):
+class BookshelfViewSet(CachedResponseMixin, PlannedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and view details for Bookshelves.
     """
@@ -69,7 +114,7 @@ class BookshelfViewSet(viewsets.ReadOnlyModelViewSet):
     ordering_fields = ('name', )
 
 
-class SubjectViewSet(viewsets.ReadOnlyModelViewSet):
+class SubjectViewSet(CachedResponseMixin, PlannedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and view details for Subjects.
     """
@@ -80,7 +125,7 @@ class SubjectViewSet(viewsets.ReadOnlyModelViewSet):
     ordering_fields = ('name', )
 
 
-class LanguageViewSet(viewsets.ReadOnlyModelViewSet):
+class LanguageViewSet(CachedResponseMixin, PlannedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and view details for Languages.
     """
@@ -91,14 +136,15 @@ class LanguageViewSet(viewsets.ReadOnlyModelViewSet):
     ordering_fields = ('name', )
 
 
-class PersonViewSet(viewsets.ReadOnlyModelViewSet):
+class PersonViewSet(CachedResponseMixin, FastSerializerMixin, PlannedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and view details Person objects.
     """
     queryset = models.Person.objects.all()
     serializer_class = serializers.PersonSerializer
+    fast_serializer_class = serializers.FastPersonSerializer
     filter_backends = (filters.SearchFilter,
-                       DjangoFilterBackend, filters.OrderingFilter)
+                       DjangoFilterBackend, AliasedOrderingFilter)
     search_fields = ('name', 'alias')
 
     class PersonFilter(django_filters.FilterSet):
@@ -108,10 +154,10 @@ class PersonViewSet(viewsets.ReadOnlyModelViewSet):
             field_name="alias", lookup_expr="icontains")
         webpage_contains = django_filters.CharFilter(
             field_name="webpage", lookup_expr="icontains")
-        birth_date_range = django_filters.NumericRangeFilter(
-            field_name="birth_date", lookup_expr="range")
-        death_date_range = django_filters.NumericRangeFilter(
-            field_name="death_date", lookup_expr="range")
+        birth_date_range = django_filters.RangeFilter(
+            field_name="birth_year")
+        death_date_range = django_filters.RangeFilter(
+            field_name="death_year")
 
         class Meta:
             model = models.Person
@@ -119,9 +165,10 @@ class PersonViewSet(viewsets.ReadOnlyModelViewSet):
 
     filterset_class = PersonFilter
     ordering_fields = ('name', 'alias', 'birth_date', 'death_date')
+    ordering_aliases = {'birth_date': 'birth_year', 'death_date': 'death_year'}
 
 
-class AgentTypeViewSet(viewsets.ReadOnlyModelViewSet):
+class AgentTypeViewSet(CachedResponseMixin, PlannedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and view details for Agent Types.
     """
@@ -132,14 +179,14 @@ class AgentTypeViewSet(viewsets.ReadOnlyModelViewSet):
     ordering_fields = ('name', )
 
 
-class AgentViewSet(viewsets.ReadOnlyModelViewSet):
+class AgentViewSet(CachedResponseMixin, PlannedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and view details for Agents.
     """
     queryset = models.Agent.objects.all()
     serializer_class = serializers.AgentSerializer
     filter_backends = (filters.SearchFilter,
-                       DjangoFilterBackend, filters.OrderingFilter)
+                       DjangoFilterBackend, AliasedOrderingFilter)
     search_fields = ('person__name', 'person__alias', 'type__name')
 
     class AgentFilter(django_filters.FilterSet):
@@ -147,10 +194,10 @@ class AgentViewSet(viewsets.ReadOnlyModelViewSet):
             queryset=models.AgentType.objects.all())
         name_contains = django_filters.CharFilter(
             field_name="person__name", lookup_expr="icontains")
-        birth_date = django_filters.NumericRangeFilter(
-            field_name="person__birth_date", lookup_expr="range")
-        death_date = django_filters.NumericRangeFilter(
-            field_name="person__death_date", lookup_expr="range")
+        birth_date = django_filters.RangeFilter(
+            field_name="person__birth_year")
+        death_date = django_filters.RangeFilter(
+            field_name="person__death_year")
 
         class Meta:
             model = models.Agent
@@ -159,14 +206,16 @@ class AgentViewSet(viewsets.ReadOnlyModelViewSet):
     filterset_class = AgentFilter
     ordering_fields = ('person__name', 'person__alias',
                        'person__birth_date', 'person__death_date')
+    ordering_aliases = {'person__birth_date': 'person__birth_year', 'person__death_date': 'person__death_year'}
 
 
-class ResourceViewSet(viewsets.ReadOnlyModelViewSet):
+class ResourceViewSet(CachedResponseMixin, FastSerializerMixin, PlannedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     """
     List and view details for Resources.
     """
     queryset = models.Resource.objects.all()
     serializer_class = serializers.ResourceSerializer
+    fast_serializer_class = serializers.FastResourceSerializer
     filter_backends = (filters.SearchFilter,
                        DjangoFilterBackend, filters.OrderingFilter)
     search_fields = ('uri', )
@@ -198,7 +247,28 @@ class ResourceViewSet(viewsets.ReadOnlyModelViewSet):
     ordering_fields = ('size', 'modified')
 
 
+class StatsView(CachedResponseMixin, APIView):
+    """
+    Statistics of the catalogue: the number of items of every endpoint,
+    the number of books per language and per type, and the most downloaded books.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return self.cached_response(self.get_stats, request, *args, **kwargs)
+
+    def get_stats(self, request, *args, **kwargs):
+        return Response(get_stats())
+
+
 class ProjectGutenbergAPIRootView(APIRootView):
     """
     Select the endpoints for more information on each.
     """
+
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        namespace = request.resolver_match.namespace
+        response.data['stats'] = reverse(
+            f'{namespace}:stats' if namespace else 'stats',
+            request=request, format=kwargs.get('format'))
+        return response
@@ -0,0 +1,42 @@
+"""
+Gunicorn config for serving gutenberg_api in production.
+
+Run it with
+    gunicorn -c python:gutenberg_api.gunicorn gutenberg_api.wsgi
+or over ASGI with
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c python:gutenberg_api.gunicorn gutenberg_api.asgi
+
+Requests are CPU bound (SQLite reads and JSON rendering), so the API scales
+with worker processes rather than threads. Every worker keeps its own
+persistent database connection and in-memory caches.
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT') or '8000'}"
+
+workers = int(os.getenv('WEB_CONCURRENCY') or multiprocessing.cpu_count())
+# uvicorn.workers.UvicornWorker serves gutenberg_api.asgi, with the /api/async/ views.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS') or 'sync'
+
+# Load Django before forking, so the workers share the imported code.
+# Database connections are opened lazily, after the fork.
+preload_app = True
+
+# Behind a reverse proxy that keeps connections to the workers open.
+keepalive = 5
+timeout = 30
+
+# Restart workers now and then to bound the growth of their caches.
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    # Load the in-memory replica of the catalogue before the first request, if it is enabled.
+    from api import replica
+    replica.refresh_replica()
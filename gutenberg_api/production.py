@@ -3,10 +3,52 @@ from .settings import *
 
 DEBUG = False
 
-STATIC_ROOT = os.getenv("STATIC_ROOT")
+STATIC_ROOT = os.getenv("STATIC_ROOT") or str(BASE_DIR / 'staticfiles')
+
+# Serves the files `collectstatic` gathers in STATIC_ROOT from the app servers,
+# unless a front proxy answers /static/ itself.
+MIDDLEWARE = [MIDDLEWARE[0], 'whitenoise.middleware.WhiteNoiseMiddleware', *MIDDLEWARE[1:]]
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 
 ALLOWED_HOSTS = list(filter(None, (os.getenv('ALLOWED_HOSTS') or '').split(";"))) 
 
-SECURE_BROWSER_XSS_FILTER = True
\ No newline at end of file
+SECURE_BROWSER_XSS_FILTER = True
+
+# Any django cache backend can hold the API responses, e.g.
+# django.core.cache.backends.filebased.FileBasedCache or
+# django.core.cache.backends.redis.RedisCache
+if os.getenv('API_CACHE_BACKEND'):
+    CACHES['api'] = {
+        'BACKEND': os.getenv('API_CACHE_BACKEND'),
+        'LOCATION': os.getenv('API_CACHE_LOCATION', ''),
+        'TIMEOUT': 60 * 60 * 24,
+    }
+
+DATABASES['default'].update({
+    'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 600)),
+    'CONN_HEALTH_CHECKS': True,
+})
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # The web processes only read the catalogue, so they open it read-only. It
+    # is not opened immutable: `migrate` and `load_db` without --staging write
+    # the live file in place (with SQLITE_READ_ONLY=0), and readers must see
+    # those writes through SQLite's locks. WAL mode is not used, because staging
+    # imports cannot replace a database in WAL mode.
+    SQLITE_PATH = os.getenv('SQLITE_PATH') or str(BASE_DIR / 'db.sqlite3')
+
+    DATABASES['default'].update({'NAME': SQLITE_PATH, 'OPTIONS': {}})
+
+    if os.getenv('SQLITE_READ_ONLY', '1') == '1':
+        # Overrides the path sqlite3.connect() receives, NAME stays the plain path.
+        DATABASES['default']['OPTIONS']['database'] = f"file:{SQLITE_PATH}?mode=ro"
+
+    SQLITE_PRAGMAS = {
+        'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': -int(os.getenv('SQLITE_CACHE_KIB', 64 * 1024)),
+        'temp_store': 'MEMORY',
+    }
+
+    # Copy the catalogue into memory in every worker, see api.replica.
+    API_MEMORY_REPLICA = os.getenv('SQLITE_MEMORY_REPLICA') == '1'
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -75,13 +76,75 @@ WSGI_APPLICATION = 'gutenberg_api.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default. Setting POSTGRES_DB switches to PostgreSQL, configured by
+# POSTGRES_HOST, POSTGRES_PORT, POSTGRES_USER and POSTGRES_PASSWORD.
+if os.getenv('POSTGRES_DB'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB'),
+            'HOST': os.getenv('POSTGRES_HOST') or 'localhost',
+            'PORT': os.getenv('POSTGRES_PORT') or '5432',
+            'USER': os.getenv('POSTGRES_USER') or 'postgres',
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD') or '',
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
+
+DATABASE_ROUTERS = ['api.replica.ReplicaRouter']
+
+# PRAGMA statements run on every new SQLite connection, e.g. {'cache_size': -65536}.
+SQLITE_PRAGMAS = {}
+
+
+# Caches
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'api-responses',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
 }
 
+# Cache used for API responses. None disables response caching.
+API_RESPONSE_CACHE = 'api'
+
+# Seconds a process trusts its copy of the catalogue version.
+CATALOGUE_VERSION_TTL = 5
+
+# Serve books from the JSON documents pre-rendered by load_db.
+API_BOOK_DOCUMENTS = True
+
+# Serve the hot list endpoints with the values() based serializers.
+API_FAST_SERIALIZERS = True
+
+# Answer the relation filters of the book list from an in-memory bitmap index.
+# Every process keeps its own copy of the index.
+API_BITMAP_FILTERS = False
+
+# Serve the reads of every process from an in-memory copy of the SQLite database.
+API_MEMORY_REPLICA = False
+
+# Threads running the database queries of the /api/async/ views.
+API_ASYNC_DB_THREADS = 8
+
+# Most ids one request to /api/book/bulk/ can look up.
+API_BULK_MAX_IDS = 1000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -128,6 +191,6 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
     'PAGE_SIZE': 10,
 }
@@ -1,3 +1,22 @@
 from django.test import TestCase
 
-# Create your tests here.
+from api import catalogue, stats
+from api.tests import create_catalogue
+
+
+class IndexTests(TestCase):
+
+    def setUp(self):
+        catalogue.invalidate()
+        stats.invalidate()
+
+    def test_counts_come_from_stored_stats(self):
+        create_catalogue(2)
+        stats.update_stats()
+        catalogue.bump_version()
+
+        self.client.get("/")
+        with self.assertNumQueries(0):
+            response = self.client.get("/")
+        self.assertEqual(response.context["books"], 2)
+        self.assertEqual(response.context["resources"], 4)
@@ -3,7 +3,7 @@ from django.http import HttpResponse
 from django.template import loader
 from django.conf import settings
 
-from api import models
+from api.stats import get_stats
 import os
 
 
@@ -29,13 +29,14 @@ def index(request):
     The Homepage
     """
     template = loader.get_template('main/index.html')
+    counts = get_stats()["counts"]
     context = {
-        "books": models.Book.objects.all().count(),
-        "creators": models.Person.objects.all().count(),
-        "bookshelves": models.Bookshelf.objects.all().count(),
-        "subjects": models.Subject.objects.all().count(),
-        "resources": models.Resource.objects.all().count(),
-        "languages": models.Language.objects.all().count(),
+        "books": counts["books"],
+        "creators": counts["people"],
+        "bookshelves": counts["bookshelves"],
+        "subjects": counts["subjects"],
+        "resources": counts["resources"],
+        "languages": counts["languages"],
     }
     return HttpResponse(template.render(context, request))
 
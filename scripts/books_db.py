@@ -3,31 +3,75 @@
 import sqlite3
 import os
 import json
+import time
 import argparse
 
 import rdf_parser
+import rdf_xml
 
 
 class BookDB:
-
-    def __init__(self, path):
+    """
+    Builds the SQLite catalogue.
+
+    The ids of the subjects, bookshelves, people, agents and resources are cached in memory,
+    so each of them is only inserted (and looked up) once. The rows of the book and junction
+    tables are buffered and written with executemany every `batch_size` rows.
+    The unique indexes are created after the data is loaded.
+    """
+
+    JUNCTION_TABLES = {
+        "Book_Resource": "INSERT OR REPLACE INTO Book_Resource (book, resource) VALUES (?, ?)",
+        "Book_Agent": "INSERT OR REPLACE INTO Book_Agent (book, agent) VALUES (?, ?)",
+        "Book_Bookshelf": "INSERT OR REPLACE INTO Book_Bookshelf (book, bookshelf) VALUES (?, ?)",
+        "Book_Subject": "INSERT OR REPLACE INTO Book_Subject (book, subject) VALUES (?, ?)",
+        "Book_Language": "INSERT OR REPLACE INTO Book_Language (book, language) VALUES (?, ?)",
+    }
+
+    def __init__(self, path, batch_size=10000):
         self.path = path
+        self.batch_size = batch_size
         self.connection = None
         self.cursor = None
 
+        self.resources = {}
+        self.people = {}
+        self.agents = {}
+        self.bookshelves = {}
+        self.subjects = {}
+        self.agent_types = set()
+        self.languages = set()
+
+        self.pending_books = []
+        self.pending = {table: [] for table in self.JUNCTION_TABLES}
+        self.rows = 0
+
     def open(self):
         self.connection = sqlite3.connect(self.path)
         self.cursor = self.connection.cursor()
+        # The database is rebuilt from scratch if anything goes wrong, so durability is not needed.
+        self.cursor.executescript('''
+        PRAGMA journal_mode = MEMORY;
+        PRAGMA synchronous = OFF;
+        PRAGMA temp_store = MEMORY;
+        PRAGMA cache_size = -200000;
+        ''')
         return self
 
     def close(self):
+        self.cursor.execute("PRAGMA journal_mode = DELETE")
         self.connection.close()
 
     def __enter__(self):
         return self.open()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.connection.commit()
+        if exc_type is None:
+            self.flush()
+            self.create_indexes()
+            self.connection.commit()
+        else:
+            self.connection.rollback()
         self.close()
 
     def create_tables(self):
@@ -51,8 +95,7 @@ class BookDB:
             alias TEXT,
             birth_date TEXT,
             death_date TEXT,
-            webpage TEXT,
-            UNIQUE(name, alias, birth_date, death_date, webpage)
+            webpage TEXT
         );
 
         CREATE TABLE IF NOT EXISTS Agent (
@@ -60,18 +103,17 @@ class BookDB:
             person INTEGER,
             type TEXT,
             FOREIGN KEY (person) REFERENCES Person(id),
-            FOREIGN KEY (type) REFERENCES AgentType(name),
-            UNIQUE(person, type)
+            FOREIGN KEY (type) REFERENCES AgentType(name)
         );
-        
+
         CREATE TABLE IF NOT EXISTS Bookshelf (
             id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            name TEXT UNIQUE
+            name TEXT
         );
 
         CREATE TABLE IF NOT EXISTS Subject (
             id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            name TEXT UNIQUE
+            name TEXT
         );
 
         CREATE TABLE IF NOT EXISTS Language (
@@ -80,7 +122,7 @@ class BookDB:
 
         CREATE TABLE IF NOT EXISTS Resource (
             id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-            url TEXT UNIQUE,
+            url TEXT,
             size INTEGER,
             modified TEXT,
             type TEXT
@@ -129,113 +171,147 @@ class BookDB:
             PRIMARY KEY (book, bookshelf)
         );''')
 
+        self.load_caches()
+
+    def create_indexes(self):
+        """Creates the unique indexes. Deferred until the data is loaded as that is much faster."""
+        self.cursor.executescript('''
+        CREATE UNIQUE INDEX IF NOT EXISTS Person_unique ON Person (name, alias, birth_date, death_date, webpage);
+        CREATE UNIQUE INDEX IF NOT EXISTS Agent_unique ON Agent (person, type);
+        CREATE UNIQUE INDEX IF NOT EXISTS Bookshelf_unique ON Bookshelf (name);
+        CREATE UNIQUE INDEX IF NOT EXISTS Subject_unique ON Subject (name);
+        CREATE UNIQUE INDEX IF NOT EXISTS Resource_unique ON Resource (url);
+        ''')
+
+    def load_caches(self):
+        """Fills the id caches from an existing database, so that books can be added to it."""
+        for id, url in self.cursor.execute("SELECT id, url FROM Resource ORDER BY id"):
+            self.resources.setdefault(url, id)
+        for id, *person in self.cursor.execute(
+                "SELECT id, name, alias, birth_date, death_date, webpage FROM Person ORDER BY id"):
+            self.people.setdefault(tuple(person), id)
+        for id, person, type in self.cursor.execute("SELECT id, person, type FROM Agent ORDER BY id"):
+            self.agents.setdefault((person, type), id)
+        for id, name in self.cursor.execute("SELECT id, name FROM Bookshelf ORDER BY id"):
+            self.bookshelves.setdefault(name, id)
+        for id, name in self.cursor.execute("SELECT id, name FROM Subject ORDER BY id"):
+            self.subjects.setdefault(name, id)
+        self.agent_types.update(name for name, in self.cursor.execute("SELECT name FROM AgentType"))
+        self.languages.update(name for name, in self.cursor.execute("SELECT name FROM Language"))
+
+    def insert_id(self, cache, key, sql, params):
+        """Returns the id of a cached row, inserting the row on a cache miss."""
+        id = cache.get(key)
+        if id is None:
+            self.cursor.execute(sql, params)
+            id = cache[key] = self.cursor.lastrowid
+            self.rows += 1
+        return id
+
     def insert_book(self, book):
-        self.cursor.execute("""
-        INSERT OR REPLACE INTO Book (id, format, title, description, license, downloads) VALUES (?, ?, ?, ?, ?, ?)
-        """, (book["id"], book["format"], book["title"], book["description"], book["license"], int(book["downloads"])))
-        book_row_id = self.cursor.lastrowid
+        book_row_id = book["id"]
+        self.pending_books.append(
+            (book["id"], book["format"], book["title"], book["description"], book["license"], int(book["downloads"])))
 
         for resource in book['resources']:
-            self.cursor.execute("""
-            INSERT OR IGNORE INTO Resource (url, size, modified, type) VALUES (?, ?, ?, ?)
+            resource_id = self.insert_id(self.resources, resource["url"], """
+            INSERT INTO Resource (url, size, modified, type) VALUES (?, ?, ?, ?)
             """, (resource["url"], resource["size"], resource["modified"], resource["type"]))
-            self.cursor.execute("""
-            SELECT id FROM Resource 
-            WHERE
-            url is ? 
-            """, (resource["url"],))
-            resource_id = self.cursor.fetchone()[0]
-
-            self.cursor.execute("""
-            INSERT OR REPLACE INTO Book_Resource (book, resource) VALUES (?, ?)
-            """, (book_row_id, resource_id))
+            self.pending["Book_Resource"].append((book_row_id, resource_id))
 
         for agent_type, agents in book["agents"].items():
-            self.cursor.execute("""
-            INSERT OR REPLACE INTO AgentType (name) VALUES (?)
-            """, (agent_type,))
+            if agent_type not in self.agent_types:
+                self.cursor.execute("""
+                INSERT OR REPLACE INTO AgentType (name) VALUES (?)
+                """, (agent_type,))
+                self.agent_types.add(agent_type)
+                self.rows += 1
 
             for agent in agents:
-                self.cursor.execute("""
-                INSERT OR IGNORE INTO Person (name, alias, birth_date, death_date, webpage) VALUES (?, ?, ?, ?, ?)
-                """, (agent["name"], agent["alias"], agent["birth_date"], agent["death_date"], agent["webpage"]))
-                self.cursor.execute("""
-                SELECT id from Person
-                WHERE 
-                name is ? AND alias is ? AND birth_date is ? AND death_date is ? AND webpage is ?
-                """, (agent["name"], agent["alias"], agent["birth_date"], agent["death_date"], agent["webpage"]))
-                person_id = self.cursor.fetchone()[0]
+                person = (agent["name"], agent["alias"], agent["birth_date"], agent["death_date"], agent["webpage"])
+                person_id = self.insert_id(self.people, person, """
+                INSERT INTO Person (name, alias, birth_date, death_date, webpage) VALUES (?, ?, ?, ?, ?)
+                """, person)
 
-                self.cursor.execute("""
-                INSERT OR IGNORE INTO Agent (person, type) VALUES (?, ?)
+                agent_id = self.insert_id(self.agents, (person_id, agent_type), """
+                INSERT INTO Agent (person, type) VALUES (?, ?)
                 """, (person_id, agent_type))
-                self.cursor.execute("""
-                SELECT id from Agent
-                WHERE 
-                person is ? AND type is ?
-                """, (person_id, agent_type))
-                agent_id = self.cursor.fetchone()[0]
-
-                self.cursor.execute("""
-                INSERT OR REPLACE INTO Book_Agent (book, agent) VALUES (?, ?)
-                """, (book_row_id, agent_id))
+                self.pending["Book_Agent"].append((book_row_id, agent_id))
 
         for bookshelf in book["bookshelves"]:
-            self.cursor.execute("""
-            INSERT OR IGNORE INTO Bookshelf (name) VALUES (?)
-            """, (bookshelf,))
-            self.cursor.execute("""
-            SELECT id FROM Bookshelf 
-            where name is ?
+            bookshelf_id = self.insert_id(self.bookshelves, bookshelf, """
+            INSERT INTO Bookshelf (name) VALUES (?)
             """, (bookshelf,))
-            bookshelf_id = self.cursor.fetchone()[0]
-
-            self.cursor.execute("""
-            INSERT OR REPLACE INTO Book_Bookshelf (book, bookshelf) VALUES (?, ?)
-            """, (book_row_id, bookshelf_id))
+            self.pending["Book_Bookshelf"].append((book_row_id, bookshelf_id))
 
         for subject in book["subjects"]:
-            self.cursor.execute("""
-            INSERT OR IGNORE INTO Subject (name) VALUES (?)
-            """, (subject,))
-            self.cursor.execute("""
-            SELECT id FROM Subject
-            WHERE name is ?
+            subject_id = self.insert_id(self.subjects, subject, """
+            INSERT INTO Subject (name) VALUES (?)
             """, (subject,))
-            subject_id = self.cursor.fetchone()[0]
-
-            self.cursor.execute("""
-            INSERT OR REPLACE INTO Book_Subject (book, subject) VALUES (?, ?)
-            """, (book_row_id, subject_id))
+            self.pending["Book_Subject"].append((book_row_id, subject_id))
 
         for lang in book["languages"]:
-            self.cursor.execute("""
-            INSERT OR REPLACE INTO Language (name) VALUES (?)
-            """, (lang,))
+            if lang not in self.languages:
+                self.cursor.execute("""
+                INSERT OR REPLACE INTO Language (name) VALUES (?)
+                """, (lang,))
+                self.languages.add(lang)
+                self.rows += 1
+            self.pending["Book_Language"].append((book_row_id, lang))
+
+        if len(self.pending_books) + sum(map(len, self.pending.values())) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered book and junction table rows."""
+        self.cursor.executemany("""
+        INSERT OR REPLACE INTO Book (id, format, title, description, license, downloads) VALUES (?, ?, ?, ?, ?, ?)
+        """, self.pending_books)
+        self.rows += len(self.pending_books)
+        self.pending_books.clear()
+
+        for table, sql in self.JUNCTION_TABLES.items():
+            self.cursor.executemany(sql, self.pending[table])
+            self.rows += len(self.pending[table])
+            self.pending[table].clear()
+
+
+def iter_books(args):
+    if args.catalogue:
+        yield from rdf_xml.iter_books(args.catalogue)
+        return
 
-            self.cursor.execute("""
-            INSERT OR REPLACE INTO Book_Language (book, language) VALUES (?, ?)
-            """, (book_row_id, lang))
+    for path, _, filenames in os.walk(args.input_rdf):
+        for _ in filenames:
+            id = int(os.path.basename(path))
+
+            # Prefer the json formats due to speed.
+            if os.path.exists(os.path.join(args.input_json, f"{id}.json")):
+                with open(os.path.join(args.input_json, f"{id}.json")) as f:
+                    yield json.load(f)
+            else:
+                yield rdf_parser.Book.parse(
+                    id, str(os.path.join(args.input_rdf, f"{id}/pg{id}.rdf")), args.backend)
 
 
 def main(args):
-    with BookDB(args.output) as book_db:
+    start = last_report = time.monotonic()
+    books = 0
+    with BookDB(args.output, args.batch_size) as book_db:
         book_db.create_tables()
-        for path, _, filenames in os.walk(args.input_rdf):
-            for _ in filenames:
-                id = int(os.path.basename(path))
-                book = {}
+        for book in iter_books(args):
+            book_db.insert_book(book)
+            books += 1
 
-                # Prefer the json formats due to speed.
-                if os.path.exists(os.path.join(args.input_json, f"{id}.json")):
-                    with open(os.path.join(args.input_json, f"{id}.json")) as f:
-                        book = json.load(f)
-                else:
-                    book = rdf_parser.Book.parse(
-                        id, str(os.path.join(args.input_rdf, f"{id}/pg{id}.rdf")))
+            now = time.monotonic()
+            if now - last_report >= 5:
+                last_report = now
+                print(f"Inserted {books} books ({books / (now - start):.0f} books/s, "
+                      f"{book_db.rows / (now - start):.0f} rows/s)")
 
-                book_db.insert_book(book)
-                print(f'Inserted book: {book["id"]}')
+    elapsed = time.monotonic() - start
+    print(f"Inserted {books} books, {book_db.rows} rows in {elapsed:.1f}s "
+          f"({book_db.rows / elapsed if elapsed else 0:.0f} rows/s)")
 
 
 if __name__ == '__main__':
@@ -248,4 +324,11 @@ if __name__ == '__main__':
         "-j", "--input_json", help="The directory that contains the converted JSON files. (Use this for faster generation.)", default="res/json")
     parser.add_argument(
         "-o", "--output", help="The output database path", default="books.sqlite3")
+    parser.add_argument(
+        "-c", "--catalogue", help="Read every book from the single file RDF catalogue instead. (Uses the xml backend.)")
+    parser.add_argument(
+        "-b", "--backend", choices=("rdflib", "xml"), default="rdflib",
+        help="The parser used for RDF files. xml is a much faster streaming parser for the catalogue vocabulary.")
+    parser.add_argument(
+        "--batch-size", type=int, default=10000, help="Number of rows written per executemany batch.")
     main(parser.parse_args())
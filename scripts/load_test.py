@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A mix of cheap lookups and slower deep filters.
+DEFAULT_PATHS = (
+    "/api/book/",
+    "/api/book/?languages=en",
+    "/api/book/?has_bookshelf=Best Books Ever Listings",
+    "/api/book/1342/",
+    "/api/person/?ordering=-birth_date",
+    "/api/book/?agent_name_contains=an&has_resource_type=text/plain&ordering=title",
+    "/api/book/?description_contains=the&agent_birth_date_range_min=1800",
+)
+
+# How each mode is served: the gunicorn worker class, the application and whether the paths go to /api/async/.
+MODES = {
+    "wsgi": ("sync", "gutenberg_api.wsgi", False),
+    "asgi": ("uvicorn.workers.UvicornWorker", "gutenberg_api.asgi", False),
+    "async": ("uvicorn.workers.UvicornWorker", "gutenberg_api.asgi", True),
+}
+
+
+def run_client(args):
+    """Requests the paths in a loop on one keep-alive connection until the deadline."""
+    host, port, paths, deadline = args
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    latencies, errors = [], 0
+    i = 0
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)].replace(" ", "%20")
+        i += 1
+        start = time.monotonic()
+        try:
+            connection.request("GET", path, headers={"Accept": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+            if response.will_close:
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            continue
+        latencies.append(time.monotonic() - start)
+    connection.close()
+    return latencies, errors
+
+
+def wait_until_ready(host, port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=1)
+            connection.request("GET", "/api/")
+            connection.getresponse().read()
+            connection.close()
+            return
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    raise RuntimeError(f"The server at {host}:{port} did not start")
+
+
+def async_path(path):
+    """Returns the /api/async/ variant of a list or detail path."""
+    if path.startswith("/api/") and not path.startswith("/api/stats/"):
+        return "/api/async/" + path[len("/api/"):]
+    return path
+
+
+def start_server(workers, port, settings, worker_class, application, cache):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PORT=str(port), DJANGO_SETTINGS_MODULE=settings,
+               GUNICORN_WORKER_CLASS=worker_class)
+    env.setdefault("SECRET_KEY", "load-test")
+    env.setdefault("ALLOWED_HOSTS", "127.0.0.1;localhost")
+    if not cache:
+        env["API_CACHE_BACKEND"] = "django.core.cache.backends.dummy.DummyCache"
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "python:gutenberg_api.gunicorn", application],
+        cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def measure(host, port, paths, concurrency, duration, warmup):
+    # One pass over the paths, so the first measured requests do not pay for the cold caches.
+    run_client((host, port, paths, time.monotonic() + warmup))
+
+    deadline = time.monotonic() + duration
+    with multiprocessing.Pool(concurrency) as pool:
+        results = pool.map(run_client, [(host, port, paths, deadline)] * concurrency)
+
+    latencies = sorted(latency for client, _ in results for latency in client)
+    errors = sum(errors for _, errors in results)
+    return latencies, errors
+
+
+def percentile(latencies, fraction):
+    """Returns a percentile of sorted latencies in milliseconds."""
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000
+
+
+def report(mode, workers, latencies, errors, duration):
+    requests = len(latencies)
+    print(f"{mode:>6} {workers:>8} {requests:>9} {requests / duration:>10.1f} "
+          f"{percentile(latencies, 0.5):>8.2f} {percentile(latencies, 0.99):>8.2f} {errors:>7}", flush=True)
+
+
+def main(args):
+    paths = args.path or DEFAULT_PATHS
+    print(f"{'mode':>6} {'workers':>8} {'requests':>9} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+
+    if args.target:
+        url = urlsplit(args.target)
+        latencies, errors = measure(
+            url.hostname, url.port or 80, paths, args.concurrency or 4, args.duration, args.warmup)
+        report("-", "-", latencies, errors, args.duration)
+        return
+
+    for mode in args.mode:
+        worker_class, application, use_async = MODES[mode]
+        mode_paths = [async_path(path) for path in paths] if use_async else paths
+        for workers in args.workers:
+            server = start_server(workers, args.port, args.settings, worker_class, application, args.cache)
+            try:
+                wait_until_ready("127.0.0.1", args.port)
+                concurrency = args.concurrency or 2 * workers
+                latencies, errors = measure(
+                    "127.0.0.1", args.port, mode_paths, concurrency, args.duration, args.warmup)
+                report(mode, workers, latencies, errors, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Measure the requests per second and latency of the API served by gunicorn "
+                    "with an increasing number of workers.")
+    parser.add_argument(
+        "-w", "--workers", type=lambda value: [int(n) for n in value.split(",")], default=[1, 2, 4],
+        help="Comma separated worker counts to measure, e.g. 1,2,4")
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=0,
+        help="Number of client processes. Twice the number of workers by default.")
+    parser.add_argument(
+        "-d", "--duration", type=float, default=10.0, help="Seconds measured per worker count.")
+    parser.add_argument(
+        "--warmup", type=float, default=2.0, help="Seconds of requests sent before measuring.")
+    parser.add_argument(
+        "-p", "--path", action="append", help="Path to request. Can be repeated. A mix of endpoints by default.")
+    parser.add_argument(
+        "-m", "--mode", type=lambda value: value.split(","), default=["wsgi"],
+        help="Comma separated serving modes to compare: wsgi (sync workers), asgi (uvicorn workers) "
+             "and async (uvicorn workers serving /api/async/).")
+    parser.add_argument(
+        "--no-cache", dest="cache", action="store_false",
+        help="Turn the API response cache off, so every request runs its queries.")
+    parser.add_argument(
+        "--port", type=int, default=8765, help="Port the measured servers listen on.")
+    parser.add_argument(
+        "--settings", default="gutenberg_api.production", help="The Django settings module of the servers.")
+    parser.add_argument(
+        "-t", "--target",
+        help="Measure an already running server at this URL (e.g. http://localhost:8000) instead of starting gunicorn.")
+    main(parser.parse_args())
@@ -1,9 +1,16 @@
 #!/usr/bin/env python3
 
 import rdflib
+import rdf_xml
 import os
 import json
+import time
+import hashlib
+import logging
 import argparse
+import multiprocessing
+
+logger = logging.getLogger("rdf_parser")
 
 def xstr(s):
     return None if s is None else str(s)
@@ -114,32 +121,139 @@ class Book:
         return book
 
     @staticmethod
-    def parse(id, input_file):
+    def parse(id, input_file, backend="rdflib"):
+        """
+        Parses the book with the given id from an RDF file.
+
+        backend is either "rdflib", or "xml" for the faster streaming parser in rdf_xml.
+        """
+        if backend == "xml":
+            return rdf_xml.parse(id, input_file)
         graph = rdflib.Graph().parse(input_file)
         return Book.parse_book(graph, id)
 
     @staticmethod
-    def convert_to_json(id, input_file, output_file):
-        if not os.path.exists(output_file):
-            book = Book.parse(id, input_file)
+    def convert_to_json(id, input_file, output_file, overwrite=False, backend="rdflib"):
+        if overwrite or not os.path.exists(output_file):
+            book = Book.parse(id, input_file, backend)
             os.makedirs(os.path.dirname(output_file), exist_ok=True)
             with open(output_file, "w", newline="\n") as f:
                 json.dump(book, f)
+            return True
+        return False
 
 
-def main(args):
+MANIFEST_NAME = ".manifest.json"
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def convert_task(task):
+    """
+    Converts a single RDF file. Runs inside the worker processes.
+
+    Returns (input_file, manifest_entry, status, error) where status is one of
+    "converted", "unchanged", "skipped" or "error".
+    """
+    id, input_file, output_file, stat, previous_hash, backend = task
+    try:
+        digest = file_hash(input_file) if stat is not None else None
+        if digest is not None and digest == previous_hash and os.path.exists(output_file):
+            return input_file, stat + [digest], "unchanged", None
+        converted = Book.convert_to_json(
+            id, input_file, output_file, overwrite=stat is not None, backend=backend)
+        entry = stat + [digest] if stat is not None else None
+        return input_file, entry, "converted" if converted else "skipped", None
+    except Exception as e:
+        return input_file, None, "error", f"{type(e).__name__}: {e}"
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def iter_tasks(args, manifest, stats):
+    """
+    Yields the conversion tasks for every RDF file under args.input.
+
+    In incremental mode, files with the same size and mtime as in the manifest are skipped
+    without being read, and the rest are passed on with their previous hash.
+    """
     for path, _, filenames in os.walk(args.input):
         for filename in filenames:
-            if filename.endswith(".rdf"):
-                try:
-                    id = int(os.path.basename(path))
-                    input_file = os.path.join(path, filename)
-                    output_file = os.path.join(args.output, f"{id}.json")
-                    Book.convert_to_json(id, input_file, output_file)
-                    print(f"Converted book: {id}")
-                except ValueError:
-                    print(f"Error: Cannot convert file named '{os.path.basename(path)}' to integer")
-                    continue
+            if not filename.endswith(".rdf"):
+                continue
+            input_file = os.path.join(path, filename)
+            try:
+                id = int(os.path.basename(path))
+            except ValueError:
+                stats["errors"] += 1
+                logger.error("Cannot convert file named '%s' to integer", os.path.basename(path))
+                continue
+
+            output_file = os.path.join(args.output, f"{id}.json")
+            if not args.incremental:
+                yield id, input_file, output_file, None, None, args.backend
+                continue
+
+            st = os.stat(input_file)
+            stat = [st.st_mtime_ns, st.st_size]
+            entry = manifest.get(input_file)
+            if entry is not None and entry[:2] == stat and os.path.exists(output_file):
+                stats["skipped"] += 1
+                continue
+            yield id, input_file, output_file, stat, entry[2] if entry else None, args.backend
+
+
+def main(args):
+    manifest_path = os.path.join(args.output, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path) if args.incremental else {}
+    stats = {"converted": 0, "unchanged": 0, "skipped": 0, "errors": 0}
+
+    tasks = iter_tasks(args, manifest, stats)
+    jobs = args.jobs or os.cpu_count()
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    results = pool.imap_unordered(convert_task, tasks, chunksize=args.chunksize) if pool \
+        else map(convert_task, tasks)
+
+    start = last_report = time.monotonic()
+    done = 0
+    try:
+        for input_file, entry, status, error in results:
+            done += 1
+            if status == "error":
+                stats["errors"] += 1
+                logger.error("%s: %s", input_file, error)
+            else:
+                stats[status] += 1
+                if entry is not None:
+                    manifest[input_file] = entry
+
+            now = time.monotonic()
+            if now - last_report >= args.progress_interval:
+                last_report = now
+                logger.info("Processed %d files (%.1f files/s), %d errors",
+                            done, done / (now - start), stats["errors"])
+    finally:
+        if pool:
+            pool.terminate()
+        if args.incremental:
+            os.makedirs(args.output, exist_ok=True)
+            with open(manifest_path, "w", newline="\n") as f:
+                json.dump(manifest, f)
+
+    elapsed = time.monotonic() - start
+    logger.info("Done in %.1fs (%.1f files/s): %d converted, %d unchanged, %d skipped, %d errors",
+                elapsed, done / elapsed if elapsed else 0, stats["converted"], stats["unchanged"],
+                stats["skipped"], stats["errors"])
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -149,4 +263,21 @@ if __name__ == '__main__':
                         default="res/rdf")
     parser.add_argument(
         "-o", "--output", help="The output JSON directory", default="res/json")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="Number of worker processes. 0 uses every CPU.")
+    parser.add_argument(
+        "--chunksize", type=int, default=64,
+        help="Number of files handed to a worker at a time.")
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Reconvert files whose content changed since the last incremental run, "
+             "and skip the rest. Otherwise existing JSON files are never overwritten.")
+    parser.add_argument(
+        "--backend", choices=("rdflib", "xml"), default="rdflib",
+        help="The RDF parser. xml is a much faster streaming parser for the catalogue vocabulary.")
+    parser.add_argument(
+        "--progress-interval", type=float, default=5.0,
+        help="Seconds between progress reports.")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
     main(parser.parse_args())
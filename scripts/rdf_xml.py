@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""
+Streaming RDF/XML parser for the Project Gutenberg catalogue.
+
+Reads the catalogue with ElementTree.iterparse instead of building an rdflib graph.
+It only understands the vocabulary used by the catalogue (pgterms, dcterms, marcrel),
+and produces the same dictionaries as rdf_parser.Book.parse_book.
+
+Each ebook is discarded as soon as it is converted, so the single file catalogue
+can be parsed with bounded memory.
+"""
+
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin
+
+RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+DC_TERMS = "http://purl.org/dc/terms/"
+PG_TERMS = "http://www.gutenberg.org/2009/pgterms/"
+MARCREL = "http://id.loc.gov/vocabulary/relators/"
+XML_BASE = "{http://www.w3.org/XML/1998/namespace}base"
+DEFAULT_BASE = "http://www.gutenberg.org/"
+
+ABOUT = f"{{{RDF}}}about"
+RESOURCE = f"{{{RDF}}}resource"
+VALUE = f"{{{RDF}}}value"
+DESCRIPTION = f"{{{RDF}}}Description"
+EBOOK = f"{{{PG_TERMS}}}ebook"
+AGENT = f"{{{PG_TERMS}}}agent"
+
+AGENT_TYPES = {
+    "ann": "Annotator",
+    "cmm": "Commentator",
+    "cmp": "Composer",
+    "com": "Compiler",
+    "ctb": "Contributor",
+    "edt": "Editor",
+    "ill": "Illustrator",
+    "oth": "Other",
+    "pht": "Photographer",
+    "trl": "Translator",
+}
+
+
+def dc(name):
+    return f"{{{DC_TERMS}}}{name}"
+
+
+def pg(name):
+    return f"{{{PG_TERMS}}}{name}"
+
+
+class Parser:
+    """
+    Converts pgterms:ebook elements into book dictionaries.
+
+    Agents are remembered by their URI, so an agent that is described once and
+    referenced with rdf:resource afterwards (as in the single file catalogue) is resolved.
+    """
+
+    def __init__(self, base=DEFAULT_BASE):
+        self.base = base
+        self.agents = {}
+
+    def uri(self, value):
+        return urljoin(self.base, value)
+
+    def node_value(self, element):
+        """The value of a property element: a literal, a resource, or the rdf:value of a node."""
+        if element is None:
+            return None
+        if RESOURCE in element.attrib:
+            return self.uri(element.attrib[RESOURCE])
+        node = element.find(DESCRIPTION)
+        if node is not None:
+            return self.node_value(node.find(VALUE))
+        return element.text or ""
+
+    def first_value(self, element, tag):
+        return self.node_value(element.find(tag))
+
+    def parse_agent(self, element):
+        about = element.get(ABOUT)
+        agent = {
+            "name": self.first_value(element, pg("name")),
+            "alias": self.first_value(element, pg("alias")),
+            "birth_date": self.first_value(element, pg("birthdate")),
+            "death_date": self.first_value(element, pg("deathdate")),
+            "webpage": self.first_value(element, pg("webpage")),
+        }
+        if about is not None:
+            self.agents[self.uri(about)] = agent
+        return agent
+
+    def agent_value(self, element):
+        """
+        The agent of a dcterms:creator or marcrel property.
+
+        Returns the URI of the agent instead if it has not been described yet.
+        """
+        node = element.find(AGENT)
+        if node is not None:
+            return self.parse_agent(node)
+        uri = self.uri(element.get(RESOURCE, ""))
+        return self.agents.get(uri, uri)
+
+    def parse_ebook(self, element):
+        """Returns the book dictionary of a pgterms:ebook element."""
+        id = int(element.get(ABOUT).rstrip("/").rsplit("/", 1)[-1])
+        book = {"id": id}
+
+        book["format"] = self.first_value(element, dc("type"))
+        book["title"] = self.first_value(element, dc("title"))
+        book["publishers"] = [self.node_value(e) for e in element.iterfind(dc("publisher"))]
+        book["description"] = self.first_value(element, dc("description"))
+        book["downloads"] = self.first_value(element, pg("downloads"))
+        book["license"] = self.first_value(element, dc("license"))
+        book["subjects"] = [self.node_value(e) for e in element.iterfind(dc("subject"))]
+
+        book["resources"] = []
+        for has_format in element.iterfind(dc("hasFormat")):
+            file = has_format.find(pg("file"))
+            if file is None:
+                continue
+            book["resources"].append({
+                "url": self.uri(file.get(ABOUT)),
+                "size": self.first_value(file, dc("extent")),
+                "modified": self.first_value(file, dc("modified")),
+                "type": self.first_value(file, dc("format")),
+            })
+
+        book["languages"] = [self.node_value(e) for e in element.iterfind(dc("language"))]
+        book["bookshelves"] = [self.node_value(e) for e in element.iterfind(pg("bookshelf"))]
+
+        book["agents"] = {"Author": [self.agent_value(e) for e in element.iterfind(dc("creator"))]}
+        for child in element:
+            if child.tag.startswith(f"{{{MARCREL}}}"):
+                code = child.tag[len(MARCREL) + 2:]
+                book["agents"].setdefault(AGENT_TYPES.get(code), []).append(self.agent_value(child))
+
+        return book
+
+    def resolve_agents(self, book):
+        """Replaces agent URIs left by forward references. Unknown agents get empty fields."""
+        for agent_type, agents in book["agents"].items():
+            book["agents"][agent_type] = [
+                self.agents.get(agent, dict.fromkeys(
+                    ("name", "alias", "birth_date", "death_date", "webpage")))
+                if isinstance(agent, str) else agent
+                for agent in agents
+            ]
+        return book
+
+
+def has_unresolved_agents(book):
+    return any(isinstance(agent, str) for agents in book["agents"].values() for agent in agents)
+
+
+def iter_books(source):
+    """
+    Yields the book dictionaries of an RDF/XML file or file object, in document order.
+
+    Works for a single book file as well as for the single file catalogue.
+    Books referencing an agent that is only described later in the file are held back
+    until the end of the file.
+    """
+    parser = None
+    pending = []
+    root = None
+    depth = 0
+
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+                parser = Parser(element.get(XML_BASE, DEFAULT_BASE))
+            depth += 1
+            continue
+
+        depth -= 1
+        # Only the children of rdf:RDF are complete descriptions.
+        if depth != 1:
+            continue
+
+        if element.tag == AGENT:
+            parser.parse_agent(element)
+        elif element.tag == EBOOK:
+            book = parser.parse_ebook(element)
+            if has_unresolved_agents(book):
+                pending.append(book)
+            else:
+                yield book
+        root.clear()
+
+    for book in pending:
+        yield parser.resolve_agents(book)
+
+
+def parse(id, input_file):
+    """Returns the book with the given id from an RDF/XML file, or None if it is not there."""
+    for book in iter_books(input_file):
+        if book["id"] == id:
+            return book
+    return None
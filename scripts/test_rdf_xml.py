@@ -0,0 +1,231 @@
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+
+import rdf_xml
+
+try:
+    import rdf_parser
+except ImportError:
+    rdf_parser = None
+else:
+    import books_db
+
+BOOK_RDF = """<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF xml:base="http://www.gutenberg.org/"
+  xmlns:cc="http://web.resource.org/cc/"
+  xmlns:dcam="http://purl.org/dc/dcam/"
+  xmlns:dcterms="http://purl.org/dc/terms/"
+  xmlns:marcrel="http://id.loc.gov/vocabulary/relators/"
+  xmlns:pgterms="http://www.gutenberg.org/2009/pgterms/"
+  xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+  xmlns:rdfs="http://www.w3.org/2000/01/rdf-schema#"
+>
+  <pgterms:ebook rdf:about="ebooks/84">
+    <dcterms:description>See also Frankenstein</dcterms:description>
+    <dcterms:type>
+      <rdf:Description rdf:nodeID="Nt1">
+        <dcam:memberOf rdf:resource="http://purl.org/dc/terms/DCMIType"/>
+        <rdf:value>Text</rdf:value>
+      </rdf:Description>
+    </dcterms:type>
+    <dcterms:issued rdf:datatype="http://www.w3.org/2001/XMLSchema#date">1993-10-01</dcterms:issued>
+    <dcterms:language>
+      <rdf:Description rdf:nodeID="Nl1">
+        <rdf:value rdf:datatype="http://purl.org/dc/terms/RFC4646">en</rdf:value>
+      </rdf:Description>
+    </dcterms:language>
+    <dcterms:publisher>Project Gutenberg</dcterms:publisher>
+    <dcterms:license rdf:resource="license"/>
+    <pgterms:downloads rdf:datatype="http://www.w3.org/2001/XMLSchema#integer">61539</pgterms:downloads>
+    <dcterms:title>Frankenstein; Or, The Modern Prometheus</dcterms:title>
+    <dcterms:creator>
+      <pgterms:agent rdf:about="2009/agents/61">
+        <pgterms:name>Shelley, Mary Wollstonecraft</pgterms:name>
+        <pgterms:alias>Shelley, Mary</pgterms:alias>
+        <pgterms:birthdate rdf:datatype="http://www.w3.org/2001/XMLSchema#integer">1797</pgterms:birthdate>
+        <pgterms:deathdate rdf:datatype="http://www.w3.org/2001/XMLSchema#integer">1851</pgterms:deathdate>
+        <pgterms:webpage rdf:resource="https://en.wikipedia.org/wiki/Mary_Shelley"/>
+      </pgterms:agent>
+    </dcterms:creator>
+    <marcrel:ill>
+      <pgterms:agent rdf:about="2009/agents/999">
+        <pgterms:name>Someone, Else</pgterms:name>
+      </pgterms:agent>
+    </marcrel:ill>
+    <dcterms:subject>
+      <rdf:Description rdf:nodeID="Ns1">
+        <dcam:memberOf rdf:resource="http://purl.org/dc/terms/LCSH"/>
+        <rdf:value>Science fiction</rdf:value>
+      </rdf:Description>
+    </dcterms:subject>
+    <dcterms:subject>
+      <rdf:Description rdf:nodeID="Ns2">
+        <dcam:memberOf rdf:resource="http://purl.org/dc/terms/LCC"/>
+        <rdf:value>PR</rdf:value>
+      </rdf:Description>
+    </dcterms:subject>
+    <pgterms:bookshelf>
+      <rdf:Description rdf:nodeID="Nb1">
+        <dcam:memberOf rdf:resource="2009/pgterms/Bookshelf"/>
+        <rdf:value>Gothic Fiction</rdf:value>
+      </rdf:Description>
+    </pgterms:bookshelf>
+    <dcterms:hasFormat>
+      <pgterms:file rdf:about="https://www.gutenberg.org/ebooks/84.epub.images">
+        <dcterms:isFormatOf rdf:resource="ebooks/84"/>
+        <dcterms:extent rdf:datatype="http://www.w3.org/2001/XMLSchema#integer">476517</dcterms:extent>
+        <dcterms:modified rdf:datatype="http://www.w3.org/2001/XMLSchema#dateTime">2021-10-01T02:58:13.402149</dcterms:modified>
+        <dcterms:format>
+          <rdf:Description rdf:nodeID="Nf1">
+            <dcam:memberOf rdf:resource="http://purl.org/dc/terms/IMT"/>
+            <rdf:value rdf:datatype="http://purl.org/dc/terms/IMT">application/epub+zip</rdf:value>
+          </rdf:Description>
+        </dcterms:format>
+      </pgterms:file>
+    </dcterms:hasFormat>
+    <dcterms:hasFormat>
+      <pgterms:file rdf:about="https://www.gutenberg.org/files/84/84-0.txt">
+        <dcterms:isFormatOf rdf:resource="ebooks/84"/>
+        <dcterms:extent rdf:datatype="http://www.w3.org/2001/XMLSchema#integer">448937</dcterms:extent>
+        <dcterms:modified rdf:datatype="http://www.w3.org/2001/XMLSchema#dateTime">2021-10-01T02:58:13</dcterms:modified>
+        <dcterms:format>
+          <rdf:Description rdf:nodeID="Nf2">
+            <dcam:memberOf rdf:resource="http://purl.org/dc/terms/IMT"/>
+            <rdf:value rdf:datatype="http://purl.org/dc/terms/IMT">text/plain; charset=utf-8</rdf:value>
+          </rdf:Description>
+        </dcterms:format>
+      </pgterms:file>
+    </dcterms:hasFormat>
+  </pgterms:ebook>
+  <cc:Work rdf:about="">
+    <cc:license rdf:resource="https://creativecommons.org/publicdomain/zero/1.0/"/>
+  </cc:Work>
+</rdf:RDF>"""
+
+HEADER = """<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF xml:base="http://www.gutenberg.org/"
+  xmlns:dcterms="http://purl.org/dc/terms/"
+  xmlns:marcrel="http://id.loc.gov/vocabulary/relators/"
+  xmlns:pgterms="http://www.gutenberg.org/2009/pgterms/"
+  xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+>"""
+
+CATALOGUE_RDF = HEADER + """
+  <pgterms:ebook rdf:about="ebooks/1">
+    <dcterms:title>First</dcterms:title>
+    <dcterms:creator>
+      <pgterms:agent rdf:about="2009/agents/7">
+        <pgterms:name>Doe, Jane</pgterms:name>
+      </pgterms:agent>
+    </dcterms:creator>
+  </pgterms:ebook>
+  <pgterms:ebook rdf:about="ebooks/2">
+    <dcterms:title>Second</dcterms:title>
+    <dcterms:creator rdf:resource="2009/agents/7"/>
+    <marcrel:trl rdf:resource="2009/agents/8"/>
+  </pgterms:ebook>
+  <pgterms:ebook rdf:about="ebooks/3">
+    <dcterms:title>Third</dcterms:title>
+    <marcrel:edt rdf:resource="2009/agents/7"/>
+  </pgterms:ebook>
+  <pgterms:agent rdf:about="2009/agents/8">
+    <pgterms:name>Roe, Richard</pgterms:name>
+    <pgterms:birthdate>1900</pgterms:birthdate>
+  </pgterms:agent>
+</rdf:RDF>
+"""
+
+
+def normalize(book):
+    """rdflib returns the values of a property in no particular order."""
+    book = dict(book)
+    for key in ("publishers", "subjects", "languages", "bookshelves"):
+        book[key] = sorted(book[key])
+    book["resources"] = sorted(book["resources"], key=lambda resource: resource["url"])
+    book["agents"] = {
+        agent_type: sorted(agents, key=lambda agent: agent["name"])
+        for agent_type, agents in book["agents"].items()
+    }
+    return book
+
+
+class StreamingParserTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.book_file = os.path.join(directory.name, "pg84.rdf")
+        with open(self.book_file, "w", encoding="utf-8") as f:
+            f.write(BOOK_RDF)
+
+    @unittest.skipIf(rdf_parser is None, "rdflib is not installed")
+    def test_same_output_as_rdflib(self):
+        expected = rdf_parser.Book.parse(84, self.book_file)
+        actual = rdf_parser.Book.parse(84, self.book_file, backend="xml")
+        self.assertEqual(normalize(actual), normalize(expected))
+        self.assertEqual(list(actual), list(expected))
+
+    @unittest.skipIf(rdf_parser is None, "rdflib is not installed")
+    def test_catalogue_same_output_as_rdflib(self):
+        graph = rdf_parser.rdflib.Graph().parse(data=CATALOGUE_RDF, format="xml")
+        for book in rdf_xml.iter_books(io.BytesIO(CATALOGUE_RDF.encode("utf-8"))):
+            self.assertEqual(normalize(book), normalize(rdf_parser.Book.parse_book(graph, book["id"])))
+
+    def test_book(self):
+        book = rdf_xml.parse(84, self.book_file)
+        self.assertEqual(book["title"], "Frankenstein; Or, The Modern Prometheus")
+        self.assertEqual(book["license"], "http://www.gutenberg.org/license")
+        self.assertEqual(book["downloads"], "61539")
+        self.assertEqual(book["languages"], ["en"])
+        self.assertEqual(book["agents"]["Author"][0]["webpage"], "https://en.wikipedia.org/wiki/Mary_Shelley")
+        self.assertEqual(book["agents"]["Illustrator"][0]["alias"], None)
+        self.assertEqual(book["resources"][1]["type"], "text/plain; charset=utf-8")
+
+    def test_catalogue_resolves_agent_references(self):
+        books = {book["id"]: book for book in rdf_xml.iter_books(io.BytesIO(CATALOGUE_RDF.encode("utf-8")))}
+        self.assertEqual(sorted(books), [1, 2, 3])
+        self.assertEqual(books[2]["agents"]["Author"][0]["name"], "Doe, Jane")
+        self.assertEqual(books[2]["agents"]["Translator"][0]["birth_date"], "1900")
+        self.assertEqual(books[3]["agents"], {"Author": [], "Editor": [books[1]["agents"]["Author"][0]]})
+
+
+@unittest.skipIf(rdf_parser is None, "rdflib is not installed")
+class BookDBTests(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "books.sqlite3")
+        book_file = os.path.join(directory.name, "pg84.rdf")
+        with open(book_file, "w", encoding="utf-8") as f:
+            f.write(BOOK_RDF)
+        self.book = rdf_xml.parse(84, book_file)
+
+    def count_books(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute("SELECT COUNT(*) FROM Book").fetchone()[0]
+        finally:
+            connection.close()
+
+    def test_commit(self):
+        with books_db.BookDB(self.path) as book_db:
+            book_db.create_tables()
+            book_db.insert_book(self.book)
+        self.assertEqual(self.count_books(), 1)
+
+    def test_rollback_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with books_db.BookDB(self.path) as book_db:
+                book_db.create_tables()
+                book_db.insert_book(self.book)
+                book_db.flush()
+                raise RuntimeError
+        self.assertEqual(self.count_books(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()